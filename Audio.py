@@ -0,0 +1,155 @@
+import struct
+
+import numpy as np
+import soundfile
+
+import Globals
+from Globals import OSE_SAMPLE_RATE
+
+# Resampler per quality setting: "fast" is a polyphase filter, "high" librosa's band-limited sinc interpolation
+RESAMPLERS = ('fast', 'high')
+
+
+def load(file, sr=OSE_SAMPLE_RATE, quality=None):
+    """
+    Decode an audio file straight to mono float32 at the given sample rate, with a single resampling step.
+    Uncompressed PCM/float WAV files are memory-mapped instead of read, other formats are decoded with soundfile
+    (or librosa if soundfile can not read them)
+    :param file: Path to the audio file
+    :param sr: The target sample rate
+    :param quality: "fast" or "high", defaults to Globals.RESAMPLE_QUALITY
+    :return: The signal and its sample rate
+    """
+    if quality is None:
+        quality = Globals.RESAMPLE_QUALITY
+    if quality not in RESAMPLERS:
+        raise ValueError("Unknown resampler quality " + str(quality) + ", use one of " + str(RESAMPLERS))
+
+    try:
+        sig, sr_in = read_wav(file)
+    except (ValueError, OSError):
+        try:
+            sig, sr_in = soundfile.read(file, dtype='float32', always_2d=True)
+            sig = sig.mean(axis=1)
+        except RuntimeError:
+            # Format not supported by soundfile (e.g. mp3 with old libsndfile versions)
+            import librosa
+            sig, sr_in = librosa.core.load(file, sr=None, mono=True, dtype=np.float32)
+    return resample(sig, sr_in, sr, quality), sr
+
+
+def read_wav(file):
+    """
+    Memory-map the samples of an uncompressed WAV file and mix them down to mono float32
+    :param file: Path to the WAV file
+    :return: The signal and its sample rate
+    :raises ValueError: If the file is not an uncompressed 16/32 bit PCM or 32 bit float WAV file
+    """
+    data, sr, scale = open_wav(file)
+    return mix_down(data, scale), sr
+
+
+def info(file):
+    """
+    Number of samples and sample rate of an audio file, without decoding it
+    :param file: Path to the audio file
+    :return: The number of samples (per channel) and the sample rate
+    """
+    try:
+        data, sr, _ = open_wav(file)
+        return data.shape[0], sr
+    except (ValueError, OSError):
+        file_info = soundfile.info(file)
+        return file_info.frames, file_info.samplerate
+
+
+def blocks(file, block_size):
+    """
+    Decode an audio file block by block, as mono float32 at its own sample rate (see info), so that only one block
+    is held in memory at a time
+    :param file: Path to the audio file
+    :param block_size: The number of samples per block
+    :return: Generator of consecutive blocks of the signal
+    """
+    try:
+        data, _, scale = open_wav(file)
+    except (ValueError, OSError):
+        for block in soundfile.blocks(file, blocksize=block_size, dtype='float32', always_2d=True):
+            yield block.mean(axis=1)
+        return
+    for start in range(0, data.shape[0], block_size):
+        yield mix_down(data[start:start + block_size], scale)
+
+
+def open_wav(file):
+    """
+    Memory-map the samples of an uncompressed WAV file
+    :param file: Path to the WAV file
+    :return: The samples (frames x channels), the sample rate and the factor that scales integer samples to [-1, 1)
+    (None for float samples)
+    :raises ValueError: If the file is not an uncompressed 16/32 bit PCM or 32 bit float WAV file
+    """
+    with open(file, 'rb') as f:
+        riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave != b'WAVE':
+            raise ValueError("Not a WAV file: " + str(file))
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError("No data chunk in " + str(file))
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                fmt = struct.unpack('<HHIIHH', f.read(16))
+                f.seek(size - 16 + size % 2, 1)
+            elif chunk_id == b'data':
+                offset = f.tell()
+                break
+            else:
+                # Chunks are padded to an even size
+                f.seek(size + size % 2, 1)
+    if fmt is None:
+        raise ValueError("No fmt chunk in " + str(file))
+    audio_format, channels, sr, _, _, bits = fmt
+    # 1: PCM, 3: IEEE float
+    dtypes = {(1, 16): '<i2', (1, 32): '<i4', (3, 32): '<f4'}
+    if (audio_format, bits) not in dtypes:
+        raise ValueError("Unsupported WAV format in " + str(file))
+    dtype = np.dtype(dtypes[(audio_format, bits)])
+    frames = size // (dtype.itemsize * channels)
+    data = np.memmap(file, dtype=dtype, mode='r', offset=offset, shape=(frames, channels))
+    scale = np.float32(1 / 2 ** (bits - 1)) if audio_format == 1 else None
+    return data, sr, scale
+
+
+def mix_down(data, scale):
+    """
+    Mix memory-mapped WAV samples down to mono float32 (without converting the whole file to float64)
+    :param data: The samples (frames x channels)
+    :param scale: The factor that scales integer samples to [-1, 1), None for float samples
+    :return: The mono signal
+    """
+    sig = np.mean(data, axis=1, dtype=np.float32)
+    if scale is not None:
+        sig *= scale
+    return sig
+
+
+def resample(sig, sr_in, sr_out, quality):
+    """
+    Resample a float32 signal
+    :param sig: The signal or a stack of signals (time on the last axis)
+    :param sr_in: Its sample rate
+    :param sr_out: The target sample rate
+    :param quality: "fast" (polyphase filter) or "high" (librosa's default resampler)
+    :return: The resampled float32 signal
+    """
+    if sr_in == sr_out:
+        return sig
+    if quality == 'fast':
+        # scipy.signal takes long to import, so only load it if needed
+        from scipy.signal import resample_poly
+        return resample_poly(sig, sr_out, sr_in, axis=-1).astype(np.float32, copy=False)
+    # librosa takes long to import, so only load it if needed
+    import librosa
+    return librosa.core.resample(sig, sr_in, sr_out).astype(np.float32, copy=False)
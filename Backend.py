@@ -0,0 +1,44 @@
+import importlib.util
+
+import Globals
+
+# Supported values of Globals.BACKEND
+BACKENDS = ('auto', 'numpy', 'numba')
+
+# Module with the compiled kernels, imported on first use as importing numba is slow
+_numba_kernels = None
+
+
+def numba_available():
+    """
+    Check whether Numba is installed without importing it
+    """
+    return importlib.util.find_spec('numba') is not None
+
+
+def use_numba():
+    """
+    Decide at runtime whether the Numba kernels are used, according to Globals.BACKEND:
+    "numpy" never uses them, "numba" always does (and fails if Numba is not installed),
+    "auto" uses them if Numba is installed and falls back to NumPy otherwise
+    """
+    backend = Globals.BACKEND
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend " + str(backend) + ", use one of " + str(BACKENDS))
+    if backend == 'numpy':
+        return False
+    if backend == 'numba' and not numba_available():
+        raise ImportError("Backend 'numba' was selected, but Numba is not installed")
+    return numba_available()
+
+
+def kernels():
+    """
+    The compiled kernels (see NumbaKernels). They are compiled on their first call and cached on disk, so other
+    processes load them instead of compiling them again
+    """
+    global _numba_kernels
+    if _numba_kernels is None:
+        import NumbaKernels
+        _numba_kernels = NumbaKernels
+    return _numba_kernels
@@ -0,0 +1,249 @@
+import numpy as np
+from scipy import sparse
+from scipy.ndimage import maximum_filter1d
+from scipy.signal import find_peaks
+
+import Profiling
+from Globals import OSE_SAMPLE_RATE, FFT_HOP
+
+# Number of onset strength envelope frames per frame of the model (16ms)
+HOP = 4
+# Tempo range of the model in BPM
+MIN_BPM = 60
+MAX_BPM = 230
+# Supported metres (beats per bar)
+METRES = (3, 4)
+# Higher values make tempo changes between beats less likely
+TRANSITION_LAMBDA = 100
+# Tempo changes with a lower probability are left out of the model (with TRANSITION_LAMBDA = 100 these are changes by
+# more than about 14%), so every period is only reached from a narrow band of periods
+TRANSITION_THRESHOLD = 1e-6
+# Ratio of the number of non-beat and beat states the observation model assumes
+OBSERVATION_LAMBDA = 16
+# Length in seconds of the window the accent of an onset is measured in (one 4/4 bar at MIN_BPM, so the window always
+# contains a downbeat)
+ACCENT_WINDOW = 4
+# Peaks with at least this fraction of the strongest activation within ACCENT_WINDOW are onsets for the accent
+ONSET_FLOOR = 0.01
+# Largest accent (log-ratio of an onset to the typical onset) a downbeat can gain or lose
+ACCENT_LIMIT = np.log(4)
+
+
+class BarPointerModel:
+    """
+    Bar-pointer state space: A state is a (metre, beat period, position in the bar) triple. The position advances by
+    one frame per frame, a beat occurs whenever it is a multiple of the beat period and a downbeat when it is 0.
+    The beat period can only change at beats, so only beat states have more than one predecessor, and every other
+    state is reached from the state before it. Beat k of a bar has the same predecessors (the last position before
+    beat k in every period of the metre) whatever its period, so the beat states form one group per metre and beat.
+    The transitions are stored in a sparse matrix with one row per target state, and for the beat states also as a
+    band of log-probabilities around the target period
+    """
+
+    def __init__(self, min_bpm=MIN_BPM, max_bpm=MAX_BPM, metres=METRES):
+        frame_rate = OSE_SAMPLE_RATE / FFT_HOP / HOP
+        self.periods = np.arange(int(np.floor(60 * frame_rate / max_bpm)), int(np.ceil(60 * frame_rate / min_bpm)) + 1)
+
+        # Enumerate the states: One block of metre * period positions per metre and period
+        metre_of_state = []
+        period_of_state = []
+        position_of_state = []
+        offsets = {}
+        offset = 0
+        for metre in metres:
+            for period in self.periods:
+                offsets[(metre, period)] = offset
+                metre_of_state.append(np.full(metre * period, metre))
+                period_of_state.append(np.full(metre * period, period))
+                position_of_state.append(np.arange(metre * period))
+                offset += metre * period
+        self.size = offset
+        self.metre = np.concatenate(metre_of_state)
+        self.period = np.concatenate(period_of_state)
+        self.position = np.concatenate(position_of_state)
+        self.is_beat = self.position % self.period == 0
+        self.is_downbeat = self.position == 0
+
+        # Within a beat the position simply advances
+        advance = np.flatnonzero((self.position + 1) % self.period != 0)
+        targets = [advance + 1]
+        origins = [advance]
+        probabilities = [np.ones(advance.size)]
+
+        # At a beat the period may change: Beat k of the bar in period p' is reached from the last position before
+        # beat k in any period p of the same metre
+        ratio = self.periods[np.newaxis, :] / self.periods[:, np.newaxis]
+        tempo_change = np.exp(-TRANSITION_LAMBDA * np.abs(ratio - 1))
+        tempo_change /= np.sum(tempo_change, axis=1, keepdims=True)
+        tempo_change[tempo_change < TRANSITION_THRESHOLD] = 0
+        # Predecessors (one per period) and beat states (one per period) of every group, i.e. metre and beat
+        group_origins = []
+        group_targets = []
+        for metre in metres:
+            for beat in range(metre):
+                group_origins.append([offsets[(metre, p)] + (beat * p - 1) % (metre * p) for p in self.periods])
+                group_targets.append([offsets[(metre, p)] + beat * p for p in self.periods])
+                for i, origin in enumerate(group_origins[-1]):
+                    possible = np.flatnonzero(tempo_change[i])
+                    targets.append(np.array(group_targets[-1])[possible])
+                    origins.append(np.full(possible.size, origin))
+                    probabilities.append(tempo_change[i, possible])
+        self.group_origins = np.array(group_origins)
+        self.group_targets = np.array(group_targets)
+        self.group_is_downbeat = self.is_downbeat[self.group_targets[:, 0]]
+        # Band of the tempo changes: Entry [i, d] is the log-probability of a change from period i + d - width to
+        # period i (-inf if the change is not possible)
+        origin_period, target_period = np.nonzero(tempo_change)
+        self.width = int(np.max(np.abs(origin_period - target_period)))
+        self.log_tempo_change = np.full((self.periods.size, 2 * self.width + 1), -np.inf)
+        self.log_tempo_change[target_period, origin_period - target_period + self.width] = \
+            np.log(tempo_change[origin_period, target_period])
+
+        transitions = sparse.csr_matrix((np.concatenate(probabilities),
+                                         (np.concatenate(targets), np.concatenate(origins))),
+                                        shape=(self.size, self.size))
+        transitions.sort_indices()
+        self.transitions = transitions
+        self.log_probabilities = np.log(transitions.data)
+
+        # Beat states are reached from the predecessors of their group, the other states exactly from one state: the
+        # state before them
+        in_degree = np.diff(transitions.indptr)
+        self.beat_states = np.flatnonzero(self.is_beat)
+        assert np.all(in_degree[self.group_targets] == np.sum(np.isfinite(self.log_tempo_change), axis=1))
+        assert np.all(in_degree[~self.is_beat] == 1)
+        assert np.all(transitions.indices[transitions.indptr[:-1][~self.is_beat]] == np.flatnonzero(~self.is_beat) - 1)
+
+    def viterbi(self, log_beat, log_non_beat, log_downbeat=None):
+        """
+        Log-domain Viterbi decoding. All states but the beat states have a single predecessor with probability 1,
+        the state before them, so the max-plus product with the transition matrix is a shift of the scores plus a
+        maximum over the predecessors of the beat states only. These are gathered once per group, and every beat state
+        takes the maximum over the band of periods it can be reached from. Back-pointers are only stored for the beat
+        states, so memory is linear in frames x beat states
+        :param log_beat: Log-likelihood of the observation in every frame for beat states
+        :param log_non_beat: Log-likelihood of the observation in every frame for the other states
+        :param log_downbeat: Optional log-likelihood of the observation in every frame for downbeat states, defaults to
+        log_beat
+        :return: The most likely state in every frame and its log-likelihood
+        """
+        if log_downbeat is None:
+            log_downbeat = log_beat
+        frames = log_beat.size
+        back_pointers = np.zeros((frames,) + self.group_targets.shape, dtype=np.int16)
+        # Observation of the beat states of every group relative to the one of the other states
+        beat_observations = (np.where(self.group_is_downbeat, log_downbeat[:, np.newaxis], log_beat[:, np.newaxis])
+                             - log_non_beat[:, np.newaxis])[..., np.newaxis]
+
+        # Scores of the predecessors of every group, padded so that the band of every period is a sliding window
+        origins = np.full((self.group_origins.shape[0], self.periods.size + 2 * self.width), -np.inf)
+        bands = np.lib.stride_tricks.sliding_window_view(origins, 2 * self.width + 1, axis=1)
+        candidates = np.empty(bands.shape)
+        rows = np.arange(candidates.size // candidates.shape[-1])
+
+        # Uniform initial distribution
+        delta = np.full(self.size, -np.log(self.size) + log_non_beat[0])
+        delta[self.group_targets] += beat_observations[0]
+        scores = np.empty(self.size)
+        for t in range(1, frames):
+            # Entry [g, i, d] is the score of reaching the beat of group g in period i from period i + d - width
+            origins[:, self.width:self.width + self.periods.size] = delta[self.group_origins]
+            np.add(bands, self.log_tempo_change, out=candidates)
+            best = np.argmax(candidates, axis=2)
+            back_pointers[t] = best
+            scores[1:] = delta[:-1]
+            scores[self.group_targets] = candidates.reshape(rows.size, -1)[rows, best.ravel()].reshape(best.shape)
+            scores[self.group_targets] += beat_observations[t]
+            scores += log_non_beat[t]
+            delta, scores = scores, delta
+
+        # Backtracking
+        group_of_state = np.full(self.size, -1)
+        group_of_state[self.group_targets] = np.arange(self.group_targets.shape[0])[:, np.newaxis]
+        path = np.zeros(frames, dtype=np.int64)
+        path[-1] = np.argmax(delta)
+        log_likelihood = delta[path[-1]]
+        for t in range(frames - 1, 0, -1):
+            state = path[t]
+            group = group_of_state[state]
+            if group >= 0:
+                period = self.period[state] - self.periods[0]
+                path[t - 1] = self.group_origins[group, period + back_pointers[t, group, period] - self.width]
+            else:
+                path[t - 1] = state - 1
+        return path, log_likelihood
+
+
+_model = None
+
+
+def get_model():
+    """
+    The state space only depends on constants, so it is built once per process
+    """
+    global _model
+    if _model is None:
+        _model = BarPointerModel()
+    return _model
+
+
+@Profiling.profiled('bar_pointer_search')
+def bar_pointer_search(ose):
+    """
+    Joint beat and downbeat tracking with a bar-pointer hidden Markov model over (metre, beat period, position in bar).
+    Beat states are scored by the onset strength, downbeat states also by the accent of the onset
+    :param ose: The onset strength envelope from Ellis-07
+    :return: The indices of beats and downbeats
+    """
+    model = get_model()
+
+    # Reduce the frame rate to 16ms frames, remembering the strongest OSE frame of each model frame
+    frames = ose.size // HOP
+    if frames < 2:
+        return [], []
+    groups = np.asarray(ose[:frames * HOP]).reshape(frames, HOP)
+    strongest = np.argmax(groups, axis=1)
+    pooled = groups[np.arange(frames), strongest]
+
+    # Observation model: Map the envelope to a beat activation between 0 and 1
+    eps = 1e-6
+    activation = np.maximum(pooled, 0)
+    scale = np.percentile(activation, 99)
+    activation = np.clip(activation / scale if scale > 0 else activation, eps, 1 - eps)
+    log_beat = np.log(activation)
+    log_non_beat = np.log((1 - activation) / (OBSERVATION_LAMBDA - 1))
+    # Accent: Downbeats sound different from the other beats, which the onset strength envelope shows as onsets that
+    # are stronger (e.g. a louder hit) or weaker (e.g. a click with a different timbre) than the typical onset. The
+    # model is decoded for both directions, with downbeats gaining the accent or losing it, and the more likely path is
+    # kept. Without accents both directions score downbeat and beat states alike
+    accent = onset_accent(activation, int(round(ACCENT_WINDOW * OSE_SAMPLE_RATE / FFT_HOP / HOP)))
+    path, log_likelihood = model.viterbi(log_beat, log_non_beat, log_beat + accent)
+    weaker_path, weaker_log_likelihood = model.viterbi(log_beat, log_non_beat, log_beat - accent)
+    if weaker_log_likelihood > log_likelihood:
+        path = weaker_path
+    beat_frames = np.flatnonzero(model.is_beat[path])
+    downbeat_frames = np.flatnonzero(model.is_downbeat[path])
+    # Back to onset strength envelope frames
+    beats = list(beat_frames * HOP + strongest[beat_frames])
+    downbeats = list(downbeat_frames * HOP + strongest[downbeat_frames])
+    return beats, downbeats
+
+
+def onset_accent(activation, window):
+    """
+    Accent of every onset: The log-ratio of its activation to the typical onset around it, i.e. the median activation
+    of the peaks within window frames that reach ONSET_FLOOR of the strongest one
+    :param activation: The beat activation
+    :param window: Length of the window in frames
+    :return: The accent of every frame, limited to +/- ACCENT_LIMIT and 0 for frames weaker than ONSET_FLOOR of the
+    typical onset
+    """
+    peaks = find_peaks(activation)[0]
+    onsets = peaks[activation[peaks] >= ONSET_FLOOR * maximum_filter1d(activation, window, mode='nearest')[peaks]]
+    if onsets.size == 0:
+        return np.zeros(activation.size)
+    first = np.searchsorted(onsets, onsets - window // 2, side='left')
+    last = np.searchsorted(onsets, onsets + window // 2, side='right')
+    typical = np.array([np.median(activation[onsets[i:j]]) for i, j in zip(first, last)])
+    ratio = activation / np.interp(np.arange(activation.size), onsets, typical)
+    return np.where(ratio >= ONSET_FLOOR, np.clip(np.log(ratio), -ACCENT_LIMIT, ACCENT_LIMIT), 0)
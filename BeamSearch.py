@@ -0,0 +1,132 @@
+import numpy as np
+from scipy.signal import find_peaks
+
+import Functions
+import Globals
+import Profiling
+
+# Weighting factor of the tempo change penalty (as ALPHA in Ellis_07_Search)
+TEMPO_WEIGHT = 30
+# Look for the next beat in the range of (position + tau) +/- WINDOW (96ms), as in Main.state_space_search
+WINDOW = 24
+# Maximum number of peaks in the search space that each hypothesis is extended with
+MAX_CANDIDATES = 3
+
+
+@Profiling.profiled('beam_search')
+def beam_search(ose, tau_index, is_duple_tempo, beam_width=None):
+    """
+    Multi-hypothesis version of Main.state_space_search: Instead of committing to one tempo and phase, the best
+    beam_width (tempo, phase) hypotheses are kept. In every step each hypothesis is extended by the
+    strongest peaks around its expected next beat (adjusting its tempo like the greedy search) and by a beat at the
+    expected position itself, and the beam is pruned to the best hypotheses.
+    A hypothesis scores the onset strength at its beats minus a penalty for deviations from its tempo (the Ellis-07
+    objective). The score does not depend on the position in the bar, so the beats are numbered after the search,
+    with the first beat as downbeat like in the greedy search. The beam is stored in preallocated arrays, so cost and
+    memory are linear in beam_width
+    :param ose: The onset strength envelope from Ellis-07
+    :param tau_index: Initial estimation of distance to next beat
+    :param is_duple_tempo: Whether duple (True) or triple (False) tempo is assumed
+    :param beam_width: Number of hypotheses, defaults to Globals.BEAM_WIDTH
+    :return: The indices of beats and downbeats
+    """
+    if beam_width is None:
+        beam_width = Globals.BEAM_WIDTH
+    metre = 4 if is_duple_tempo else 3
+    tau_index = int(tau_index)
+    peaks = find_peaks(ose)[0]
+
+    # The tempo may change by at most an octave, which also bounds the number of beats
+    tau_min = max(WINDOW + 1, tau_index // 2)
+    tau_max = max(tau_min, 2 * tau_index)
+    # Every beat is at least tau_min - WINDOW frames after the previous one
+    max_steps = ose.size // (tau_min - WINDOW) + 2
+
+    # Beam history: Position and parent hypothesis of every hypothesis in every step
+    positions = np.zeros((max_steps, beam_width), dtype=np.int64)
+    parents = np.zeros((max_steps, beam_width), dtype=np.int64)
+    # Current tempo and score of every hypothesis
+    taus = np.zeros(beam_width, dtype=np.int64)
+    scores = np.zeros(beam_width)
+
+    # Initial hypotheses: The strongest peaks in the first beat period
+    first_peaks = peaks[peaks < peaks[0] + tau_index]
+    first_peaks = first_peaks[np.argsort(-ose[first_peaks], kind='stable')][:beam_width]
+    size = first_peaks.size
+    positions[0, :size] = first_peaks
+    taus[:size] = np.clip(tau_index, tau_min, tau_max)
+    scores[:size] = ose[positions[0, :size]]
+
+    # Best hypothesis that reached the end of the onset strength envelope (score, step, index in beam)
+    best = (-np.inf, 0, 0)
+    step = 0
+    while size > 0:
+        candidate_positions = []
+        candidate_taus = []
+        candidate_parents = []
+        candidate_scores = []
+        for k in range(size):
+            position = positions[step, k]
+            tau = taus[k]
+            expected = position + tau
+            if expected >= ose.size:
+                # This hypothesis is complete
+                if scores[k] > best[0]:
+                    best = (scores[k], step, k)
+                continue
+            # Peaks in the search space around the expected beat (after the current beat)
+            low = np.searchsorted(peaks, max(expected - WINDOW, position + 1), side='left')
+            high = np.searchsorted(peaks, expected + WINDOW, side='left')
+            candidates = peaks[low:high]
+            if candidates.size > MAX_CANDIDATES:
+                candidates = candidates[np.argsort(-ose[candidates], kind='stable')[:MAX_CANDIDATES]]
+            # Adjust the tempo towards each candidate like the greedy search does
+            diff = expected - candidates
+            new_taus = np.clip(((tau * 2 - diff) / 2).astype(np.int64), tau_min, tau_max)
+            # The beat at the expected position keeps the tempo
+            candidates = np.append(candidates, expected)
+            new_taus = np.append(new_taus, tau)
+
+            candidate_positions.append(candidates)
+            candidate_taus.append(new_taus)
+            candidate_parents.append(np.full(candidates.size, k))
+            candidate_scores.append(scores[k] + ose[candidates]
+                                    + TEMPO_WEIGHT * Functions.F_squared_error(candidates - position, tau))
+        if len(candidate_positions) == 0:
+            break
+
+        candidate_positions = np.concatenate(candidate_positions)
+        candidate_taus = np.concatenate(candidate_taus)
+        candidate_parents = np.concatenate(candidate_parents)
+        candidate_scores = np.concatenate(candidate_scores)
+
+        # Prune: Keep the best hypothesis per (position, tempo) and then the best beam_width ones
+        order = np.argsort(-candidate_scores, kind='stable')
+        keys = candidate_positions * (tau_max + 1) + candidate_taus
+        _, unique = np.unique(keys[order], return_index=True)
+        keep = order[np.sort(unique)][:beam_width]
+
+        if step + 1 == max_steps:
+            break
+        step = step + 1
+        size = keep.size
+        positions[step, :size] = candidate_positions[keep]
+        parents[step, :size] = candidate_parents[keep]
+        taus[:size] = candidate_taus[keep]
+        scores[:size] = candidate_scores[keep]
+
+    # Trace the best hypothesis back to the first beat
+    score, best_step, k = best
+    if score == -np.inf:
+        # No hypothesis reached the end, use the best one of the last step
+        best_step, k = step, int(np.argmax(scores[:size]))
+    step = best_step
+    beats = []
+    while step >= 0:
+        beats.append(positions[step, k])
+        k = parents[step, k]
+        step = step - 1
+    beats.reverse()
+    # Every metre-th beat is a downbeat, starting with the first one
+    downbeats = beats[::metre]
+    return beats, downbeats
@@ -0,0 +1,283 @@
+"""
+Batch beat tracking of many audio files into one compact output file. Run from the repository root, e.g.:
+    python BeatTrack.py BallroomData --output beats.npz --jobs 4
+    python BeatTrack.py "music/**/*.flac" --manifest more_files.txt
+The output is a *.npz file with the beats and downbeats of all files concatenated into two arrays, indexed by
+per-file offsets (see load_beats). Files that are unchanged since the last run into the same output are skipped
+"""
+import argparse
+import glob
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+
+import Audio
+import Functions
+import Globals
+import Main
+from Globals import OSE_SAMPLE_RATE
+
+# Default output file
+OUTPUT_FILE = "beats.npz"
+# File extensions collected from directories
+AUDIO_EXTENSIONS = ('.wav', '.flac', '.ogg', '.mp3', '.au', '.aiff')
+# Number of files decoded ahead of the beat tracking
+PREFETCH = 8
+
+
+def collect_files(inputs, manifests=()):
+    """
+    Collect the audio files to track
+    :param inputs: Directories (searched recursively for AUDIO_EXTENSIONS), glob patterns or file paths
+    :param manifests: Text files with one path per line
+    :return: Sorted list of unique file paths
+    """
+    files = set()
+    for manifest in manifests:
+        with open(manifest) as f:
+            files.update(line.strip() for line in f if line.strip())
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.update(os.path.join(root, name) for name in names if name.lower().endswith(AUDIO_EXTENSIONS))
+        elif os.path.isfile(path):
+            files.add(path)
+        else:
+            matches = glob.glob(path, recursive=True)
+            if not matches:
+                raise FileNotFoundError("No files match " + path)
+            files.update(match for match in matches if os.path.isfile(match))
+    return sorted(files)
+
+
+def file_hash(file):
+    """
+    SHA-256 hash of the contents of a file
+    """
+    h = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_beats(path):
+    """
+    Read an output file of the batch beat tracker
+    :param path: Path to the *.npz file
+    :return: Dictionary from file path to a dictionary with its "beats", "downbeats" (in seconds), "mtime", "size",
+    "hash" and "seconds" (duration of the audio), and the configuration the beats were tracked with
+    """
+    with np.load(path) as data:
+        files = {}
+        for i, file in enumerate(data['files']):
+            files[str(file)] = {
+                'beats': data['beats'][data['beat_offsets'][i]:data['beat_offsets'][i + 1]],
+                'downbeats': data['downbeats'][data['downbeat_offsets'][i]:data['downbeat_offsets'][i + 1]],
+                'mtime': int(data['mtimes'][i]), 'size': int(data['sizes'][i]), 'hash': str(data['hashes'][i]),
+                'seconds': float(data['seconds'][i])}
+        return files, str(data['config'])
+
+
+def save_beats(path, files, config):
+    """
+    Write the output file of the batch beat tracker (written to a temporary file that is renamed afterwards, so an
+    interrupted run never leaves a partial file)
+    :param path: Path to the *.npz file
+    :param files: Dictionary in the format returned by load_beats
+    :param config: The configuration the beats were tracked with
+    """
+    names = sorted(files)
+    entries = [files[name] for name in names]
+    beat_counts = [len(entry['beats']) for entry in entries]
+    downbeat_counts = [len(entry['downbeats']) for entry in entries]
+    arrays = {
+        'files': np.array(names, dtype=str),
+        'beats': np.concatenate([np.asarray(entry['beats'], dtype=float) for entry in entries] + [np.zeros(0)]),
+        'beat_offsets': np.concatenate(([0], np.cumsum(beat_counts, dtype=np.int64))),
+        'downbeats': np.concatenate([np.asarray(entry['downbeats'], dtype=float) for entry in entries]
+                                    + [np.zeros(0)]),
+        'downbeat_offsets': np.concatenate(([0], np.cumsum(downbeat_counts, dtype=np.int64))),
+        'mtimes': np.array([entry['mtime'] for entry in entries], dtype=np.int64),
+        'sizes': np.array([entry['size'] for entry in entries], dtype=np.int64),
+        'hashes': np.array([entry['hash'] for entry in entries], dtype=str),
+        'seconds': np.array([entry['seconds'] for entry in entries], dtype=float),
+        'config': np.array(config),
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def is_up_to_date(file, entry):
+    """
+    Check whether the beats of a file in a previous output are still valid: The file has the same modification time
+    and size, or (e.g. after a copy) the same contents
+    :param file: The path to the audio file
+    :param entry: The entry of the file in the previous output (see load_beats) or None
+    :return: True if the file does not have to be tracked again (False for files that can not be read, so that the
+    error is reported for that file only when it is tracked)
+    """
+    if entry is None:
+        return False
+    try:
+        stat = os.stat(file)
+        if stat.st_mtime_ns == entry['mtime'] and stat.st_size == entry['size']:
+            return True
+        return stat.st_size == entry['size'] and file_hash(file) == entry['hash']
+    except OSError:
+        # E.g. a manifest entry whose file was deleted or moved
+        return False
+
+
+def decode(file):
+    """
+    Decode a file for the beat tracker (runs in the decode threads)
+    :return: The signal at OSE_SAMPLE_RATE and the modification time, size and hash of the file
+    """
+    stat = os.stat(file)
+    sig, _ = Audio.load(file)
+    return sig, stat.st_mtime_ns, stat.st_size, file_hash(file)
+
+
+def track(sig, search='greedy', style=None):
+    """
+    Beat-track a decoded signal (runs in the worker processes)
+    :param sig: The signal at OSE_SAMPLE_RATE
+    :return: Beats and downbeats in seconds
+    """
+    Globals.TAU_0 = Functions.find_tempo_period_bias()
+    ose = Main.calculate_onset_strength_envelope(sig, OSE_SAMPLE_RATE)
+    return Main.track_onset_strength_envelope(ose, search, style)
+
+
+def track_files(files, output=OUTPUT_FILE, jobs=1, prefetch=PREFETCH, search='greedy', style=None, force=False):
+    """
+    Beat-track audio files into one output file. Decoding runs in a pool of threads that stays up to prefetch files
+    ahead, so reading and decoding overlap with the beat tracking in the worker processes
+    :param files: List of audio file paths
+    :param output: Path of the *.npz output file. Entries of files that are not in the list are kept (unless the
+    configuration changed)
+    :param jobs: Number of worker processes. With 1 job the beats are tracked in this process
+    :param prefetch: Number of files decoded ahead
+    :param search: The beat search passed to Main.track_onset_strength_envelope ("greedy", "beam", "hmm" or "coarse")
+    :param style: The style hint passed to Main.track_onset_strength_envelope
+    :param force: If true, files are tracked again even if they are up to date
+    :return: Number of tracked files, number of files that failed
+    """
+    config = {'search': search, 'style': style, 'dtype': Globals.OSE_DTYPE,
+              'resample_quality': Globals.RESAMPLE_QUALITY, 'tempo_prior': Globals.TEMPO_PRIOR}
+    if search == 'coarse':
+        config['pyramid_depth'] = Globals.PYRAMID_DEPTH
+    if search == 'greedy' and Globals.LOCAL_TEMPO:
+        config['local_tempo'] = True
+    config = repr(config)
+    results = {}
+    if os.path.exists(output):
+        results, previous_config = load_beats(output)
+        if previous_config != config:
+            print("Configuration changed, tracking all files again")
+            results = {}
+    pending = [file for file in files if force or not is_up_to_date(file, results.get(file))]
+    print(str(len(files) - len(pending)) + "/" + str(len(files)) + " files up to date")
+
+    work = partial(track, search=search, style=style)
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    decoder = ThreadPoolExecutor(max_workers=max(1, min(prefetch, jobs + 1)))
+    failures = 0
+    audio_seconds = 0
+
+    def finish(file, entry, result):
+        nonlocal failures, audio_seconds
+        try:
+            entry['beats'], entry['downbeats'] = result()
+        except Exception as e:
+            print("Could not track " + file + ": " + str(e))
+            failures += 1
+            return
+        results[file] = entry
+        audio_seconds += entry['seconds']
+
+    # Files are decoded in order by the decode threads, at most prefetch files ahead
+    decodes = deque()
+    remaining = iter(pending)
+
+    def refill():
+        while len(decodes) < prefetch:
+            file = next(remaining, None)
+            if file is None:
+                return
+            decodes.append((file, decoder.submit(decode, file)))
+
+    start = time.perf_counter()
+    tracking = deque()
+    try:
+        refill()
+        while decodes:
+            file, decoded = decodes.popleft()
+            refill()
+            try:
+                sig, mtime, size, digest = decoded.result()
+            except Exception as e:
+                print("Could not decode " + file + ": " + str(e))
+                failures += 1
+                continue
+            entry = {'mtime': mtime, 'size': size, 'hash': digest, 'seconds': sig.size / OSE_SAMPLE_RATE}
+            if executor is None:
+                finish(file, entry, partial(work, sig))
+                continue
+            # Keep the worker processes busy, but only hold a bounded number of decoded signals
+            tracking.append((file, entry, executor.submit(work, sig)))
+            if len(tracking) >= 2 * jobs:
+                file, entry, future = tracking.popleft()
+                finish(file, entry, future.result)
+        while tracking:
+            file, entry, future = tracking.popleft()
+            finish(file, entry, future.result)
+    finally:
+        decoder.shutdown()
+        if executor is not None:
+            executor.shutdown()
+    elapsed = time.perf_counter() - start
+
+    save_beats(output, results, config)
+    tracked = len(pending) - failures
+    print("Tracked " + str(tracked) + " files (" + str(failures) + " failed) in " + str(round(elapsed, 1)) + "s: "
+          + str(round(tracked / max(elapsed, 1e-9), 2)) + " files/s, "
+          + str(round(audio_seconds / max(elapsed, 1e-9), 1)) + " audio seconds/s")
+    return tracked, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Beat-track directories, globs or manifests of audio files")
+    parser.add_argument('inputs', nargs='*', help="Directories, glob patterns or audio files")
+    parser.add_argument('--manifest', action='append', default=[], help="Text file with one audio file per line")
+    parser.add_argument('--output', default=OUTPUT_FILE, help="The *.npz file the beats are written to")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of worker processes")
+    parser.add_argument('--prefetch', type=int, default=PREFETCH, help="Number of files decoded ahead")
+    parser.add_argument('--search', choices=['greedy', 'beam', 'hmm', 'coarse'], default='greedy', help="Beat search")
+    parser.add_argument('--style', default=None, help="Style hint for the tempo prior, or 'auto'")
+    parser.add_argument('--force', action='store_true', help="Track all files again, even if they are up to date")
+    args = parser.parse_args(argv)
+    if not args.inputs and not args.manifest:
+        parser.error("No inputs given")
+    files = collect_files(args.inputs, args.manifest)
+    _, failures = track_files(files, output=args.output, jobs=args.jobs, prefetch=args.prefetch,
+                              search=args.search, style=args.style, force=args.force)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
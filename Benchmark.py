@@ -0,0 +1,1080 @@
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+from scipy.signal import find_peaks
+
+import Audio
+import Backend
+import Globals
+import Functions
+import Main
+import Ellis_07_Search
+import Evaluation
+from Globals import OSE_SAMPLE_RATE, FFT_HOP
+
+# Budget for the cumulative import time of Main in ms (checked by check_import_time)
+IMPORT_TIME_BUDGET = 500
+# Modules that must not be imported by Main, as they are slow to import and only needed for plotting and evaluation,
+# or only by optional searches, the streaming/chunked envelope and style priors (imported where they are used)
+LAZY_MODULES = ['matplotlib', 'IPython', 'mir_eval', 'librosa', 'numba', 'BarPointer', 'BeamSearch', 'CoarseToFine',
+                'Streaming', 'TempoPrior', 'Tempogram', 'tracemalloc']
+
+# Sample rate of the synthetic audio (librosa's default load rate)
+AUDIO_SAMPLE_RATE = 22050
+
+# Durations of the synthetic onset strength envelopes in seconds (10s up to 10min)
+DURATIONS = [10, 30, 60, 180, 600]
+
+# Time limit in seconds for one greedy search in the parity checks (a search that does not terminate fails the check)
+SEARCH_TIMEOUT = 10
+# Budget for decoding a 30s excerpt with the bar-pointer model in seconds (checked by benchmark_bar_pointer)
+BAR_POINTER_BUDGET = 0.5
+# Mean beat and downbeat F-measure the bar-pointer model has to reach on the fixtures of the benchmark suite
+DOWNBEAT_AGREEMENT = 0.9
+
+
+def synthetic_ose(seconds, bpm=120, seed=0):
+    """
+    Generate a synthetic onset strength envelope: Gaussian noise with a smoothed impulse on every beat
+    :param seconds: Duration in seconds
+    :param bpm: Tempo of the impulses
+    :param seed: Seed for the noise generator
+    :return: The onset strength envelope and the beat period in frames
+    """
+    rng = np.random.default_rng(seed)
+    frames = int(seconds * OSE_SAMPLE_RATE / FFT_HOP)
+    tau_index = int(round(60 / bpm * OSE_SAMPLE_RATE / FFT_HOP))
+    ose = rng.normal(0, 0.3, frames)
+    ose[::tau_index] += 3
+    ose = np.convolve(ose, np.hanning(9), mode='same')
+    return ose / np.std(ose), tau_index
+
+
+def ellis_07_forward_pass_loop(ose, tau_index):
+    """
+    Baseline: The original per-frame, per-predecessor loop of the Ellis-07 forward pass (with C indexed relative to
+    the start of the search window, so that the results are comparable with Ellis_07_Search.forward_pass)
+    """
+    C = np.zeros(ose.size)
+    P_indices = np.zeros(ose.size, dtype=int)
+    C[0] = ose[0]
+    for t in range(1, ose.size):
+        startwidth = t - int(tau_index * 2)
+        endwidth = t - int(tau_index * 0.5)
+        start_idx = startwidth if startwidth > 0 else 0
+        end_idx = endwidth if endwidth > 0 else t
+        window = end_idx - start_idx
+
+        P_temp = np.zeros(window)
+        for j in range(window):
+            error = Ellis_07_Search.ALPHA * Functions.F_squared_error(t - (start_idx + j), tau_index)
+            P_temp[j] = error + C[start_idx + j]
+        P_indices[t] = start_idx + np.argmax(P_temp)
+        C[t] = ose[t] + np.max(P_temp)
+    return C, P_indices
+
+
+def benchmark_ellis_07_search(durations=DURATIONS, max_baseline_seconds=60):
+    """
+    Compare the throughput of the vectorised Ellis-07 forward pass with the original loop
+    :param durations: List of durations (in seconds) of the synthetic onset strength envelopes
+    :param max_baseline_seconds: The loop is only timed up to this duration as it takes minutes for longer inputs
+    :return: None
+    """
+    print("Duration | Frames | Loop (frames/s) | Vectorised (frames/s) | Speedup")
+    for seconds in durations:
+        ose, tau_index = synthetic_ose(seconds)
+
+        start = time.perf_counter()
+        C, P_indices = Ellis_07_Search.forward_pass(ose, tau_index)
+        vectorised = ose.size / (time.perf_counter() - start)
+
+        loop = None
+        if seconds <= max_baseline_seconds:
+            start = time.perf_counter()
+            C_loop, P_loop = ellis_07_forward_pass_loop(ose, tau_index)
+            loop = ose.size / (time.perf_counter() - start)
+            # Both implementations have to agree
+            assert np.allclose(C, C_loop) and np.array_equal(P_indices, P_loop)
+
+        if loop is None:
+            print(str(seconds) + "s | " + str(ose.size) + " | - | " + str(round(vectorised)) + " | -")
+        else:
+            print(str(seconds) + "s | " + str(ose.size) + " | " + str(round(loop)) + " | " + str(round(vectorised))
+                  + " | " + str(round(vectorised / loop, 1)))
+
+
+def estimate_tempo_loop(ose):
+    """
+    Baseline: The original Functions.estimate_tempo with a per-lag weighting loop over the full autocorrelation and
+    Python loops for TPS2 and TPS3 (the autocorrelation is calculated like librosa.autocorrelate).
+    The envelope needs at least 3 * Functions.TEMPO_SEARCH_RANGE frames, the loops index beyond shorter ones
+    :return: The tactus estimate, the estimated tempo in OSE frames and whether duple tempo is assumed
+    """
+    spectrum = np.fft.rfft(ose, n=2 * ose.size)
+    ac = np.fft.irfft(np.abs(spectrum) ** 2, n=2 * ose.size)[:ose.size]
+    TPS = []
+    for tau in range(1, ose.size):
+        TPS.append(Functions.autocorrelation_weighting(tau, Globals.TAU_0) * ac[tau])
+    tau_index = np.argmax(TPS)
+    TPS2 = []
+    TPS3 = []
+    for tau in range(1, Functions.TEMPO_SEARCH_RANGE):
+        TPS2.append(TPS[tau] + 0.5 * TPS[2 * tau] + 0.25 * TPS[2 * tau - 1] + 0.25 * TPS[2 * tau + 1])
+        TPS3.append(TPS[tau] + 0.33 * TPS[3 * tau] + 0.33 * TPS[3 * tau - 1] + 0.33 * TPS[3 * tau + 1])
+    tau2 = np.argmax(TPS2)
+    tau3 = np.argmax(TPS3)
+    metre = np.argmax([TPS[tau_index], TPS2[tau2], TPS3[tau3]])
+    if metre == 0:
+        return tau_index * FFT_HOP / OSE_SAMPLE_RATE, tau_index, True
+    elif metre == 1:
+        return (1 / 2) * tau2 * FFT_HOP / OSE_SAMPLE_RATE, tau2, True
+    return (1 / 3) * tau3 * FFT_HOP / OSE_SAMPLE_RATE, tau3, False
+
+
+def check_tempo_parity(durations=(30, 60, 180, 600), seeds=range(8)):
+    """
+    The vectorised Functions.estimate_tempo has to return the same tempo and metre as the original loops (the
+    tactus within float tolerance, as the autocorrelations are calculated with FFTs of different sizes)
+    :param durations: Durations of the synthetic onset strength envelopes in seconds (at least 24s)
+    :param seeds: Seeds of the synthetic envelopes, every seed uses a different tempo, plus one envelope of pure noise
+    :return: None
+    """
+    Globals.TAU_0 = Functions.find_tempo_period_bias()
+    for seconds in durations:
+        oses = [("noise", np.random.default_rng(seconds).normal(0, 1, int(seconds * OSE_SAMPLE_RATE / FFT_HOP)))]
+        for seed in seeds:
+            bpm = 60 + 20 * seed
+            oses.append((str(bpm) + " BPM", synthetic_ose(seconds, bpm=bpm, seed=seed)[0]))
+        for name, ose in oses:
+            expected = estimate_tempo_loop(ose)
+            result = Functions.estimate_tempo(ose)
+            assert result[1:] == expected[1:] and np.isclose(result[0], expected[0]), (seconds, name)
+        print("Tempo estimates match the original loops for " + str(len(oses)) + " envelopes of " + str(seconds)
+              + "s")
+
+
+def synthetic_waltz_ose(seconds, bpm=87, seed=0):
+    """
+    Generate a synthetic onset strength envelope of a 3/4 drum loop: Gaussian noise with a weak smoothed impulse on
+    every beat and a strong one on every downbeat
+    :param seconds: Duration in seconds
+    :param bpm: Tempo of the beats
+    :param seed: Seed for the noise generator
+    :return: The onset strength envelope and the beat period in frames
+    """
+    rng = np.random.default_rng(seed)
+    frames = int(seconds * OSE_SAMPLE_RATE / FFT_HOP)
+    tau_index = int(round(60 / bpm * OSE_SAMPLE_RATE / FFT_HOP))
+    ose = rng.normal(0, 0.3, frames)
+    ose[::tau_index] += 0.5
+    ose[::3 * tau_index] += 6
+    ose = np.convolve(ose, np.hanning(9), mode='same')
+    return ose / np.std(ose), tau_index
+
+
+def check_triple_metre(bpm=87, seeds=range(8)):
+    """
+    A style prior must not hide the metre: A 3/4 drum loop that is triple with the global tempo weighting has to stay
+    triple with a Waltz prior (a prior of synthetic annotations around bpm), at a beat period close to the true one
+    :param bpm: Tempo of the drum loops
+    :param seeds: Seeds of the drum loops
+    :return: None
+    """
+    import TempoPrior
+    Globals.TAU_0 = Functions.find_tempo_period_bias()
+    tempi = np.random.default_rng(0).uniform(bpm - 3, bpm + 3, 50)
+    prior = TempoPrior.TempoPrior({str(i): {'mtime': 0, 'bpm': float(tempo), 'style': 'Waltz'}
+                                   for i, tempo in enumerate(tempi)})
+    for seed in seeds:
+        ose, tau_index = synthetic_waltz_ose(30, bpm, seed)
+        assert not Functions.estimate_tempo(ose)[2], ("global weighting", seed)
+        _, prior_tau_index, is_duple_tempo = Functions.estimate_tempo(ose, prior)
+        assert not is_duple_tempo and abs(prior_tau_index - tau_index) <= 3, ("Waltz prior", seed)
+    print("3/4 drum loops at " + str(bpm) + " BPM are triple with the global weighting and with a Waltz prior")
+
+
+def synthetic_beats(n_beats, tau_index=125, jitter=3, miss_rate=0.1, seed=0):
+    """
+    Generate synthetic correct and found beat sequences (in frames): The found beats are the correct beats with
+    uniform timing jitter, some of them are dropped and the same number of spurious beats is added
+    :param n_beats: Number of correct beats
+    :param tau_index: Beat period in frames
+    :param jitter: Maximum timing deviation of the found beats in frames
+    :param miss_rate: Fraction of beats that are missed (and of spurious beats)
+    :param seed: Seed for the random generator
+    :return: The found beats and the correct beats as lists of ints
+    """
+    rng = np.random.default_rng(seed)
+    c_beats = np.arange(n_beats) * tau_index
+    found = c_beats + rng.integers(-jitter, jitter + 1, n_beats)
+    n_missed = int(n_beats * miss_rate)
+    found = np.delete(found, rng.choice(n_beats, n_missed, replace=False))
+    # Spurious beats halfway between two correct beats
+    spurious = rng.choice(n_beats, n_missed, replace=False) * tau_index + tau_index // 2
+    beats = np.sort(np.concatenate((found, spurious)))
+    return beats.tolist(), c_beats.tolist()
+
+
+def match_beats_loop(beats, c_beats, margin):
+    """
+    Baseline: The original window scans of Evaluation.evaluate_file (TP, FN and FP loops for beats)
+    """
+    TP = 0
+    FN = 0
+    FP = 0
+    for i in range(len(beats)):
+        space = np.arange(beats[i] - margin, beats[i] + margin, 1, dtype=int)
+        for allowed in space:
+            if allowed in c_beats:
+                TP = TP + 1
+    for i in range(len(c_beats)):
+        space = np.arange(c_beats[i] - margin, c_beats[i] + margin, 1, dtype=int)
+        if not any(allowed in beats for allowed in space):
+            FN = FN + 1
+    for i in range(len(beats)):
+        space = np.arange(beats[i] - margin, beats[i] + margin, 1, dtype=int)
+        if not any(allowed in c_beats for allowed in space):
+            FP = FP + 1
+    return TP, FP, FN
+
+
+def benchmark_beat_matching(sizes=(100, 1000, 10000), max_baseline_beats=1000):
+    """
+    Compare the sorted-array matcher of Evaluation.match_beats with the original window scans
+    :param sizes: Numbers of beats of the synthetic sequences
+    :param max_baseline_beats: The loops are only timed up to this size as they are quadratic in the number of beats
+    :return: None
+    """
+    margin = np.ceil((Evaluation.MARGIN * 0.001) * OSE_SAMPLE_RATE / FFT_HOP / 2)
+    print("Beats | Loop (ms) | Sorted (ms) | Speedup")
+    for n_beats in sizes:
+        beats, c_beats = synthetic_beats(n_beats)
+
+        start = time.perf_counter()
+        counts = Evaluation.match_beats(beats, c_beats, margin)
+        matched = time.perf_counter() - start
+
+        loop = None
+        if n_beats <= max_baseline_beats:
+            start = time.perf_counter()
+            counts_loop = match_beats_loop(beats, c_beats, margin)
+            loop = time.perf_counter() - start
+            # The beats are further apart than the margin, so no beat can be counted twice and both have to agree
+            assert counts == counts_loop
+
+        if loop is None:
+            print(str(n_beats) + " | - | " + str(round(matched * 1000, 2)) + " | -")
+        else:
+            print(str(n_beats) + " | " + str(round(loop * 1000, 2)) + " | " + str(round(matched * 1000, 2))
+                  + " | " + str(round(loop / matched, 1)))
+
+
+def synthetic_audio(seconds, bpm=120, seed=0):
+    """
+    Generate a synthetic audio signal: Quiet noise with a decaying noise burst on every beat
+    :param seconds: Duration in seconds
+    :param bpm: Tempo of the bursts
+    :param seed: Seed for the noise generator
+    :return: The signal at AUDIO_SAMPLE_RATE
+    """
+    rng = np.random.default_rng(seed)
+    sig = rng.normal(0, 0.01, int(seconds * AUDIO_SAMPLE_RATE))
+    period = int(60 / bpm * AUDIO_SAMPLE_RATE)
+    burst = rng.normal(0, 0.5, 2000) * np.exp(-np.arange(2000) / 300)
+    for start in range(0, sig.size - burst.size, period):
+        sig[start:start + burst.size] += burst
+    return sig
+
+
+def benchmark_batched_ose(batch_sizes=(1, 8, 64), seconds=30):
+    """
+    Compare the per-file time of Main.calculate_onset_strength_envelope with the batched
+    Main.calculate_onset_strength_envelopes for clips with the length of the Ballroom excerpts
+    :param batch_sizes: Numbers of signals per batch
+    :param seconds: Duration of each signal in seconds
+    :return: None
+    """
+    print("Batch size | Single (ms/file) | Batched (ms/file) | Speedup")
+    for batch_size in batch_sizes:
+        signals = [synthetic_audio(seconds, bpm=100 + i, seed=i) for i in range(batch_size)]
+
+        start = time.perf_counter()
+        single = [Main.calculate_onset_strength_envelope(sig, AUDIO_SAMPLE_RATE) for sig in signals]
+        single_time = (time.perf_counter() - start) / batch_size
+
+        start = time.perf_counter()
+        batched = Main.calculate_onset_strength_envelopes(signals, AUDIO_SAMPLE_RATE)
+        batched_time = (time.perf_counter() - start) / batch_size
+
+        # Both implementations have to agree
+        for ose, ose_batched in zip(single, batched):
+            assert ose.shape == ose_batched.shape and np.allclose(ose, ose_batched, atol=1e-3)
+
+        print(str(batch_size) + " | " + str(round(single_time * 1000, 1)) + " | " + str(round(batched_time * 1000, 1))
+              + " | " + str(round(single_time / batched_time, 1)))
+
+
+def decode_librosa(file):
+    """
+    Baseline: librosa's default load at 22.05kHz followed by a second resampling step to OSE_SAMPLE_RATE
+    """
+    import librosa
+    sig, sr = librosa.core.load(file)
+    return librosa.core.resample(sig, sr, OSE_SAMPLE_RATE)
+
+
+def decode_fast(file):
+    return Audio.load(file, quality='fast')[0]
+
+
+def decode_high(file):
+    return Audio.load(file, quality='high')[0]
+
+
+def measure_decode(decoder, file):
+    """
+    Decode a file and measure the time and the increase of the peak resident set size.
+    Meant to run in a fresh process, as the peak RSS of a process never decreases
+    :return: Decode time in seconds and peak RSS increase in MB
+    """
+    # Import everything the decoders need before taking the baseline
+    import librosa
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    decoder(file)
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kB on Linux
+    return elapsed, (after - before) / 1024
+
+
+def benchmark_decode(seconds=30, sr=44100):
+    """
+    Compare decode time and peak RSS of the librosa load + resample path with Audio.load on a synthetic stereo
+    16 bit WAV file. Every measurement runs in a new process
+    :param seconds: Duration of the file in seconds
+    :param sr: Sample rate of the file
+    :return: None
+    """
+    import soundfile
+    rng = np.random.default_rng(0)
+    sig = rng.normal(0, 0.1, (int(seconds * sr), 2))
+    with tempfile.TemporaryDirectory() as folder:
+        file = os.path.join(folder, "decode.wav")
+        soundfile.write(file, sig, sr, subtype='PCM_16')
+        print("Decoder | Time (ms) | Peak RSS increase (MB)")
+        for name, decoder in [("librosa load + resample", decode_librosa), ("Audio.load fast", decode_fast),
+                              ("Audio.load high", decode_high)]:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                elapsed, rss = executor.submit(measure_decode, decoder, file).result()
+            print(name + " | " + str(round(elapsed * 1000, 1)) + " | " + str(round(rss, 1)))
+
+
+def check_chunked_ose(seconds=30, block_sizes=(777, 22050, 10 ** 6), chunk_size=1000):
+    """
+    The chunked onset strength envelope has to match Main.calculate_onset_strength_envelope within float tolerance,
+    also for blocks and chunks that do not line up with the STFT frames
+    :param seconds: Duration of the synthetic signal in seconds
+    :param block_sizes: Sizes of the audio blocks fed to the chunked implementation
+    :param chunk_size: Globals.OSE_CHUNK_SIZE used for the check (smaller than the signal)
+    :return: None
+    """
+    sig = synthetic_audio(seconds).astype(np.float32)
+    quality, default_chunk_size, dtype = Globals.RESAMPLE_QUALITY, Globals.OSE_CHUNK_SIZE, Globals.OSE_DTYPE
+    # float64, so that only the differences caused by the chunks are measured
+    Globals.RESAMPLE_QUALITY, Globals.OSE_CHUNK_SIZE, Globals.OSE_DTYPE = 'fast', chunk_size, 'float64'
+    try:
+        for sr, audio in [(AUDIO_SAMPLE_RATE, sig), (OSE_SAMPLE_RATE, Audio.resample(sig, AUDIO_SAMPLE_RATE,
+                                                                                       OSE_SAMPLE_RATE, 'fast'))]:
+            expected = Main.calculate_onset_strength_envelope(audio, sr)
+            for block_size in block_sizes:
+                blocks = (audio[start:start + block_size] for start in range(0, audio.size, block_size))
+                ose = Main.calculate_onset_strength_envelope_chunked(blocks, sr, audio.size)
+                assert ose.shape == expected.shape, (sr, block_size)
+                assert np.allclose(ose, expected, rtol=1e-5, atol=1e-5), (sr, block_size)
+                print("Chunked envelope matches at " + str(sr) + "Hz with blocks of " + str(block_size)
+                      + " samples (max. difference " + str(np.max(np.abs(ose - expected))) + ")")
+    finally:
+        Globals.RESAMPLE_QUALITY, Globals.OSE_CHUNK_SIZE, Globals.OSE_DTYPE = quality, default_chunk_size, dtype
+
+
+def measure_ose(file, chunked, path=None):
+    """
+    Calculate the onset strength envelope of a file and measure the time and the increase of the peak resident set
+    size. Meant to run in a fresh process, as the peak RSS of a process never decreases
+    :return: Time in seconds and peak RSS increase in MB
+    """
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if chunked:
+        Main.file_onset_strength_envelope_chunked(file, path)
+    else:
+        Main.file_onset_strength_envelope(file)
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed, (after - before) / 1024
+
+
+def benchmark_chunked_ose(durations=(60, 600, 1800), sr=AUDIO_SAMPLE_RATE):
+    """
+    Compare time and peak RSS of the monolithic and the chunked onset strength envelope on synthetic mono 16 bit WAV
+    files. Every measurement runs in a new process
+    :param durations: Durations of the files in seconds
+    :param sr: Sample rate of the files
+    :return: None
+    """
+    import soundfile
+    print("Duration | Monolithic (ms) | Monolithic peak RSS (MB) | Chunked (ms) | Chunked peak RSS (MB) "
+          "| Chunked, memory-mapped (ms) | Chunked, memory-mapped peak RSS (MB)")
+    with tempfile.TemporaryDirectory() as folder:
+        for seconds in durations:
+            file = os.path.join(folder, "ose.wav")
+            # Write the file in pieces to keep the memory of this process low as well
+            with soundfile.SoundFile(file, 'w', sr, 1, subtype='PCM_16') as f:
+                for start in range(0, seconds, 60):
+                    f.write(synthetic_audio(min(60, seconds - start), seed=start) * 0.5)
+            row = str(seconds) + "s"
+            for chunked, path in [(False, None), (True, None), (True, os.path.join(folder, "ose.npy"))]:
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                    elapsed, rss = executor.submit(measure_ose, file, chunked, path).result()
+                row += " | " + str(round(elapsed * 1000, 1)) + " | " + str(round(rss, 1))
+            print(row)
+
+
+def onset_strength_envelope_float64(audio, sr):
+    """
+    Baseline: The onset strength envelope as calculated before the dtype policy, in float64 with a new array for
+    every step
+    """
+    from scipy import signal
+    audio = Audio.resample(audio, sr, OSE_SAMPLE_RATE, 'fast')
+    audio = np.pad(audio, Globals.N_FFT // 2, mode='reflect')
+    frames = np.lib.stride_tricks.sliding_window_view(audio, Globals.N_FFT)[::FFT_HOP]
+    spectrogram = np.abs(np.fft.rfft(frames * np.hanning(Globals.N_FFT + 1)[:-1], axis=-1)) ** 2
+    mel_spectrogram = Functions.mel_filterbank(OSE_SAMPLE_RATE, Globals.N_FFT, Globals.N_MELS) @ spectrogram.T
+    fod = np.diff(mel_spectrogram, n=1, axis=1)
+    fod[fod < 0] = 0
+    fod = np.sum(fod, axis=0)
+    ose = Functions.apply_highpass_filter(fod, OSE_SAMPLE_RATE, Globals.HIGHPASS_CUTOFF, Globals.HIGHPASS_ORDER)
+    window = Functions.smoothing_window(OSE_SAMPLE_RATE)
+    ose = signal.convolve(ose, window, mode='same') / sum(window)
+    return ose / np.std(ose)
+
+
+def measure_ose_dtype(seconds, dtype):
+    """
+    Calculate the onset strength envelope of a synthetic signal and measure the time and the peak memory allocated
+    on top of the signal. The time is measured first, then the calculation is repeated with tracemalloc (which slows
+    it down), started after the signal has been created. numpy and scipy.fft report their arrays to tracemalloc
+    :param seconds: Duration of the signal in seconds
+    :param dtype: Globals.OSE_DTYPE, or None for the float64 baseline
+    :return: Time in seconds and peak memory in MB
+    """
+    sig = synthetic_audio(seconds).astype(np.float32)
+    # Compile the filters and build the cached windows before measuring
+    Main.calculate_onset_strength_envelope(sig[:AUDIO_SAMPLE_RATE], AUDIO_SAMPLE_RATE)
+    if dtype is None:
+        run = lambda: onset_strength_envelope_float64(sig, AUDIO_SAMPLE_RATE)
+    else:
+        Globals.OSE_DTYPE = dtype
+        run = lambda: Main.calculate_onset_strength_envelope(sig, AUDIO_SAMPLE_RATE)
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return elapsed, peak / 2 ** 20
+
+
+def benchmark_ose_dtype(durations=(30, 600)):
+    """
+    Compare time and peak memory of the previous float64 onset strength envelope with the pipeline in float64 and
+    float32. Every measurement runs in a new process
+    :param durations: Durations of the synthetic signals in seconds
+    :return: None
+    """
+    # The pipeline has to agree with the baseline in float64, and within float32 precision in float32
+    sig = synthetic_audio(30).astype(np.float32)
+    expected = onset_strength_envelope_float64(sig, AUDIO_SAMPLE_RATE)
+    dtype = Globals.OSE_DTYPE
+    try:
+        for policy, tolerance in [('float64', 1e-6), ('float32', 1e-3)]:
+            Globals.OSE_DTYPE = policy
+            ose = Main.calculate_onset_strength_envelope(sig, AUDIO_SAMPLE_RATE)
+            assert ose.dtype == np.dtype(policy) and np.allclose(ose, expected, atol=tolerance), policy
+    finally:
+        Globals.OSE_DTYPE = dtype
+
+    print("Duration | Pipeline | Time (ms) | Peak memory (MB)")
+    for seconds in durations:
+        for name, policy in [("float64 baseline", None), ("float64", 'float64'), ("float32", 'float32')]:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                elapsed, peak = executor.submit(measure_ose_dtype, seconds, policy).result()
+            print(str(seconds) + "s | " + name + " | " + str(round(elapsed * 1000, 1)) + " | " + str(round(peak, 1)))
+
+
+def state_space_search_loop(ose, tau_index, is_duple_tempo):
+    """
+    Baseline: The original Main.state_space_search with linear "candidate in peaks" scans and repeated find_peaks
+    calls in the extended search, plus the termination guard of Main.state_space_search (without it, the original
+    walks back through the envelope once the tempo adaptation drives tau_index to zero or below).
+    State-space search approach to beat tracking: This function goes through the onset strength envelope
+    and finds suitable candidates for beats.
+    :param ose: The onset strength envelope from Ellis-07
+    :param tau_index: Initial estimation of distance to next beat
+    :param is_duple_tempo: Whether duple (True) or triple (False) tempo is assumed
+    :return: The indices of beats and downbeats
+    """
+    # Found beats are store here
+    beats = []
+    # Counter to keep track of the "type" of current beat (e.g. 1, 2, 3, or 4 for a 4/4 measure)
+    downbeat_counter = 1
+    # Metre inferred from estimated tempo function
+    # Supported metres are 3/4 and 4/4
+    metre = 4 if is_duple_tempo else 3
+    beat_numbers = []
+
+    # Find peaks in the onset strength envelope
+    peaks = find_peaks(ose)[0]
+    # Find first peak
+    first_peak = peaks[0]
+    # Set the first beat to the first peak in the onset strength envelope
+    beats.append(first_peak)
+    # Set beat number
+    beat_numbers.append(downbeat_counter)
+    # Variable to keep track of the current position in the onset strength envelope
+    index = first_peak
+    while tau_index >= 1 and index + tau_index < ose.size:
+        # Look for next peak in the range of (index + tau_index) +/- window
+        window = 24  # 96ms
+        # The exact position of the next expected beat, according to the current tempo estimate
+        expected = index + tau_index
+        # The search space around the expected beat
+        space = np.arange(expected - window, expected + window)
+        # Flag indicating whether a peak was found in the current search space
+        found = False
+        # Go through the search space and look for a peak
+        for candidate in space:
+            if candidate > index and candidate in peaks:
+                found = True
+                # Get difference of expectation
+                diff = expected - candidate
+                # Adjust assumed tempo
+                if diff != 0:
+                    tau_index = int((tau_index * 2 - diff) / 2)
+                # Update current position in the onset strength envelope
+                index = candidate
+                # Add found beat to list of beats
+                beats.append(candidate)
+
+                # Reset downbeat counter if it is over the metre value
+                if downbeat_counter > metre:
+                    downbeat_counter = 1
+                # Append current beat number to beat numbers array
+                beat_numbers.append(downbeat_counter)
+                downbeat_counter = downbeat_counter + 1
+                break
+        # If no suitable candidate for a beat was found in the given search space
+        # Start looking for the next peak starting from the current position + a given window size
+        # The size of the window is increased until the next peak is found
+        if found is False:
+            # Assume that there is a longer break
+            # Look for next peak and start again from there
+            candidate = None
+            # Multiplicator for the window: This increases in order to extend the search window
+            # if no suitable candidate has been found yet
+            look_ahead = 1
+            while candidate is None and index + window * look_ahead <= ose.size:
+                ext_window = window * look_ahead
+                cur_peaks = find_peaks(ose[index + tau_index:index + tau_index + ext_window])[0]
+                look_ahead = look_ahead + 1
+                # If a peak was found, choose it for the next beat candidate
+                if len(cur_peaks) > 0:
+                    candidate = index + cur_peaks[0]
+                    index = candidate
+                    break
+            if candidate is None:
+                # Reached the end of the onset strength envelope
+                # Collect indices of downbeats and return results
+                downbeat_indices = [i for i, x in enumerate(beat_numbers) if x == 1]
+                # Convert to onset strength envelope indices
+                downbeats = [beats[i] for i in downbeat_indices]
+                return beats, downbeats
+            else:
+                # If a candidate was found through the extended search append it and continue
+                beats.append(candidate)
+                # The extended search usually happens when there is a longer break in the piece
+                # Therefore the downbeat counter is reset to 1 after break, assuming that the found beat
+                # will be a downbeat
+                downbeat_counter = 1
+                beat_numbers.append(downbeat_counter)
+                downbeat_counter = downbeat_counter + 1
+
+    # Get indices of downbeats
+    downbeat_indices = [i for i, x in enumerate(beat_numbers) if x == 1]
+    # Convert to frame indices
+    downbeats = [beats[i] for i in downbeat_indices]
+    return beats, downbeats
+
+
+def benchmark_state_space_search(durations=DURATIONS, max_baseline_seconds=600):
+    """
+    Compare the peak-index lookups of Main.state_space_search with the original linear scans
+    :param durations: List of durations (in seconds) of the synthetic onset strength envelopes
+    :param max_baseline_seconds: The original search is only timed up to this duration
+    :return: None
+    """
+    print("Duration | Beats | Loop (ms) | Peak index (ms) | Speedup")
+    for seconds in durations:
+        ose, tau_index = synthetic_ose(seconds)
+        # Cut out a few beats so that the extended search is exercised as well
+        ose[ose.size // 3:ose.size // 3 + 10 * tau_index] = 0
+
+        start = time.perf_counter()
+        beats, downbeats = Main.state_space_search(ose, tau_index, True)
+        indexed = time.perf_counter() - start
+
+        loop = None
+        if seconds <= max_baseline_seconds:
+            start = time.perf_counter()
+            beats_loop, downbeats_loop = state_space_search_loop(ose, tau_index, True)
+            loop = time.perf_counter() - start
+            # Both implementations have to agree
+            assert beats == beats_loop and downbeats == downbeats_loop
+
+        if loop is None:
+            print(str(seconds) + "s | " + str(len(beats)) + " | - | " + str(round(indexed * 1000, 1)) + " | -")
+        else:
+            print(str(seconds) + "s | " + str(len(beats)) + " | " + str(round(loop * 1000, 1)) + " | "
+                  + str(round(indexed * 1000, 1)) + " | " + str(round(loop / indexed, 1)))
+
+
+def search_parity_oses(n_cases=500, seed=0):
+    """
+    Onset strength envelopes for the parity checks of the greedy search: Short envelopes at 60-200 BPM that end at
+    random positions, with a silent gap just before the end (so the extended search runs into the end of the
+    envelope) and values rounded to 0.1, which creates plateaus. They are followed by 30s single-tempo envelopes at
+    70-180 BPM with the tempo of Functions.estimate_tempo, on which the tempo adaptation collapses tau_index
+    :param n_cases: Number of short envelopes
+    :param seed: Seed for the random generator
+    :return: List of (name, onset strength envelope, tau_index) tuples
+    """
+    rng = np.random.default_rng(seed)
+    cases = []
+    for case in range(n_cases):
+        ose, tau_index = synthetic_ose(rng.uniform(3, 20), bpm=rng.uniform(60, 200), seed=case)
+        ose = ose[:rng.integers(ose.size // 2, ose.size + 1)]
+        gap = rng.integers(0, 6 * tau_index)
+        end = rng.integers(0, 3 * tau_index)
+        if gap + end < ose.size:
+            ose[ose.size - gap - end:ose.size - end] = 0
+        cases.append(("case " + str(case), np.round(ose, 1), tau_index))
+    Globals.TAU_0 = Functions.find_tempo_period_bias()
+    for seed, bpm in enumerate([70, 87, 100, 120, 135, 150, 165, 180]):
+        ose, _ = synthetic_ose(30, bpm=bpm, seed=seed)
+        cases.append((str(bpm) + " BPM", ose, Functions.estimate_tempo(ose)[1]))
+    return cases
+
+
+def check_state_space_search_parity(n_cases=500):
+    """
+    Main.state_space_search (NumPy backend) has to return exactly the beats and downbeats of the original search,
+    also when the extended search looks ahead close to the end of the envelope and when the tempo collapses.
+    Every search has to finish within SEARCH_TIMEOUT seconds
+    :param n_cases: Number of random envelopes (see search_parity_oses)
+    :return: None
+    """
+    from Evaluation_mir_eval import time_limit, FileTimeoutError
+    cases = search_parity_oses(n_cases)
+    backend = Globals.BACKEND
+    Globals.BACKEND = 'numpy'
+    try:
+        for name, ose, tau_index in cases:
+            try:
+                with time_limit(SEARCH_TIMEOUT):
+                    expected = state_space_search_loop(ose, tau_index, True)
+                    beats, downbeats = Main.state_space_search(ose, tau_index, True)
+            except FileTimeoutError:
+                raise AssertionError(name + ": the search did not finish within " + str(SEARCH_TIMEOUT) + "s")
+            assert (list(beats), list(downbeats)) == (list(expected[0]), list(expected[1])), name
+    finally:
+        Globals.BACKEND = backend
+    print("Greedy search matches the original search on " + str(len(cases)) + " envelopes")
+
+
+def parity_oses(n_files=10):
+    """
+    Onset strength envelopes for the backend parity check: Synthetic envelopes with different tempi, noise and a
+    silent gap, plus the first n_files Ballroom excerpts if the dataset is available
+    :param n_files: Number of Ballroom files
+    :return: List of (name, onset strength envelope) tuples
+    """
+    oses = []
+    for seed, bpm in enumerate([70, 95, 120, 150, 190]):
+        ose, tau_index = synthetic_ose(30, bpm=bpm, seed=seed)
+        ose[ose.size // 2:ose.size // 2 + 4 * tau_index] = 0
+        oses.append(("synthetic " + str(bpm) + " BPM", ose))
+    if os.path.isdir('BallroomData'):
+        import Evaluation_mir_eval
+        for file in Evaluation_mir_eval.find_files(n_files):
+            oses.append((file, Main.file_onset_strength_envelope(file)))
+    return oses
+
+
+def run_pipeline(ose):
+    """
+    Run tempo estimation, the greedy search and the Ellis-07 forward pass on one onset strength envelope
+    """
+    tau_est, tau_index, is_duple_tempo = Functions.estimate_tempo(ose)
+    beats, downbeats = Main.state_space_search(ose, tau_index, is_duple_tempo)
+    C, P_indices = Ellis_07_Search.forward_pass(ose, tau_index)
+    return tau_index, is_duple_tempo, beats, downbeats, C, P_indices
+
+
+def check_backend_parity(n_files=10):
+    """
+    Parity check of the backends: The Numba kernels have to produce exactly the same tempo, beats, downbeats and
+    Ellis-07 objective function as the NumPy code
+    :param n_files: Number of Ballroom files used in addition to the synthetic envelopes
+    :return: None
+    """
+    if not Backend.numba_available():
+        print("Numba is not installed, skipping the backend parity check")
+        return
+    Globals.TAU_0 = Functions.find_tempo_period_bias()
+    backend = Globals.BACKEND
+    try:
+        for name, ose in parity_oses(n_files):
+            Globals.BACKEND = 'numpy'
+            expected = run_pipeline(ose)
+            Globals.BACKEND = 'numba'
+            result = run_pipeline(ose)
+            assert expected[:2] == result[:2], name
+            assert list(expected[2]) == list(result[2]) and list(expected[3]) == list(result[3]), name
+            assert np.array_equal(expected[4], result[4]) and np.array_equal(expected[5], result[5]), name
+            print("Backends agree for " + name)
+        # The extended search close to the end of short envelopes, and envelopes on which the tempo collapses
+        # (a kernel that does not terminate cannot be interrupted, so these only finish because of the guard)
+        cases = search_parity_oses()
+        for name, ose, tau_index in cases:
+            Globals.BACKEND = 'numpy'
+            expected = Main.state_space_search(ose, tau_index, True)
+            Globals.BACKEND = 'numba'
+            result = Main.state_space_search(ose, tau_index, True)
+            assert list(expected[0]) == list(result[0]) and list(expected[1]) == list(result[1]), name
+        print("Backends agree for the greedy search on " + str(len(cases)) + " envelopes")
+    finally:
+        Globals.BACKEND = backend
+
+
+def benchmark_backends(durations=(60, 600)):
+    """
+    Time tempo estimation, the greedy search and the Ellis-07 forward pass per backend
+    :param durations: List of durations (in seconds) of the synthetic onset strength envelopes
+    :return: None
+    """
+    backends = ['numpy'] + (['numba'] if Backend.numba_available() else [])
+    Globals.TAU_0 = Functions.find_tempo_period_bias()
+    backend = Globals.BACKEND
+    print("Backend | Duration | Tempo (ms) | Greedy search (ms) | Ellis-07 forward pass (ms)")
+    try:
+        for name in backends:
+            Globals.BACKEND = name
+            # Compile (or load the cached kernels) before timing
+            run_pipeline(synthetic_ose(10)[0])
+            for seconds in durations:
+                ose, _ = synthetic_ose(seconds)
+                start = time.perf_counter()
+                tau_est, tau_index, is_duple_tempo = Functions.estimate_tempo(ose)
+                tempo = time.perf_counter() - start
+                start = time.perf_counter()
+                Main.state_space_search(ose, tau_index, is_duple_tempo)
+                search = time.perf_counter() - start
+                start = time.perf_counter()
+                Ellis_07_Search.forward_pass(ose, tau_index)
+                ellis = time.perf_counter() - start
+                print(name + " | " + str(seconds) + "s | " + str(round(tempo * 1000, 1)) + " | "
+                      + str(round(search * 1000, 1)) + " | " + str(round(ellis * 1000, 1)))
+    finally:
+        Globals.BACKEND = backend
+
+
+def benchmark_beam_search(beam_widths=(1, 2, 4, 8, 16), n_files=50):
+    """
+    Accuracy vs. throughput of the beam search for different beam widths compared with the greedy search on the
+    first n_files Ballroom excerpts (onset strength envelopes are taken from the cache)
+    :param beam_widths: The beam widths
+    :param n_files: Number of Ballroom files
+    :return: None
+    """
+    if not os.path.isdir('BallroomData'):
+        print("BallroomData not found, skipping the beam search benchmark")
+        return
+    import BeamSearch
+    import Evaluation
+    import Evaluation_mir_eval
+    import FeatureCache
+
+    Globals.TAU_0 = Functions.find_tempo_period_bias()
+    pieces = []
+    for file in Evaluation_mir_eval.find_files(n_files):
+        ose, _ = FeatureCache.onset_strength_envelope(file, Main.file_onset_strength_envelope)
+        tau_est, tau_index, is_duple_tempo = Functions.estimate_tempo(ose)
+        filename = file.split(os.path.sep)[2][:-4] + ".beats"
+        c_beats, c_downbeats = Evaluation.get_beats_from_file(filename, in_seconds=True)
+        pieces.append((ose, tau_index, is_duple_tempo, np.array(c_beats), np.array(c_downbeats)))
+
+    searches = [("greedy", Main.state_space_search)]
+    for beam_width in beam_widths:
+        searches.append(("beam " + str(beam_width),
+                         lambda ose, tau, duple, k=beam_width: BeamSearch.beam_search(ose, tau, duple, beam_width=k)))
+
+    to_seconds = FFT_HOP / OSE_SAMPLE_RATE
+    print("Search | Mean F-measure | Mean F-measure downbeats | Time per file (ms)")
+    for name, search in searches:
+        f_measures = []
+        f_measures_downbeats = []
+        elapsed = 0
+        for ose, tau_index, is_duple_tempo, c_beats, c_downbeats in pieces:
+            start = time.perf_counter()
+            beats, downbeats = search(ose, tau_index, is_duple_tempo)
+            elapsed += time.perf_counter() - start
+            scores = Evaluation_mir_eval.score(c_beats, np.array(beats) * to_seconds, c_downbeats,
+                                               np.array(downbeats) * to_seconds)
+            f_measures.append(scores[0])
+            f_measures_downbeats.append(scores[1])
+        print(name + " | " + str(round(np.mean(f_measures), 3)) + " | " + str(round(np.mean(f_measures_downbeats), 3))
+              + " | " + str(round(elapsed / len(pieces) * 1000, 1)))
+
+
+def benchmark_coarse_to_fine(depths=(1, 2, 3, 4), n_files=50):
+    """
+    Accuracy vs. speed of the coarse-to-fine search for different pyramid depths compared with the full resolution
+    tempo estimation and Ellis-07 search on the first n_files Ballroom excerpts (onset strength envelopes are taken
+    from the cache). The times include the tempo estimation, which the coarse-to-fine search also decimates
+    :param depths: The pyramid depths (1 is the full resolution search within CoarseToFine)
+    :param n_files: Number of Ballroom files
+    :return: None
+    """
+    if not os.path.isdir('BallroomData'):
+        print("BallroomData not found, skipping the coarse-to-fine benchmark")
+        return
+    import CoarseToFine
+    import Ellis_07_Search
+    import Evaluation
+    import Evaluation_mir_eval
+    import FeatureCache
+
+    Globals.TAU_0 = Functions.find_tempo_period_bias()
+    pieces = []
+    for file in Evaluation_mir_eval.find_files(n_files):
+        ose, _ = FeatureCache.onset_strength_envelope(file, Main.file_onset_strength_envelope)
+        filename = file.split(os.path.sep)[2][:-4] + ".beats"
+        c_beats, c_downbeats = Evaluation.get_beats_from_file(filename, in_seconds=True)
+        pieces.append((ose, np.array(c_beats), np.array(c_downbeats)))
+
+    def full_resolution(ose):
+        tau_est, tau_index, is_duple_tempo = Functions.estimate_tempo(ose)
+        beats, _, _ = Ellis_07_Search.ellis_07_search(ose, tau_index)
+        return beats, []
+
+    searches = [("full resolution", full_resolution)]
+    for depth in depths:
+        frame = FFT_HOP * CoarseToFine.FACTOR ** (depth - 1) / OSE_SAMPLE_RATE * 1000
+        searches.append(("depth " + str(depth) + " (" + str(round(frame)) + "ms)",
+                         lambda ose, d=depth: CoarseToFine.coarse_to_fine_search(ose, depth=d)))
+
+    to_seconds = FFT_HOP / OSE_SAMPLE_RATE
+    print("Search | Mean F-measure | Time per file (ms) | Speed-up")
+    reference_time = None
+    for name, search in searches:
+        f_measures = []
+        elapsed = 0
+        for ose, c_beats, c_downbeats in pieces:
+            start = time.perf_counter()
+            beats, downbeats = search(ose)
+            elapsed += time.perf_counter() - start
+            scores = Evaluation_mir_eval.score(c_beats, np.array(beats) * to_seconds, c_downbeats,
+                                               np.array(downbeats) * to_seconds)
+            f_measures.append(scores[0])
+        if reference_time is None:
+            reference_time = elapsed
+        print(name + " | " + str(round(np.mean(f_measures), 3)) + " | " + str(round(elapsed / len(pieces) * 1000, 1))
+              + " | " + str(round(reference_time / max(elapsed, 1e-9), 1)) + "x")
+
+
+def benchmark_tempogram(durations=(30, 180, 600)):
+    """
+    Compare the batched FFT of Tempogram.local_autocorrelations with one Functions.autocorrelate call per window,
+    and check that the tempo curve follows a tempo change (100 BPM for 30s, then 140 BPM for 30s) that the global
+    tempo estimate cannot represent
+    :param durations: Durations of the synthetic onset strength envelopes in seconds
+    :return: None
+    """
+    import Tempogram
+    window = Tempogram.seconds_to_frames(Tempogram.WINDOW)
+    hop = Tempogram.seconds_to_frames(Tempogram.HOP)
+    max_lag = Tempogram.seconds_to_frames(Tempogram.MAX_PERIOD) + 1
+    print("Duration (s) | Windows | Per window (ms) | Batched (ms) | Speed-up | Max. difference")
+    for seconds in durations:
+        ose, _ = synthetic_ose(seconds)
+        start = time.perf_counter()
+        ac_loop = np.array([Functions.autocorrelate(ose[k:k + window], max_lag)
+                            for k in range(0, ose.size - window + 1, hop)])
+        loop = time.perf_counter() - start
+        start = time.perf_counter()
+        ac = Tempogram.local_autocorrelations(ose, window, hop, max_lag)
+        batched = time.perf_counter() - start
+        print(str(seconds) + " | " + str(ac.shape[0]) + " | " + str(round(loop * 1000, 1)) + " | "
+              + str(round(batched * 1000, 1)) + " | " + str(round(loop / max(batched, 1e-9), 1)) + "x | "
+              + str(float(np.max(np.abs(ac - ac_loop)))))
+
+    Globals.TAU_0 = Functions.find_tempo_period_bias()
+    slow, slow_tau = synthetic_ose(30, bpm=100)
+    fast, fast_tau = synthetic_ose(30, bpm=140, seed=1)
+    ose = np.concatenate((slow, fast))
+    curve = Tempogram.tempo_curve(ose)
+    _, tau_index, _ = Functions.estimate_tempo(ose)
+    print("Tempo change " + str(slow_tau) + " -> " + str(fast_tau) + " frames: global estimate " + str(tau_index)
+          + ", median of the tempo curve " + str(int(np.median(curve[:slow.size]))) + " -> "
+          + str(int(np.median(curve[slow.size:]))))
+    for name, tau in [("global tempo", tau_index), ("tempo curve", curve)]:
+        beats, _, _ = Ellis_07_Search.ellis_07_search(ose, tau)
+        intervals = np.diff(beats)
+        half = len(intervals) // 2
+        print("Ellis-07 search with the " + name + ": median beat interval " + str(np.median(intervals[:half]))
+              + " -> " + str(np.median(intervals[half:])) + " frames")
+
+
+def check_bar_pointer_downbeats(cases=None, seconds=30):
+    """
+    The bar-pointer model has to find beats and downbeats of the benchmark fixtures (mean F-measure of at least
+    DOWNBEAT_AGREEMENT for both): Click tracks in 3/4 and 4/4, whose downbeat clicks are higher and weaker in the onset
+    strength envelope than the other clicks, and 3/4 drum loops with a kick on every downbeat (the drum loops at
+    higher tempi and in 4/4, with a kick on beats 1 and 3, are left out as their beats or downbeats are ambiguous)
+    :param cases: (kind, bpm, metre) tuples, by default all click tracks of the benchmark suite and the 3/4 drum loops
+    at 60 and 90 BPM
+    :param seconds: Duration of the fixtures in seconds
+    :return: None
+    """
+    import BarPointer
+    from benchmarks import fixtures, suite
+    if cases is None:
+        cases = [('click', bpm, metre) for metre in suite.METRES for bpm in suite.TEMPI]
+        cases += [('drums', 60, 3), ('drums', 90, 3)]
+    margin = np.ceil((Evaluation.MARGIN * 0.001) * OSE_SAMPLE_RATE / FFT_HOP / 2)
+
+    def f_measure(found, correct):
+        correct = np.round(correct * OSE_SAMPLE_RATE / FFT_HOP).astype(int)
+        return Evaluation.f_measure_from_counts(*Evaluation.match_beats(found, correct, margin))
+
+    print("Fixture | Metre | BPM | Beat F-measure | Downbeat F-measure")
+    scores = []
+    for kind, bpm, metre in cases:
+        ose = Main.file_onset_strength_envelope(fixtures.fixture(kind, bpm, metre, seconds))
+        beats, downbeats = fixtures.beat_times(bpm, metre, seconds)
+        found_beats, found_downbeats = BarPointer.bar_pointer_search(ose)
+        scores.append((f_measure(found_beats, beats), f_measure(found_downbeats, downbeats)))
+        print(kind + " | " + str(metre) + " | " + str(bpm) + " | " + str(round(scores[-1][0], 2)) + " | "
+              + str(round(scores[-1][1], 2)))
+    beat_score, downbeat_score = np.mean(scores, axis=0)
+    print("Mean: " + str(round(beat_score, 3)) + " | " + str(round(downbeat_score, 3)))
+    assert beat_score >= DOWNBEAT_AGREEMENT and downbeat_score >= DOWNBEAT_AGREEMENT, (beat_score, downbeat_score)
+
+
+def benchmark_bar_pointer(seconds=30, budget=BAR_POINTER_BUDGET):
+    """
+    Time the bar-pointer decoder on a synthetic onset strength envelope with the length of a Ballroom excerpt
+    (the state space is built before timing, as it is only built once per process)
+    :param seconds: Duration in seconds
+    :param budget: The decoding has to take at most this many seconds
+    :return: None
+    """
+    import BarPointer
+    start = time.perf_counter()
+    model = BarPointer.get_model()
+    setup = time.perf_counter() - start
+    ose, _ = synthetic_ose(seconds)
+    start = time.perf_counter()
+    beats, downbeats = BarPointer.bar_pointer_search(ose)
+    decode = time.perf_counter() - start
+    print("Bar-pointer model: " + str(model.size) + " states, " + str(model.transitions.nnz) + " transitions, built in "
+          + str(round(setup * 1000, 1)) + "ms")
+    print("Decoded " + str(seconds) + "s in " + str(round(decode * 1000, 1)) + "ms: " + str(len(beats)) + " beats, "
+          + str(len(downbeats)) + " downbeats")
+    assert decode <= budget, "Decoding took " + str(round(decode, 2)) + "s, the budget is " + str(budget) + "s"
+
+
+def import_time(module):
+    """
+    Measure the cold-start import time of a module in a fresh interpreter with "python -X importtime"
+    :param module: Name of the module
+    :return: The cumulative import time in ms and the set of all imported modules
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+    cumulative = None
+    imported = set()
+    # Lines have the format "import time: <self us> | <cumulative us> | <indented module name>"
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, total, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        imported.add(name)
+        if name == module:
+            cumulative = int(total) / 1000
+    return cumulative, imported
+
+
+def check_import_time(module='Main', budget=IMPORT_TIME_BUDGET):
+    """
+    Regression check for the import time of a module: Fails if it takes longer than the budget or if it imports
+    one of LAZY_MODULES
+    :param module: Name of the module
+    :param budget: The budget in ms
+    :return: True if the check passed
+    """
+    cumulative, imported = import_time(module)
+    eager = [name for name in LAZY_MODULES if name in imported]
+    print("Import time of " + module + ": " + str(round(cumulative, 1)) + "ms (budget " + str(budget) + "ms)")
+    if len(eager) > 0:
+        print("Modules that should be imported lazily: " + ", ".join(eager))
+    return cumulative <= budget and len(eager) == 0
+
+
+if __name__ == "__main__":
+    # "python Benchmark.py import-time" only runs the import time check and exits with a non-zero status on failure
+    if sys.argv[1:] == ['import-time']:
+        sys.exit(0 if check_import_time() else 1)
+    benchmark_ellis_07_search()
+    check_tempo_parity()
+    check_triple_metre()
+    check_state_space_search_parity()
+    benchmark_state_space_search()
+    benchmark_beat_matching()
+    benchmark_batched_ose()
+    benchmark_ose_dtype()
+    benchmark_decode()
+    check_chunked_ose()
+    benchmark_chunked_ose()
+    check_backend_parity()
+    benchmark_backends()
+    benchmark_beam_search()
+    benchmark_coarse_to_fine()
+    benchmark_tempogram()
+    benchmark_bar_pointer()
+    check_bar_pointer_downbeats()
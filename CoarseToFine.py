@@ -0,0 +1,149 @@
+import numpy as np
+
+import Ellis_07_Search
+import Functions
+import Globals
+import Profiling
+
+# Decimation factor between two levels of the pyramid (a depth of 3 gives 16ms, 8ms and 4ms frames)
+FACTOR = 2
+
+
+def decimate(ose, factor=FACTOR):
+    """
+    Decimate an onset strength envelope by taking the maximum of every "factor" frames, so that onsets are not
+    smeared out or lost between two coarse frames
+    :param ose: The onset strength envelope
+    :param factor: The decimation factor
+    :return: The decimated envelope (a trailing partial block is dropped)
+    """
+    n = ose.size // factor
+    return ose[:n * factor].reshape(n, factor).max(axis=1)
+
+
+def pyramid(ose, depth):
+    """
+    The onset strength envelope at depth resolutions, from the full resolution to the coarsest one
+    """
+    levels = [np.asarray(ose, dtype=float)]
+    for _ in range(depth - 1):
+        levels.append(decimate(levels[-1]))
+    return levels
+
+
+def lag_strengths(ose, lags, weighting):
+    """
+    Weighted autocorrelation for a few lags, calculated directly instead of for the whole lag range
+    :param ose: The onset strength envelope
+    :param lags: The lags (> 0)
+    :param weighting: The tempo weighting window (at least max(lags) + 1 long)
+    :return: weighting[lag] * autocorrelation[lag] for every lag (0 for lags beyond the envelope)
+    """
+    return np.array([weighting[lag] * (ose[:-lag] @ ose[lag:]) if 0 < lag < ose.size else 0.0 for lag in lags])
+
+
+def refine_tempo(ose, index, metre, scale, weighting, multiple_weighting=None):
+    """
+    Refine a tempo estimate of a coarse level at full resolution, only looking at the lags within one coarse frame
+    :param ose: The full resolution onset strength envelope
+    :param index: Index of the coarse estimate in its tempo period strengths (TPS, TPS2 or TPS3)
+    :param metre: 0, 1 or 2 for TPS, TPS2 or TPS3 (see Functions.tempo_from_strengths)
+    :param scale: Decimation factor of the coarse level
+    :param weighting: The full resolution tempo weighting window
+    :param multiple_weighting: Optional weighting window of the multiples in TPS2 and TPS3, defaults to weighting
+    :return: The refined index at full resolution
+    """
+    if multiple_weighting is None:
+        multiple_weighting = weighting
+    # Entry i of TPS is the lag i + 1, entry i of TPS2 and TPS3 is based on the lag i + 2 (see
+    # Functions.tempo_period_strengths), and a lag of the coarse level is scale lags at full resolution
+    offset = 1 if metre == 0 else 2
+    centre = (index + offset) * scale - offset
+    candidates = np.arange(max(0, centre - scale), centre + scale + 1)
+    if metre == 0:
+        strengths = lag_strengths(ose, candidates + 1, weighting)
+    elif metre == 1:
+        strengths = (lag_strengths(ose, candidates + 2, weighting)
+                     + 0.5 * lag_strengths(ose, 2 * candidates + 3, multiple_weighting)
+                     + 0.25 * lag_strengths(ose, 2 * candidates + 2, multiple_weighting)
+                     + 0.25 * lag_strengths(ose, 2 * candidates + 4, multiple_weighting))
+    else:
+        strengths = (lag_strengths(ose, candidates + 2, weighting)
+                     + 0.33 * lag_strengths(ose, 3 * candidates + 4, multiple_weighting)
+                     + 0.33 * lag_strengths(ose, 3 * candidates + 3, multiple_weighting)
+                     + 0.33 * lag_strengths(ose, 3 * candidates + 5, multiple_weighting))
+    return int(candidates[np.argmax(strengths)])
+
+
+def estimate_tempo(levels, prior=None):
+    """
+    Estimate the tempo on the coarsest level of the pyramid and refine it at full resolution
+    :param levels: The pyramid returned by pyramid
+    :param prior: Optional TempoPrior used instead of the global tempo weighting for the candidate beat periods (the
+    multiples in TPS2 and TPS3 keep the global weighting, see Functions.estimate_tempo)
+    :return: The tempo in full resolution frames and whether duple (True) or triple (False) tempo is assumed
+    """
+    scale = FACTOR ** (len(levels) - 1)
+    R = max(2, Functions.TEMPO_SEARCH_RANGE // scale)
+    ac = Functions.autocorrelate(levels[-1], 3 * R)
+    # The full resolution weighting (long enough for the lags refine_tempo looks at), sampled at the coarse lags
+    length = 3 * (Functions.TEMPO_SEARCH_RANGE + 2 * scale) + 6
+    weighting = Functions.tempo_weighting_window(length)
+    multiple_weighting = None
+    if prior is not None:
+        weighting, multiple_weighting = prior.weighting(length), weighting
+    coarse_weighting = np.ascontiguousarray(weighting[:ac.size * scale:scale])
+    coarse_multiple_weighting = None
+    if multiple_weighting is not None:
+        coarse_multiple_weighting = np.ascontiguousarray(multiple_weighting[:ac.size * scale:scale])
+    TPS, TPS2, TPS3 = Functions.tempo_period_strengths(ac, coarse_weighting, R, coarse_multiple_weighting)
+    indices = [np.argmax(TPS), np.argmax(TPS2), np.argmax(TPS3)]
+    metre = int(np.argmax([TPS[indices[0]], TPS2[indices[1]], TPS3[indices[2]]]))
+    if scale == 1:
+        return indices[metre], metre < 2
+    return refine_tempo(levels[0], indices[metre], metre, scale, weighting, multiple_weighting), metre < 2
+
+
+def refine_beats(levels, beats):
+    """
+    Move beats found on the coarsest level down the pyramid: On every finer level, a beat is placed at the maximum
+    of the envelope within one coarse frame around the frames it covers
+    :param levels: The pyramid returned by pyramid
+    :param beats: Beat indices on the coarsest level
+    :return: Beat indices at full resolution
+    """
+    beats = np.asarray(beats, dtype=int)
+    for ose in reversed(levels[:-1]):
+        refined = []
+        for beat in beats:
+            start = max(0, (beat - 1) * FACTOR)
+            stop = min(ose.size, (beat + 2) * FACTOR)
+            refined.append(start + int(np.argmax(ose[start:stop])))
+        beats = np.array(refined, dtype=int)
+    return beats
+
+
+@Profiling.profiled('coarse_to_fine_search')
+def coarse_to_fine_search(ose, depth=None, prior=None):
+    """
+    Coarse-to-fine version of the tempo estimation and the Ellis-07 dynamic program: The envelope is decimated
+    depth - 1 times by FACTOR, tempo and beats are searched on the coarsest level, and the tempo and the beat
+    positions are then refined in narrow windows at the finer resolutions.
+    The dynamic program costs O(frames * tempo) and both shrink by the decimation factor, so a depth of 3 reduces
+    the work of the global search by a factor of 16
+    :param ose: The onset strength envelope
+    :param depth: Number of levels of the pyramid (1 is the full resolution search), defaults to Globals.PYRAMID_DEPTH
+    :param prior: Optional TempoPrior used instead of the global tempo weighting
+    :return: The indices of beats and downbeats (the dynamic program does not find downbeats, so the list is empty)
+    """
+    if depth is None:
+        depth = Globals.PYRAMID_DEPTH
+    levels = pyramid(ose, depth)
+    with Profiling.span('tempo'):
+        tau_index, is_duple_tempo = estimate_tempo(levels, prior)
+    scale = FACTOR ** (depth - 1)
+    with Profiling.span('dynamic_program'):
+        beats, _, _ = Ellis_07_Search.ellis_07_search(levels[-1], max(1, int(round(tau_index / scale))))
+    with Profiling.span('refine'):
+        beats = refine_beats(levels, beats)
+    return [int(beat) for beat in beats], []
@@ -1,42 +1,25 @@
 import numpy as np
+import Backend
 import Globals
 import Functions
+import Profiling
 from scipy.signal import find_peaks
 
 # Weighting factor for the two terms in the objective function
 ALPHA = 30
 
-def ellis_07_search(ose, tau_index):
+@Profiling.profiled('ellis_07_search')
+def ellis_07_search(ose, tau_index, alpha=ALPHA):
     Globals.TAU_0 = Functions.find_tempo_period_bias()
 
     # Naming conventions per paper: C is the objective function
-    C = np.zeros(ose.size)
-    # Indices of previous beats
-    P_indices = np.zeros(ose.size, dtype=int)
-
-    # Forward pass
-    def calculate_beat(t):
-        if t == 0:
-            return ose[t]
-
-        # For each point in time store index of previous best match for beat
-        startwidth = t - int(tau_index * 2)
-        endwidth = t - int(tau_index * 0.5)
-        start_idx = startwidth if startwidth > 0 else 0
-        end_idx = endwidth if endwidth > 0 else t
-        window = end_idx - start_idx
-
-        P_temp = np.zeros(window)
-        for j in range(window):
-            error = ALPHA * Functions.F_squared_error(t - j, tau_index)
-            P_temp[j] = error + C[j]
-        previous_best = start_idx + np.argmax(P_temp)
-
-        P_indices[t] = previous_best
-        return ose[t] + np.max(P_temp)
-
-    for i in range(ose.size):
-        C[i] = calculate_beat(i)
+    # P_indices stores the indices of previous beats
+    # A tempo curve (e.g. Tempogram.tempo_curve) gives the tempo of every frame instead of one global tempo
+    if np.ndim(tau_index) > 0:
+        C, P_indices = forward_pass_varying(ose, tau_index, alpha)
+        tau_index = int(tau_index[-1])
+    else:
+        C, P_indices = forward_pass(ose, tau_index, alpha)
 
     # look for the largest value of C∗ (which will typically be within "tau_index" of the END of the time range)
     # Stores the index of the final beat
@@ -55,4 +38,120 @@ def ellis_07_search(ose, tau_index):
     # Reverse so the order is correct
     beats.reverse()
 
-    return beats, [], ose
\ No newline at end of file
+    return beats, [], ose
+
+
+def transition_kernel(tau_index, alpha=ALPHA):
+    """
+    Precompute the weighted transition penalty for every possible distance between two beats.
+    The penalty only depends on the distance and the tempo estimate, so it is calculated once per tau_index
+    instead of once per frame and predecessor
+    :param tau_index: Current tempo estimate in frames
+    :param alpha: Weighting factor of the transition penalty
+    :return: Array of length int(2 * tau_index) + 1, where entry d holds the penalty for a beat d frames
+    after its predecessor (entry 0 is unused)
+    """
+    longest = int(tau_index * 2)
+    kernel = np.full(longest + 1, -np.inf)
+    kernel[1:] = alpha * Functions.F_squared_error(np.arange(1, longest + 1), tau_index)
+    return kernel
+
+
+def forward_pass(ose, tau_index, alpha=ALPHA):
+    """
+    Forward pass of the Ellis-07 dynamic program: For every frame t calculate the best score C[t] of a beat sequence
+    ending at t and the index of the best preceding beat P_indices[t].
+    Predecessors are searched in the range [t - 2 * tau_index, t - 0.5 * tau_index). As no predecessor is closer than
+    int(0.5 * tau_index) + 1 frames, the scores of that many consecutive frames only depend on already finished
+    frames and can be calculated at once as a sliding-window max/argmax over C
+    :param ose: The onset strength envelope
+    :param tau_index: Tempo estimate in frames
+    :param alpha: Weighting factor of the transition penalty
+    :return: The objective function C and the indices of the previous beats
+    """
+    longest = int(tau_index * 2)
+    shortest = int(tau_index * 0.5) + 1
+    kernel = transition_kernel(tau_index, alpha)
+    if Backend.use_numba():
+        return Backend.kernels().forward_pass(np.ascontiguousarray(ose, dtype=np.float64), kernel, longest, shortest)
+
+    # C is padded with -inf on the left so that every frame has a full window of predecessors
+    C_padded = np.full(ose.size + longest, -np.inf)
+    C = C_padded[longest:]
+    P_indices = np.zeros(ose.size, dtype=int)
+    if ose.size == 0:
+        return C, P_indices
+    C[0] = ose[0]
+
+    # Lead-in: The first frames can use every earlier frame as predecessor, which makes them depend on each other
+    for t in range(1, min(shortest, ose.size)):
+        P_temp = kernel[t:0:-1] + C[:t]
+        P_indices[t] = np.argmax(P_temp)
+        C[t] = ose[t] + P_temp[P_indices[t]]
+
+    # Row t of the sliding window view holds C[t - longest:t - shortest + 1], i.e. all valid predecessors of t
+    windows = np.lib.stride_tricks.sliding_window_view(C_padded, longest - shortest + 1)
+    # Penalty in the same order as the window (oldest predecessor first, so ties resolve to the earliest beat)
+    window_kernel = kernel[longest:shortest - 1:-1]
+    for start in range(shortest, ose.size, shortest):
+        end = min(start + shortest, ose.size)
+        P_temp = windows[start:end] + window_kernel
+        best = np.argmax(P_temp, axis=1)
+        rows = np.arange(end - start)
+        P_indices[start:end] = np.arange(start, end) - longest + best
+        C[start:end] = ose[start:end] + P_temp[rows, best]
+
+    return C, P_indices
+
+
+def forward_pass_varying(ose, tempo, alpha=ALPHA):
+    """
+    Forward pass of the Ellis-07 dynamic program with a time-varying tempo: The predecessors of frame t and their
+    penalties depend on tempo[t]. Runs of frames with the same tempo are processed like in forward_pass, in blocks
+    of frames that only depend on already finished frames (the Numba kernel only supports a constant tempo)
+    :param ose: The onset strength envelope
+    :param tempo: Tempo estimate in frames for every frame of the envelope (see Tempogram.tempo_curve)
+    :param alpha: Weighting factor of the transition penalty
+    :return: The objective function C and the indices of the previous beats
+    """
+    tempo = np.asarray(tempo, dtype=int)
+    # C is padded with -inf on the left so that every frame has a full window of predecessors at any tempo
+    padding = int(tempo.max() * 2) if tempo.size > 0 else 0
+    C_padded = np.full(ose.size + padding, -np.inf)
+    C = C_padded[padding:]
+    P_indices = np.zeros(ose.size, dtype=int)
+    if ose.size == 0:
+        return C, P_indices
+    C[0] = ose[0]
+
+    # Lead-in with the tempo of the first frame (see forward_pass)
+    lead_in = min(int(tempo[0] * 0.5) + 1, ose.size)
+    kernel = transition_kernel(tempo[0], alpha)
+    for t in range(1, lead_in):
+        P_temp = kernel[t:0:-1] + C[:t]
+        P_indices[t] = np.argmax(P_temp)
+        C[t] = ose[t] + P_temp[P_indices[t]]
+
+    # Boundaries of the runs of frames with the same tempo
+    bounds = np.concatenate(([lead_in], np.flatnonzero(np.diff(tempo[lead_in:])) + lead_in + 1, [ose.size]))
+    for run_start, run_end in zip(bounds[:-1], bounds[1:]):
+        if run_start == run_end:
+            # The lead-in covers the whole envelope
+            continue
+        tau_index = int(tempo[run_start])
+        longest = int(tau_index * 2)
+        shortest = int(tau_index * 0.5) + 1
+        kernel = transition_kernel(tau_index, alpha)
+        # Row r of the sliding window view holds C[r - padding:r - padding + longest - shortest + 1], so row
+        # t + padding - longest holds all valid predecessors of t
+        windows = np.lib.stride_tricks.sliding_window_view(C_padded, longest - shortest + 1)
+        window_kernel = kernel[longest:shortest - 1:-1]
+        for start in range(run_start, run_end, shortest):
+            end = min(start + shortest, run_end)
+            P_temp = windows[start + padding - longest:end + padding - longest] + window_kernel
+            best = np.argmax(P_temp, axis=1)
+            rows = np.arange(end - start)
+            P_indices[start:end] = np.arange(start, end) - longest + best
+            C[start:end] = ose[start:end] + P_temp[rows, best]
+
+    return C, P_indices
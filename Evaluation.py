@@ -1,11 +1,12 @@
 import os
+import time
 from pathlib import Path
 
 import numpy as np
 
 import Functions
 import Main
-import Plot
+import Profiling
 from Globals import OSE_SAMPLE_RATE, FFT_HOP
 
 from Ellis_07_Search import ellis_07_search
@@ -14,6 +15,8 @@ from Ellis_07_Search import ellis_07_search
 MARGIN = 70
 # Limit for evaluate_all()
 N = 20
+# Default file the stage-level profile of evaluate_all() is saved to
+PROFILE_FILE = "profile.json"
 
 def get_beats_from_file(file, in_seconds=False):
     """
@@ -42,11 +45,12 @@ def get_beats_from_file(file, in_seconds=False):
 
         return beats, downbeats
 
-def evaluate_file(file, ellis=False):
+def evaluate_file(file, ellis=False, cache=True):
     """
     Analyse a given file and calculate its f-measure
     :param file: The path to the *.wav file
     :param ellis: If set to true, the algorithm specified by Ellis 2007 will be used for the beat calculation
+    :param cache: Whether the onset strength envelope is taken from the on-disk cache (see FeatureCache)
     :return: The correct beats (read from *.beats file), the found beats, the correct downbeats, the downbeats,
     the onset strength envelope, accuracy for true positives of beats and downbeats, f-measure for beats and downbeats
     """
@@ -54,7 +58,7 @@ def evaluate_file(file, ellis=False):
     # And replace ".wav" with ".beats"
     filename = file.split(os.path.sep)[2][:-4] + ".beats"
     c_beats, c_downbeats = get_beats_from_file(filename)
-    beats, downbeats, ose, sig = Main.analyse(file)
+    beats, downbeats, ose, sig = Main.analyse(file, cache=cache)
 
     # Convert beats and downbeats from seconds to frames to compare
     # int conversion necessary because for this evaluation method values are indices
@@ -71,96 +75,74 @@ def evaluate_file(file, ellis=False):
     # So 70 ms allow for 35ms before and 35ms after
     margin = np.ceil((MARGIN * 0.001) * OSE_SAMPLE_RATE / FFT_HOP / 2)
     # True positives, false positives, false negatives, for beats and downbeats respectively
-    TP = []
-    FP = []
-    FN = []
-    TP_D = []
-    FP_D = []
-    FN_D = []
-    # Get TP
-    for i in range(len(beats)):
-        # Get allowed values for current beat
-        space = np.arange(beats[i] - margin, beats[i] + margin, 1, dtype=int)
-        for allowed in space:
-            if allowed in c_beats:
-                TP.append(beats[i])
-                if beats[i] in downbeats and allowed in c_downbeats:
-                    TP_D.append(beats[i])
-
-    # Get FN: Beat should exist, but is missing
-    for i in range(len(c_beats)):
-        space = np.arange(c_beats[i] - margin, c_beats[i] + margin, 1, dtype=int)
-        found = False
-        for allowed in space:
-            if allowed in beats:
-                found = True
-                break
-        if not found:
-            FN.append(c_beats[i])
-
-    # Get FP: Beat should not exist, but something was found
-    for i in range(len(beats)):
-        space = np.arange(beats[i] - margin, beats[i] + margin, 1, dtype=int)
-        found = False
-        for allowed in space:
-            if allowed in c_beats:
-                found = True
-                break
-        if not found:
-            # Increase false positives
-            FP.append(beats[i])
-
-    # Get FN Downbeats: Beat should be downbeat, but is not
-    for c_downbeat in c_downbeats:
-        start = c_downbeat - margin if c_downbeat - margin >= 0 else 0
-        end = c_downbeat + margin if c_downbeat + margin < ose.size else ose.size
-        space = np.arange(start, end, 1, dtype=int)
-        found = False
-        for candidate in space:
-            if candidate in downbeats:
-                found = True
-                break
-        if not found:
-            FN_D.append(c_downbeat)
-
-    # Get FP Downbeats: Beat should not be downbeat, but was classified as such
-    for db_idx in downbeats:
-        space = np.arange(db_idx - margin, db_idx + margin, 1, dtype=int)
-        misclassified = True
-        for allowed in space:
-            if allowed in c_downbeats:
-                misclassified = False
-        if misclassified:
-            FP_D.append(db_idx)
+    start = time.perf_counter()
+    TP, FP, FN = match_beats(beats, c_beats, margin)
+    TP_D, FP_D, FN_D = match_beats(downbeats, c_downbeats, margin)
+    matching_time = time.perf_counter() - start
 
     # Calculate F-measure for beats
-    if len(TP) == 0:
-        f_measure = 0
-    else:
-        precision = len(TP) / (len(TP) + len(FP))
-        recall = len(TP) / (len(TP) + len(FN))
-        f_measure = 2 * ((precision * recall) / (precision + recall))
-
+    f_measure = f_measure_from_counts(TP, FP, FN)
     # Calculate F-measure for downbeats
-    if len(TP_D) == 0:
-        f_measure_d = 0
-    else:
-        precision_d = len(TP_D) / (len(TP_D) + len(FP_D))
-        recall_d = len(TP_D) / (len(TP_D) + len(FN_D))
-        f_measure_d = 2 * ((precision_d * recall_d) / (precision_d + recall_d))
+    f_measure_d = f_measure_from_counts(TP_D, FP_D, FN_D)
 
     # Calculate avg score for TP (beats and downbeats)
-    acc_TP = len(TP) / len(c_beats)
-    acc_TP_down = len(TP_D) / len(c_downbeats)
+    acc_TP = TP / len(c_beats)
+    acc_TP_down = TP_D / len(c_downbeats)
 
     # Print evaluation
     print("TP accuracy for " + filename[:-6] + ".wav: " + str(round(acc_TP, 2)))
     print("TP downbeat accuracy: " + str(round(acc_TP_down, 2)))
     print("F-measure: " + str(round(f_measure, 2)))
     print("F-measure for downbeats: " + str(round(f_measure_d, 2)))
+    print("Matching took " + str(round(matching_time * 1000, 2)) + "ms")
     return c_beats, beats, c_downbeats, downbeats, ose, acc_TP, acc_TP_down, f_measure, f_measure_d
 
-def evaluate_all(ellis=False):
+def match_beats(beats, c_beats, margin):
+    """
+    One-to-one matching of found beats to correct beats: A correct beat c can be matched to a found beat b if
+    b - margin <= c < b + margin, and every beat is matched at most once.
+    Both sequences are sorted, so matching every found beat (in order) to the earliest unmatched correct beat in its
+    window is optimal. The first candidate for each found beat is located with a binary search, which makes the
+    matching O((n + m) log m)
+    :param beats: The found beats (in frames)
+    :param c_beats: The correct beats (in frames)
+    :param margin: Allowed inaccuracy in each direction (in frames)
+    :return: Number of true positives, false positives and false negatives
+    """
+    beats = np.sort(np.asarray(beats))
+    c_beats = np.sort(np.asarray(c_beats))
+    # Index of the first correct beat in the window of each found beat
+    first = np.searchsorted(c_beats, beats - margin, side='left')
+    TP = 0
+    # Index of the first correct beat that has not been matched or skipped yet
+    j = 0
+    for i in range(beats.size):
+        j = max(j, first[i])
+        if j < c_beats.size and c_beats[j] < beats[i] + margin:
+            TP = TP + 1
+            j = j + 1
+    return TP, beats.size - TP, c_beats.size - TP
+
+
+def f_measure_from_counts(TP, FP, FN):
+    """
+    Calculate the F-measure from the number of true positives, false positives and false negatives
+    """
+    if TP == 0:
+        return 0
+    precision = TP / (TP + FP)
+    recall = TP / (TP + FN)
+    return 2 * ((precision * recall) / (precision + recall))
+
+
+def evaluate_all(ellis=False, profile=None):
+    """
+    Evaluate the first N files
+    :param ellis: If set to true, the algorithm specified by Ellis 2007 will be used for the beat calculation
+    :param profile: Optional path to a JSON file the stage-level profile of the run is saved to (see Profiling)
+    """
+    if profile is not None:
+        Profiling.enable()
     # Evaluate N files
     accuracies = []
     accuracies_d = []
@@ -168,15 +150,20 @@ def evaluate_all(ellis=False):
     f_measures_d = []
     files = Path('BallroomData').rglob('*.wav')
     counter = 0
-    for file in files:
-        correct_beats, beats, correct_downbeats, downbeats, ose, acc_TP, acc_TP_down, f_measure, f_measure_d = evaluate_file(str(file), ellis)
-        accuracies.append(acc_TP)
-        accuracies_d.append(acc_TP_down)
-        f_measures.append(f_measure)
-        f_measures_d.append(f_measure_d)
-        counter = counter + 1
-        if counter > N:
-            break
+    try:
+        for file in files:
+            with Profiling.profile_file(str(file)):
+                correct_beats, beats, correct_downbeats, downbeats, ose, acc_TP, acc_TP_down, f_measure, f_measure_d = evaluate_file(str(file), ellis)
+            accuracies.append(acc_TP)
+            accuracies_d.append(acc_TP_down)
+            f_measures.append(f_measure)
+            f_measures_d.append(f_measure_d)
+            counter = counter + 1
+            if counter > N:
+                break
+    finally:
+        if profile is not None:
+            Profiling.disable()
 
     # Info
     print("Mean TP accuracy over " + str(N) + " files: " + str(round(np.mean(accuracies), 2)))
@@ -184,6 +171,9 @@ def evaluate_all(ellis=False):
     print("Mean F-measure: " + str(round(np.mean(f_measures), 2)))
     print("Mean F-measure for downbeats: " + str(round(np.mean(f_measures_d), 2)))
 
+    if profile is not None:
+        print(Profiling.save_report(profile, Profiling.take_records()))
+
 
 # current_file = "BallroomData\\ChaChaCha\\Albums-Cafe_Paradiso-07.wav"
 # current_file = "BallroomData\\ChaChaCha\\Albums-Cafe_Paradiso-06.wav"
@@ -1,56 +1,228 @@
+import argparse
 import glob
+import json
 import os
+import signal
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import partial
 import numpy as np
-import mir_eval
 from pathlib import Path
 
 import Evaluation
+import FeatureCache
+import Profiling
 import Functions
 import Main
-import Plot
 
-ANNOTATION_FOLDER = "CreatedAnnotations"
+# Default file the annotations of a run are exported to
+ANNOTATION_FILE = "annotations.npz"
+# Default file the stage-level profile of a run is saved to
+PROFILE_FILE = "profile.json"
 
-def analyse_all(limit=None):
+def find_files(limit=None):
+    """
+    Collect the "*.wav" files in the folder 'BallroomData' in a stable order
+    :param limit: Optionally limit the number of files
+    :return: List of file paths as strings
+    """
+    files = sorted(str(file) for file in Path('BallroomData').rglob('*.wav'))
+    return files if limit is None else files[:limit]
+
+
+def analyse_all(limit=None, jobs=1, chunk_size=4, timeout=None, journal=None, export=None, cache=True,
+                search='greedy', style=None, profile=None):
     """
     Analyse all files in the folder 'BallroomData'
     :param limit: Optionally limit the number of analysed files for quicker run
-    :return: None
-    """
-    f_measures = []
-    f_measures_downbeats = []
-    cemgils = []
-    continuities = []
-    files = Path('BallroomData').rglob('*.wav')
-    number_of_files = len([_ for _ in files])  # This call "invalidates" the pathlib object
-    # Reset pathlib object
-    files = Path('BallroomData').rglob('*.wav')
-    counter = 1
-    for file in files:
-        # Print progress
-        print("Progress: Analysed " + str(counter) + "/" + str(number_of_files) + " files")
-        f_measure, f_measure_downbeats, cemgil, continuity = analyse(str(file))
-        f_measures.append(f_measure)
-        f_measures_downbeats.append(f_measure_downbeats)
-        cemgils.append(cemgil)
-        continuities.append(continuity)
-        counter = counter + 1
-        if limit is not None and counter > limit:
-            break
+    :param jobs: Number of worker processes. With 1 job the files are analysed serially in this process
+    :param chunk_size: Number of files per work unit sent to a worker process
+    :param timeout: Optional time limit in seconds per file. Files that exceed it are skipped (Unix only)
+    :param journal: Optional path to a results journal. Every analysed file is appended to it and files found in it
+    are not analysed again, so an interrupted run can be resumed
+    :param export: Optional path to a *.npz file the estimated and correct beats and downbeats of all files analysed
+    in this run are saved to (see save_annotations)
+    :param cache: Whether the onset strength envelopes are taken from the on-disk cache (see FeatureCache)
+    :param search: The beat search passed to Main.analyse ("greedy", "beam", "hmm" or "coarse")
+    :param style: The style hint passed to analyse (None, "auto" or "folder")
+    :param profile: Optional path to a JSON file the stage-level profile of the run is saved to (see Profiling)
+    :return: Tuple of mean F-measure, mean F-measure for downbeats, mean Cemgil and mean continuity score
+    """
+    files = find_files(limit)
+    number_of_files = len(files)
+
+    # Results of previous runs
+    results = read_journal(journal) if journal is not None else {}
+    pending = [file for file in files if file not in results]
+    if len(results) > 0:
+        print("Resuming: " + str(number_of_files - len(pending)) + "/" + str(number_of_files)
+              + " files found in journal")
+
+    chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+    counter = number_of_files - len(pending)
+    annotations = {}
+    cache_stats = {'hits': 0, 'misses': 0}
+    span_records = []
+    work = partial(analyse_chunk, timeout=timeout, export=export is not None, cache=cache, search=search,
+                   style=style, profile=profile is not None)
+    if jobs == 1:
+        completed = (work(chunk) for chunk in chunks)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        completed = (future.result() for future in as_completed([executor.submit(work, chunk) for chunk in chunks]))
+    try:
+        for chunk_results, chunk_cache_stats, chunk_span_records in completed:
+            span_records.extend(chunk_span_records)
+            for key in cache_stats:
+                cache_stats[key] += chunk_cache_stats[key]
+            for file, scores, file_annotations in chunk_results:
+                results[file] = scores
+                if file_annotations is not None:
+                    annotations.update(file_annotations)
+                if journal is not None:
+                    write_journal(journal, file, scores)
+                counter = counter + 1
+                # Print progress
+                print("Progress: Analysed " + str(counter) + "/" + str(number_of_files) + " files")
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        # Write the annotations collected so far in one go
+        if export is not None:
+            save_annotations(export, annotations)
+
+    if cache:
+        print("OSE cache: " + str(cache_stats['hits']) + " hits, " + str(cache_stats['misses']) + " misses")
+    if profile is not None:
+        print(Profiling.save_report(profile, span_records))
+
+    # Aggregate in file order so that the results do not depend on the number of jobs
+    scores = [results[file] for file in files if results[file] is not None]
+    timed_out = [file for file in files if results[file] is None]
+    if len(timed_out) > 0:
+        print("Skipped " + str(len(timed_out)) + " files that exceeded the timeout: " + ", ".join(timed_out))
+    if len(scores) == 0:
+        print("No files analysed")
+        return None
+    f_measures, f_measures_downbeats, cemgils, continuities = zip(*scores)
 
     # Print overall results
     print("Mean F-measure (70ms error margin): " + str(round(np.mean(f_measures), 2)))
     print("Mean F-measure for downbeats: " + str(round(np.mean(f_measures_downbeats), 2)))
     print("Mean Cemgil score: " + str(round(np.mean(cemgils), 2)))
     print("Mean continuity score: " + str(round(np.mean(continuities), 2)))
+    return np.mean(f_measures), np.mean(f_measures_downbeats), np.mean(cemgils), np.mean(continuities)
+
+
+def analyse_chunk(files, timeout=None, export=False, cache=True, search='greedy', style=None, profile=False):
+    """
+    Work unit of analyse_all: Analyse a list of files
+    :param files: List of file paths
+    :param timeout: Optional time limit in seconds per file
+    :param export: Whether the annotations of the files should be returned
+    :param cache: Whether the onset strength envelopes are taken from the on-disk cache
+    :param search: The beat search passed to Main.analyse
+    :param style: The style hint passed to analyse
+    :param profile: Whether the stages of the analysis are profiled
+    :return: List of (file, scores, annotations) tuples, scores is None if the file exceeded the timeout and
+    annotations is None if export is False, the OSE cache hits and misses of the chunk and the recorded spans
+    """
+    if profile:
+        Profiling.enable()
+    hits = FeatureCache.stats['hits']
+    misses = FeatureCache.stats['misses']
+    results = []
+    try:
+        for file in files:
+            annotations = {} if export else None
+            try:
+                with time_limit(timeout), Profiling.profile_file(file):
+                    scores = analyse(file, annotations=annotations, cache=cache, search=search, style=style)
+            except FileTimeoutError:
+                print("Timeout: Analysis of " + file + " took longer than " + str(timeout) + "s")
+                scores = None
+            results.append((file, scores, annotations))
+    finally:
+        # Worker processes analyse further chunks, which must not pay for profiling they did not ask for
+        if profile:
+            Profiling.disable()
+    cache_stats = {'hits': FeatureCache.stats['hits'] - hits, 'misses': FeatureCache.stats['misses'] - misses}
+    return results, cache_stats, Profiling.take_records()
+
 
+class FileTimeoutError(Exception):
+    pass
+
+
+@contextmanager
+def time_limit(seconds):
+    """
+    Raise a FileTimeoutError if the enclosed code takes longer than the given number of seconds.
+    Uses SIGALRM, so it only has an effect on Unix and in the main thread (which is where pool workers run tasks)
+    :param seconds: The time limit, None for no limit
+    """
+    if seconds is None or not hasattr(signal, 'SIGALRM'):
+        yield
+        return
+
+    def handler(signum, frame):
+        raise FileTimeoutError()
+
+    previous = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def read_journal(path):
+    """
+    Read the results journal written by analyse_all
+    :param path: Path to the journal
+    :return: Dictionary mapping file paths to scores (None for files that timed out)
+    """
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Line was only partially written when the previous run crashed
+                continue
+            scores = entry['scores']
+            results[entry['file']] = tuple(scores) if scores is not None else None
+    return results
+
+
+def write_journal(path, file, scores):
+    """
+    Append the scores of one file to the results journal
+    :param path: Path to the journal
+    :param file: The analysed file
+    :param scores: The scores returned by analyse or None if the file timed out
+    """
+    if scores is not None:
+        scores = [float(score) for score in scores]
+    with open(path, 'a') as f:
+        f.write(json.dumps({'file': file, 'scores': scores}) + "\n")
 
 
-def analyse(file, plot=False):
+def analyse(file, plot=False, annotations=None, cache=True, search='greedy', style=None):
     """
     Analyse a single "*.wav" audio file
     :param file: Path to the file
     :param plot: If true, a plot is produced and output showing the OSE, the found beats and the correct beats
+    :param annotations: Optional dictionary the estimated and correct beats and downbeats are added to
+    (for export with save_annotations)
+    :param cache: Whether the onset strength envelope is taken from the on-disk cache (see FeatureCache)
+    :param search: The beat search passed to Main.analyse ("greedy", "beam", "hmm" or "coarse")
+    :param style: The style hint passed to Main.analyse: None, "auto" (nearest style prior) or "folder" (the folder
+    of the file, i.e. the dance style of the Ballroom excerpt)
     :return: Measures: F-measure for beats and downbeats, cemgil and continuity
     """
     # Get last part of file path for getting the original beat data
@@ -61,37 +233,53 @@ def analyse(file, plot=False):
     c_beats, c_downbeats = Evaluation.get_beats_from_file(filename, in_seconds=True)
 
     # Get estimated beat and downbeat time in seconds
-    beats, downbeats, ose, sig = Main.analyse(file)
+    if style == 'folder':
+        style = os.path.basename(os.path.dirname(file))
+    beats, downbeats, ose, sig = Main.analyse(file, cache=cache, search=search, style=style)
 
     # Plot results if specified
     if plot:
+        import Plot
         Plot.plot_evaluation(c_beats, beats, c_downbeats, downbeats, ose)
 
-    # Save to 4 *.txt files (2 for beats and 2 for downbeats)
     # Remove ".beats" extension
     filename = filename[:-6]
 
-    # Create annotation folder if not exists
-    if not os.path.exists(ANNOTATION_FOLDER):
-        os.makedirs(ANNOTATION_FOLDER)
-
-    # Save estimated beats
-    path_est_beats = ANNOTATION_FOLDER + os.path.sep + filename + "_est.txt"
-    path_correct_beats = ANNOTATION_FOLDER + os.path.sep + filename + "_correct.txt"
-    path_est_downbeats = ANNOTATION_FOLDER + os.path.sep + filename + "_d_est.txt"
-    path_correct_downbeats = ANNOTATION_FOLDER + os.path.sep + filename + "_d_correct.txt"
-    save_to_txt(path_est_beats, beats)
-    save_to_txt(path_correct_beats, c_beats)
-    save_to_txt(path_est_downbeats, downbeats)
-    save_to_txt(path_correct_downbeats, c_downbeats)
-
-    # Load data
-    reference_beats = mir_eval.io.load_events(path_correct_beats)
-    estimated_beats = mir_eval.io.load_events(path_est_beats)
-    reference_downbeats = mir_eval.io.load_events(path_correct_downbeats)
-    estimated_downbeats = mir_eval.io.load_events(path_est_downbeats)
-
-    # Compare and print score info
+    reference_beats = np.asarray(c_beats, dtype=float)
+    estimated_beats = np.asarray(beats, dtype=float)
+    reference_downbeats = np.asarray(c_downbeats, dtype=float)
+    estimated_downbeats = np.asarray(downbeats, dtype=float)
+
+    if annotations is not None:
+        annotations[filename + "_est"] = estimated_beats
+        annotations[filename + "_correct"] = reference_beats
+        annotations[filename + "_d_est"] = estimated_downbeats
+        annotations[filename + "_d_correct"] = reference_downbeats
+
+    f_measure, f_measure_downbeats, cemgil, continuity = score(reference_beats, estimated_beats,
+                                                               reference_downbeats, estimated_downbeats)
+
+    print("Evaluation for " + filename + " :")
+    print("F-measure (70ms error margin): " + str(f_measure))
+    print("F-measure for downbeats: " + str(f_measure_downbeats))
+    # Print empty line
+    print()
+
+    return f_measure, f_measure_downbeats, cemgil, continuity
+
+
+def score(reference_beats, estimated_beats, reference_downbeats, estimated_downbeats):
+    """
+    Score estimated beats and downbeats against the correct ones with mir_eval
+    :param reference_beats: Array of correct beat times in seconds
+    :param estimated_beats: Array of estimated beat times in seconds
+    :param reference_downbeats: Array of correct downbeat times in seconds
+    :param estimated_downbeats: Array of estimated downbeat times in seconds
+    :return: Measures: F-measure for beats and downbeats, cemgil and continuity
+    """
+    # mir_eval (and its dependencies) are only needed for scoring
+    import mir_eval
+    # Compare and get score info
     scores = mir_eval.beat.evaluate(reference_beats, estimated_beats)
     scores_downbeats = mir_eval.beat.evaluate(reference_downbeats, estimated_downbeats)
 
@@ -101,33 +289,50 @@ def analyse(file, plot=False):
     cemgil = scores['Cemgil']
     # Continuity-based scores which compute the proportion of the beat sequence which is continuously correct
     continuity = scores['Any Metric Level Continuous']
-
-    print("Evaluation for " + filename + " :")
-    print("F-measure (70ms error margin): " + str(f_measure))
-    print("F-measure for downbeats: " + str(f_measure_downbeats))
-    # Print empty line
-    print()
-
     return f_measure, f_measure_downbeats, cemgil, continuity
 
-def save_to_txt(path, beats):
+
+def save_annotations(path, annotations):
     """
-    Saves a list of beats to a specified path in the format required by mir_eval.
-    If the file does not exist it is created
-    If the file exists, values are overwritten
+    Saves the annotations of a run to a single compressed *.npz file.
+    Each file contributes four arrays (in seconds): "<name>_est" and "<name>_correct" for the beats and
+    "<name>_d_est" and "<name>_d_correct" for the downbeats
     :param path: The path to save to
-    :param beats: The list of beats
+    :param annotations: Dictionary mapping array names to beat times
     :return:
     """
-    # Save to file
-    f = open(path, 'w+')  # w+ makes sure that a .txt file is created if it does not exist yet
-    # Write beats
-    f.writelines([str(beat) + "\n" for beat in beats])
-    # Close file
-    f.close()
+    np.savez_compressed(path, **annotations)
 
 # current_file = "BallroomData\\ChaChaCha\\Albums-Cafe_Paradiso-07.wav"
 # current_file = "BallroomData\\ChaChaCha\\Albums-Cafe_Paradiso-06.wav"
 # analyse(current_file, plot=True)
 # analyse("BallroomData\\ChaChaCha\\Albums-Latin_Jam2-04.wav")
-analyse_all(limit=None)
\ No newline at end of file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the beat tracker on the Ballroom dataset with mir_eval")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of worker processes")
+    parser.add_argument('--limit', type=int, default=None, help="Only analyse the first LIMIT files")
+    parser.add_argument('--chunk-size', type=int, default=4, help="Number of files per work unit")
+    parser.add_argument('--timeout', type=float, default=None, help="Time limit in seconds per file")
+    parser.add_argument('--journal', default=None, help="Results journal used to resume an interrupted run")
+    parser.add_argument('--export', nargs='?', const=ANNOTATION_FILE, default=None,
+                        help="Save all beats and downbeats of the run to one *.npz file")
+    parser.add_argument('--search', choices=['greedy', 'beam', 'hmm', 'coarse'], default='greedy',
+                        help="Beat search: greedy state-space search, beam search, bar-pointer HMM or coarse-to-fine "
+                             "dynamic program")
+    parser.add_argument('--style', choices=['auto', 'folder'], default=None,
+                        help="Tempo prior: nearest style prior or the prior of the file's folder (default: global)")
+    parser.add_argument('--profile', nargs='?', const=PROFILE_FILE, default=None,
+                        help="Profile the stages of the analysis and save the profile to this JSON file (default: "
+                             + PROFILE_FILE + ")")
+    parser.add_argument('--no-cache', action='store_true', help="Always recompute the onset strength envelopes")
+    args = parser.parse_args()
+    analyse_all(limit=args.limit, jobs=args.jobs, chunk_size=args.chunk_size, timeout=args.timeout,
+                journal=args.journal, export=args.export,
+                cache=not args.no_cache, search=args.search, style=args.style,
+                profile=args.profile)
+
+
+if __name__ == "__main__":
+    main()
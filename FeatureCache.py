@@ -0,0 +1,112 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+import Globals
+
+# Hit and miss counters of this process
+stats = {'hits': 0, 'misses': 0}
+
+
+def cache_key(file):
+    """
+    Content-addressed key of the onset strength envelope of an audio file: A hash of the audio bytes combined with
+    all parameters that influence the onset strength envelope, so changing one of them never returns a stale entry
+    :param file: Path to the audio file
+    :return: The key as hex string
+    """
+    h = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    parameters = (Globals.OSE_SAMPLE_RATE, Globals.FFT_HOP, Globals.N_FFT, Globals.N_MELS, Globals.HIGHPASS_CUTOFF,
+                  Globals.HIGHPASS_ORDER, Globals.SMOOTHING_WINDOW, Globals.RESAMPLE_QUALITY,
+                  Globals.OSE_DTYPE)
+    h.update(repr(parameters).encode())
+    return h.hexdigest()
+
+
+def cache_path(key):
+    return os.path.join(Globals.OSE_CACHE_FOLDER, key + ".npy")
+
+
+def load(key):
+    """
+    Look up an onset strength envelope in the cache
+    :param key: The key returned by cache_key
+    :return: The (read-only, memory-mapped) onset strength envelope or None if it is not cached
+    """
+    path = cache_path(key)
+    try:
+        ose = np.load(path, mmap_mode='r')
+        # Mark the entry as recently used for the LRU eviction
+        os.utime(path)
+    except (FileNotFoundError, ValueError):
+        # Not cached or evicted by another worker in the meantime
+        stats['misses'] += 1
+        return None
+    stats['hits'] += 1
+    return ose
+
+
+def store(key, ose):
+    """
+    Save an onset strength envelope to the cache and evict the least recently used entries if the cache is too big.
+    The array is written to a temporary file that is renamed afterwards, so concurrent workers never see partial files
+    :param key: The key returned by cache_key
+    :param ose: The onset strength envelope
+    """
+    os.makedirs(Globals.OSE_CACHE_FOLDER, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=Globals.OSE_CACHE_FOLDER, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, ose)
+        os.replace(tmp_path, cache_path(key))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    evict(Globals.OSE_CACHE_SIZE)
+
+
+def evict(max_size):
+    """
+    Delete the least recently used cache entries until the cache is at most max_size bytes
+    :param max_size: Size limit in bytes
+    """
+    entries = []
+    for entry in os.scandir(Globals.OSE_CACHE_FOLDER):
+        if not entry.name.endswith(".npy"):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Already evicted by another worker
+            pass
+        total -= size
+
+
+def onset_strength_envelope(file, compute):
+    """
+    Get the onset strength envelope of a file from the cache or compute and cache it
+    :param file: Path to the audio file
+    :param compute: Function that calculates the onset strength envelope of the file
+    :return: The onset strength envelope and whether it was found in the cache
+    """
+    key = cache_key(file)
+    ose = load(key)
+    if ose is not None:
+        return ose, True
+    ose = compute(file)
+    store(key, ose)
+    return ose, False
@@ -1,52 +1,88 @@
-import librosa
-from scipy.signal import butter, filtfilt
-from pathlib import Path
 import numpy as np
 import os
-import IPython.display as ipd
-from scipy.signal import find_peaks
+from functools import lru_cache
+import Backend
 import Globals
-import Main
+import Profiling
 
-def estimate_tempo(ose):
+# Number of lags searched for duple and triple tempo (corresponds to the first 8 seconds of the song)
+TEMPO_SEARCH_RANGE = 2000
+# Value for στ (the width of the weighting curve for the autocorrelation window in octaves)
+WEIGHTING_CURVE = 0.9
+
+
+@Profiling.profiled('estimate_tempo')
+def estimate_tempo(ose, prior=None, weighting_curve=WEIGHTING_CURVE):
     """
     This function uses the precomputed global tempo information parameters to estimate the tempo
     of one piece
     :param ose: The onset strength envelope
+    :param prior: Optional TempoPrior (e.g. of one style) used instead of the global tempo weighting for the candidate
+    beat periods. The search for duple and triple tempo is restricted to the lags covered by the prior, and the
+    autocorrelation is only calculated for the lags this search looks at. The multiples of the candidates in TPS2 and
+    TPS3 keep the global weighting, as the prior is practically zero there and could not tell the metres apart
+    :param weighting_curve: Width of the log-Gaussian tempo weighting in octaves (not used with a prior or the
+    learned tempo weighting)
     :return: The tactus estimate, the estimated tempo expressed in terms of OSE frames
                 and whether duple (True) or triple (False) tempo is assumed
     """
-    # The list of tempo period strengths
-    TPS = []
+    R = TEMPO_SEARCH_RANGE
+    if prior is not None:
+        R = min(R, prior.lag_range()[1] + 2)
+    # TPS3 looks at three times the searched lags, so larger lags are never needed
+    max_lag = 3 * R
+
+    # Calculate autocorrelation of onset strength envelope (only for the searchable lags)
+    with Profiling.span('autocorrelation'):
+        ac = autocorrelate(ose, max_lag)
+
+    # Weight the autocorrelated onset strength envelope (as seen in the Ellis paper)
+    weighting = tempo_weighting_window(ac.size, weighting_curve)
+    if prior is not None:
+        return tempo_from_strengths(*tempo_period_strengths(ac, prior.weighting(ac.size), R, weighting))
+    return tempo_from_strengths(*tempo_period_strengths(ac, weighting, R))
+
+
+def tempo_period_strengths(ac, weighting, search_range=TEMPO_SEARCH_RANGE, multiple_weighting=None):
+    """
+    Weighted autocorrelation (tempo period strengths) and the strengths of duple and triple tempo
+    :param ac: The autocorrelation of the onset strength envelope for the lags 0 to 3 * search_range - 1 (or less)
+    :param weighting: The tempo weighting window for the lags of ac
+    :param search_range: Number of lags searched for duple and triple tempo
+    :param multiple_weighting: Optional weighting window of the multiples 2 * tau and 3 * tau in TPS2 and TPS3,
+    defaults to weighting
+    :return: TPS, TPS2 and TPS3. Entry i of TPS corresponds to a lag of i + 1 frames
+    """
+    R = search_range
+    max_lag = 3 * R
+    if multiple_weighting is None:
+        multiple_weighting = weighting
+    if Backend.use_numba():
+        return Backend.kernels().tempo_period_strengths(ac, weighting, multiple_weighting, max_lag, R)
+    TPS = np.zeros(max_lag - 1)
+    TPS[:ac.size - 1] = weighting[1:] * ac[1:]
+    if multiple_weighting is weighting:
+        multiples = TPS
+    else:
+        multiples = np.zeros(max_lag - 1)
+        multiples[:ac.size - 1] = multiple_weighting[1:] * ac[1:]
+    # Probabilities of duple and triple tempos for tau in range(1, TEMPO_SEARCH_RANGE):
+    # TPS2(tau) = TPS[tau] + 0.5 * TPS[2 * tau] + 0.25 * TPS[2 * tau - 1] + 0.25 * TPS[2 * tau + 1]
+    # TPS3(tau) = TPS[tau] + 0.33 * TPS[3 * tau] + 0.33 * TPS[3 * tau - 1] + 0.33 * TPS[3 * tau + 1]
+    # (the multiples are taken from the multiples weighted with multiple_weighting)
+    TPS2 = TPS[1:R] + 0.5 * multiples[2:2 * R:2] + 0.25 * multiples[1:2 * R - 1:2] + 0.25 * multiples[3:2 * R + 1:2]
+    TPS3 = TPS[1:R] + 0.33 * multiples[3:3 * R:3] + 0.33 * multiples[2:3 * R - 1:3] + 0.33 * multiples[4:3 * R + 1:3]
+    return TPS, TPS2, TPS3
 
-    # Calculate autocorrelation of onset strength envelope
-    ac = librosa.autocorrelate(ose)
 
-    # For each frame of the autocorrelated onset strength envelope save the
-    # weighted value (as seen in the Ellis paper)
-    for tau in range(1, ose.size):
-        res = autocorrelation_weighting(tau, Globals.TAU_0) * ac[tau]
-        TPS.append(res)
+def tempo_from_strengths(TPS, TPS2, TPS3):
+    """
+    Choose the most likely tempo and metre from the tempo period strengths (see tempo_period_strengths)
+    :return: The tactus estimate, the estimated tempo expressed in terms of OSE frames
+                and whether duple (True) or triple (False) tempo is assumed
+    """
     # This index stores the highest value -> this indicates the most likely tempo
     tau_index = np.argmax(TPS)
-    # Express in terms of samples
-    index_samples = tau_index * Globals.FFT_HOP
-    # Express in terms of seconds
-    tau_est = index_samples / Globals.OSE_SAMPLE_RATE
-    tempo_est = 60 / tau_est
-
-    # Helper functions for calculating the probabilities of duple and triple tempos
-    def get_TPS2(tau):
-        return TPS[tau] + 0.5 * TPS[2 * tau] + 0.25 * TPS[2 * tau - 1] + 0.25 * TPS[2 * tau + 1]
-    def get_TPS3(tau):
-        return TPS[tau] + 0.33 * TPS[3 * tau] + 0.33 * TPS[3 * tau - 1] + 0.33 * TPS[3 * tau + 1]
-
-    TPS2 = []
-    TPS3 = []
-    search_range = 2000  # corresponds to the first 8 seconds of the song
-    for tau in range(1, search_range):
-        TPS2.append(get_TPS2(tau))
-        TPS3.append(get_TPS3(tau))
     tau2 = np.argmax(TPS2)
     tau3 = np.argmax(TPS3)
 
@@ -70,6 +106,73 @@ def estimate_tempo(ose):
         return tactus, tau3, False
 
 
+def nearest_tempo_prior(ose):
+    """
+    Select the style prior that fits an onset strength envelope best, i.e. the one whose weighting gives the largest
+    weighted autocorrelation (see TempoPrior.style_priors)
+    :param ose: The onset strength envelope
+    :return: The style and its prior
+    """
+    import TempoPrior
+    priors = TempoPrior.style_priors()
+    if not priors:
+        raise ValueError("No style priors available, the styles are taken from " + TempoPrior.AUDIO_FOLDER)
+    ac = autocorrelate(ose, 3 * TEMPO_SEARCH_RANGE)
+    return max(priors.items(), key=lambda item: np.max(item[1].weighting(ac.size) * ac))
+
+
+def autocorrelate(ose, max_lag):
+    """
+    Autocorrelation of the onset strength envelope for the lags 0 to max_lag - 1, calculated via the FFT.
+    Zero-padding the signal by max_lag samples is enough to prevent circular wrap-around for the requested lags
+    :param ose: The onset strength envelope
+    :param max_lag: The number of lags to calculate
+    :return: The autocorrelation (shorter than max_lag if the onset strength envelope is shorter)
+    """
+    # scipy.fft and scipy.signal take long to import, so they are only loaded when needed
+    from scipy.fft import next_fast_len
+    max_lag = min(max_lag, ose.size)
+    n_fft = next_fast_len(ose.size + max_lag)
+    spectrum = np.fft.rfft(ose, n=n_fft)
+    return np.fft.irfft(np.abs(spectrum) ** 2, n=n_fft)[:max_lag]
+
+
+# Supported values of Globals.TEMPO_PRIOR
+TEMPO_PRIORS = ('log-gaussian', 'learned')
+
+
+def tempo_weighting_window(length, weighting_curve=WEIGHTING_CURVE):
+    """
+    Tempo weighting window of the autocorrelation according to Globals.TEMPO_PRIOR: "log-gaussian" is the fixed
+    window around Globals.TAU_0, "learned" the tempo distribution of the annotated corpus (see TempoPrior)
+    :param length: The number of lags
+    :param weighting_curve: Width of the log-Gaussian window in octaves
+    :return: The (read-only) window for the lags 0 to length - 1
+    """
+    if Globals.TEMPO_PRIOR not in TEMPO_PRIORS:
+        raise ValueError("Unknown tempo prior " + str(Globals.TEMPO_PRIOR) + ", use one of " + str(TEMPO_PRIORS))
+    if Globals.TEMPO_PRIOR == 'learned':
+        import TempoPrior
+        return TempoPrior.get_prior().weighting(length)
+    return get_tempo_weighting_window(Globals.TAU_0, length, weighting_curve)
+
+
+@lru_cache(maxsize=16)
+def get_tempo_weighting_window(TAU_0, length, weighting_curve=WEIGHTING_CURVE):
+    """
+    Log-Gaussian autocorrelation window around the tempo period bias for the lags 0 to length - 1.
+    The window is expressed in OSE frames, so it only has to be calculated once per TAU_0 and length
+    :param TAU_0: The precalculated tempo period bias
+    :param length: The number of lags
+    :param weighting_curve: Width of the window in octaves
+    :return: The (read-only) window, the value for lag 0 is 0
+    """
+    window = np.zeros(length)
+    window[1:] = autocorrelation_weighting(np.arange(1, length), TAU_0, weighting_curve)
+    window.setflags(write=False)
+    return window
+
+
 def apply_highpass_filter(sig, sr, cutoff, order):
     """
     Apply a butterworth filter of order "order" at given cutoff frequency
@@ -79,6 +182,21 @@ def apply_highpass_filter(sig, sr, cutoff, order):
     :param order: The filter order
     :return: The filtered signal
     """
+    from scipy.signal import filtfilt
+    b, a = highpass_coefficients(sr, cutoff, order)
+    return filtfilt(b, a, sig)
+
+
+@lru_cache(maxsize=16)
+def highpass_coefficients(sr, cutoff, order):
+    """
+    Design a butterworth high-pass filter of order "order" at given cutoff frequency
+    :param sr: The sampling rate of the system
+    :param cutoff: The cutoff-frequency of the filter
+    :param order: The filter order
+    :return: The filter coefficients b and a
+    """
+    from scipy.signal import butter
     # Filter requirements
     T = 1 / sr  # Sampling period
     f_nyquist = sr / 2
@@ -87,7 +205,196 @@ def apply_highpass_filter(sig, sr, cutoff, order):
     normal_cutoff = cutoff / f_nyquist
     # Get filter coefficients
     b, a = butter(N=order, Wn=normal_cutoff, btype='highpass', analog=False)
-    return filtfilt(b, a, sig)
+    b.setflags(write=False)
+    a.setflags(write=False)
+    return b, a
+
+
+# Supported values of Globals.OSE_DTYPE
+OSE_DTYPES = ('float32', 'float64')
+
+
+def ose_dtype():
+    """
+    The floating point type of the onset strength envelope pipeline, according to Globals.OSE_DTYPE
+    """
+    if Globals.OSE_DTYPE not in OSE_DTYPES:
+        raise ValueError("Unknown dtype " + str(Globals.OSE_DTYPE) + ", use one of " + str(OSE_DTYPES))
+    return np.dtype(Globals.OSE_DTYPE)
+
+
+def rectified_difference_sum(spectrogram, block_size=4096):
+    """
+    Half-wave rectified first order difference over time, summed over the frequency bands, in one pass over blocks
+    of frames (only a block-sized scratch buffer is allocated instead of the full difference and a boolean mask)
+    :param spectrogram: Array of shape (frames, bands)
+    :param block_size: The number of frames processed at once
+    :return: Array of length frames - 1 with the dtype of the spectrogram
+    """
+    n = spectrogram.shape[0] - 1
+    out = np.empty(max(n, 0), dtype=spectrogram.dtype)
+    scratch = np.empty((min(block_size, max(n, 0)), spectrogram.shape[1]), dtype=spectrogram.dtype)
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        difference = scratch[:stop - start]
+        np.subtract(spectrogram[start + 1:stop + 1], spectrogram[start:stop], out=difference)
+        np.maximum(difference, 0, out=difference)
+        np.sum(difference, axis=1, out=out[start:stop])
+    return out
+
+
+def filtfilt_inplace(sig, b, a, block_size):
+    """
+    Forward-backward filter a long signal in place, block by block (same result as scipy.signal.filtfilt with its
+    default odd extension, but without copies of the whole signal, so that sig can be a np.memmap)
+    :param sig: The 1D float signal, overwritten with the filtered signal
+    :param b: The numerator coefficients of the filter
+    :param a: The denominator coefficients of the filter
+    :param block_size: The number of samples filtered at once
+    :return: The filtered signal (sig)
+    """
+    from scipy.signal import lfilter, lfilter_zi
+    edge = 3 * max(len(a), len(b))
+    if sig.size <= edge:
+        raise ValueError("The signal has to be longer than " + str(edge) + " samples")
+    zi = lfilter_zi(b, a)
+    # Odd extension at both ends of the signal
+    left = 2 * sig[0] - sig[edge:0:-1]
+    right = 2 * sig[-1] - sig[-2:-edge - 2:-1]
+
+    # Forward pass, the filter state is carried from block to block
+    _, state = lfilter(b, a, left, zi=zi * left[0])
+    for start in range(0, sig.size, block_size):
+        sig[start:start + block_size], state = lfilter(b, a, sig[start:start + block_size], zi=state)
+    right, _ = lfilter(b, a, right, zi=state)
+
+    # Backward pass, starting at the end of the extension
+    _, state = lfilter(b, a, right[::-1], zi=zi * right[-1])
+    for stop in range(sig.size, 0, -block_size):
+        start = max(0, stop - block_size)
+        filtered, state = lfilter(b, a, sig[start:stop][::-1], zi=state)
+        sig[start:stop] = filtered[::-1]
+    return sig
+
+
+def convolve_inplace(sig, window, block_size):
+    """
+    Convolve a long signal in place with a window, block by block (same result as scipy.signal.convolve with
+    mode="same" for signals longer than the window)
+    :param sig: The 1D float signal, overwritten with the result
+    :param window: The window
+    :param block_size: The number of samples convolved at once
+    :return: The convolved signal (sig)
+    """
+    # Output sample i depends on the input samples i - before to i + after
+    after = (len(window) - 1) // 2
+    before = len(window) - 1 - after
+    # The original samples before the current block (already overwritten in sig), zeros before the signal
+    history = np.zeros(before)
+    for start in range(0, sig.size, block_size):
+        stop = min(start + block_size, sig.size)
+        segment = np.concatenate((history, sig[start:stop + after]))
+        if stop + after > sig.size:
+            segment = np.concatenate((segment, np.zeros(stop + after - sig.size)))
+        history = segment[stop - start:stop - start + before].copy()
+        sig[start:stop] = np.convolve(segment, window, mode='valid')
+    return sig
+
+
+def blockwise_std(sig, block_size):
+    """
+    Standard deviation of a long signal (two passes over blocks instead of a temporary copy of the whole signal)
+    :param sig: The 1D signal
+    :param block_size: The number of samples processed at once
+    :return: The standard deviation
+    """
+    mean = sum(np.sum(sig[start:start + block_size]) for start in range(0, sig.size, block_size)) / sig.size
+    squares = sum(np.sum((sig[start:start + block_size] - mean) ** 2) for start in range(0, sig.size, block_size))
+    return np.sqrt(squares / sig.size)
+
+
+@lru_cache(maxsize=16)
+def smoothing_window(sr):
+    """
+    Gaussian window used to smooth the onset strength envelope
+    :param sr: The sampling rate of the system
+    :return: The (read-only) window
+    """
+    from scipy.signal.windows import gaussian
+    M = Globals.SMOOTHING_WINDOW * sr
+    std = np.ceil(M / 12)
+    window = gaussian(int(M), std, sym=True)
+    window.setflags(write=False)
+    return window
+
+
+@lru_cache(maxsize=16)
+def normalised_smoothing_window(sr, dtype):
+    """
+    The smoothing window scaled to a sum of one, in the given dtype
+    :param sr: The sampling rate of the system
+    :param dtype: The dtype of the window
+    :return: The (read-only) window
+    """
+    window = smoothing_window(sr)
+    window = (window / np.sum(window)).astype(dtype)
+    window.setflags(write=False)
+    return window
+
+
+@lru_cache(maxsize=16)
+def mel_filterbank(sr, n_fft, n_mels):
+    """
+    Mel filterbank that maps the bins of an STFT to Mel bands. This is the same Slaney-style filterbank as
+    librosa.filters.mel (triangular filters between 0Hz and sr / 2, normalised to constant energy per band), built
+    with NumPy so that librosa does not have to be imported
+    :param sr: The sampling rate of the system
+    :param n_fft: The FFT size
+    :param n_mels: The number of Mel bands
+    :return: The (read-only) filterbank of shape (n_mels, n_fft / 2 + 1)
+    """
+    fft_frequencies = np.linspace(0, sr / 2, 1 + n_fft // 2)
+    # Centre frequencies of the bands (plus the outer edges of the first and the last band)
+    mel_frequencies = mel_to_hz(np.linspace(hz_to_mel(0), hz_to_mel(sr / 2), n_mels + 2))
+
+    fdiff = np.diff(mel_frequencies)
+    ramps = np.subtract.outer(mel_frequencies, fft_frequencies)
+    lower = -ramps[:-2] / fdiff[:-1, np.newaxis]
+    upper = ramps[2:] / fdiff[1:, np.newaxis]
+    mel_basis = np.maximum(0, np.minimum(lower, upper))
+    # Slaney-style normalisation
+    mel_basis *= (2.0 / (mel_frequencies[2:] - mel_frequencies[:-2]))[:, np.newaxis]
+    mel_basis = mel_basis.astype(np.float32)
+    mel_basis.setflags(write=False)
+    return mel_basis
+
+
+# Slaney Mel scale: Linear below 1kHz, logarithmic above
+MEL_F_SP = 200.0 / 3
+MEL_MIN_LOG_HZ = 1000.0
+MEL_MIN_LOG_MEL = MEL_MIN_LOG_HZ / MEL_F_SP
+MEL_LOG_STEP = np.log(6.4) / 27.0
+
+
+def hz_to_mel(frequencies):
+    """
+    Convert frequencies in Hz to the Slaney Mel scale
+    """
+    frequencies = np.asanyarray(frequencies, dtype=float)
+    mels = frequencies / MEL_F_SP
+    log_region = frequencies >= MEL_MIN_LOG_HZ
+    return np.where(log_region, MEL_MIN_LOG_MEL + np.log(np.maximum(frequencies, MEL_MIN_LOG_HZ) / MEL_MIN_LOG_HZ)
+                    / MEL_LOG_STEP, mels)
+
+
+def mel_to_hz(mels):
+    """
+    Convert Slaney Mel values to frequencies in Hz
+    """
+    mels = np.asanyarray(mels, dtype=float)
+    frequencies = MEL_F_SP * mels
+    log_region = mels >= MEL_MIN_LOG_MEL
+    return np.where(log_region, MEL_MIN_LOG_HZ * np.exp(MEL_LOG_STEP * (mels - MEL_MIN_LOG_MEL)), frequencies)
 
 
 def extract_tempo_information_from_beats_file(file):
@@ -96,49 +403,27 @@ def extract_tempo_information_from_beats_file(file):
     :param file: The name of the *.beats file
     :return: The BPM measure of the file
     """
-    with open("BallroomAnnotations-master/" + file) as f:
-        lines = f.read().splitlines()
-        # Get the last beat
-        last_beat = float(lines[-1][:-2])
-        # Tempo will be the number of beats, i.e. number of lines divided by the number of the last beat
-        tempo_bpm = 60 * len(lines) / last_beat
-        return tempo_bpm
+    import TempoPrior
+    return TempoPrior.beats_file_tempo(os.path.join(TempoPrior.ANNOTATIONS_FOLDER, file))
 
 
 def find_tempo_period_bias():
     """
-    Find tempo period bias, i.e. the mean period of the tempi over a set of data
+    Find tempo period bias, i.e. the mean tempo over a set of data.
+    The tempo prior is loaded once per process and only reads annotation files that are new or changed (see TempoPrior)
     """
-    # Check if tempo period bias has been calculated before
-    if not os.path.exists("tempo_period_bias.txt") or os.stat("tempo_period_bias.txt").st_size == 0:
-        all_files = Path('BallroomAnnotations-master').rglob('*.beats')
-        tempos = []
-        for file in all_files:
-            tempos.append(extract_tempo_information_from_beats_file(file.name))
-        mean_bpm = np.mean(tempos)
-        mean_seconds = 60 / mean_bpm
-
-        # Save to file
-        f = open('tempo_period_bias.txt', 'w+')
-        f.write(str(mean_bpm))
-        return mean_bpm
-
-    # If it has been calculated, save time and return the recorded value
-    # NB: This means that the file has to be deleted or cleared in order to recalculate the tempo period bias
-    else:
-        f = open('tempo_period_bias.txt', 'r')
-        return float(f.read())
+    import TempoPrior
+    return TempoPrior.get_prior().mean_bpm()
 
 
-def autocorrelation_weighting(tau, TAU_0):
+def autocorrelation_weighting(tau, TAU_0, weighting_curve=WEIGHTING_CURVE):
     """
     Helper function for getting the window value for a given tau and the tempo period bias TAU_0
-    :param tau: The current point in the autocorrelation function
+    :param tau: The current point in the autocorrelation function (a single lag or an array of lags)
     :param TAU_0: The precalculated tempo period bias
+    :param weighting_curve: Value for στ (the width of the weighting curve for the autocorrelation window in octaves)
     :return: The weighted value of the autocorrelation function
     """
-    # Value for στ (the width of the weighting curve for the autocorrelation window in octaves)
-    weighting_curve = 0.9
     return np.exp((-1 / 2) * ((np.log2(tau / TAU_0) / weighting_curve) ** 2))
 
 def F_squared_error(delta_t, tau):
@@ -6,3 +6,33 @@ OSE_SAMPLE_RATE = 8000
 FFT_HOP = 32
 # Use global variable so as to calculate it only once per run
 TAU_0 = 0
+# FFT size of the STFT (64ms windows at OSE_SAMPLE_RATE)
+N_FFT = 512
+# Number of Mel bands of the onset strength envelope
+N_MELS = 40
+# Cutoff frequency and order of the high-pass filter applied to the onset strength envelope
+HIGHPASS_CUTOFF = 0.4
+HIGHPASS_ORDER = 2
+# Length of the Gaussian smoothing window in seconds
+SMOOTHING_WINDOW = 0.02
+# Folder and size limit in bytes of the on-disk onset strength envelope cache
+OSE_CACHE_FOLDER = "OSECache"
+OSE_CACHE_SIZE = 1024 ** 3
+# Backend of the beat-tracking kernels: "auto" (Numba if installed), "numpy" or "numba" (see Backend)
+BACKEND = 'auto'
+# Number of hypotheses kept by the beam search (see BeamSearch)
+BEAM_WIDTH = 8
+# Resampler used when decoding audio files, "fast" (polyphase) or "high" (librosa's default)
+RESAMPLE_QUALITY = 'fast'
+# Number of samples (at OSE_SAMPLE_RATE) processed at once by Main.calculate_onset_strength_envelope_chunked
+OSE_CHUNK_SIZE = 2 ** 16
+# Floating point type of the onset strength envelope pipeline, "float32" or "float64"
+OSE_DTYPE = 'float32'
+# Tempo weighting of the autocorrelation, "log-gaussian" (around TAU_0) or "learned" (see TempoPrior)
+TEMPO_PRIOR = 'log-gaussian'
+# File the learned tempo prior is saved to
+TEMPO_PRIOR_FILE = "tempo_prior.json"
+# Number of levels of the coarse-to-fine search, each level halves the resolution (3 levels: 16ms, 8ms and 4ms frames)
+PYRAMID_DEPTH = 3
+# Track with the local tempo curve of Tempogram instead of one global tempo in the greedy search
+LOCAL_TEMPO = False
@@ -1,83 +1,365 @@
+from fractions import Fraction
+from itertools import chain
+
 import numpy as np
-import librosa
-from scipy import signal
-import IPython.display as ipd
-from scipy.signal import find_peaks
 
-import Plot
 import Globals
-from Globals import OSE_SAMPLE_RATE, FFT_HOP
+from Globals import OSE_SAMPLE_RATE, FFT_HOP, N_FFT, N_MELS, HIGHPASS_CUTOFF, HIGHPASS_ORDER
+import Audio
+import Backend
 import Functions
+import FeatureCache
+import Profiling
+
+# Look for the next beat in the range of (index + tau_index) +/- SEARCH_WINDOW frames (96ms)
+SEARCH_WINDOW = 24
+# Number of STFT frames windowed and transformed at once by power_spectrogram (a block of windowed frames and its
+# spectrum take about 3MB in float64, so they stay in the cache)
+STFT_BLOCK = 512
 
-def beatTracker(inputFile):
+def beatTracker(inputFile, style=None):
     """
     Main function to be called by markers.
     :param inputFile: The string path to the *.wav file
+    :param style: Optional style hint (e.g. "Waltz", see TempoPrior), or "auto" to select the nearest style prior
     :return: A list of beats and downbeat times in seconds
     """
-    beats, downbeats, ose, sig = analyse(inputFile)
+    beats, downbeats, ose, sig = analyse(inputFile, style=style)
     return beats, downbeats
 
-def analyse(file):
+@Profiling.profiled('analyse')
+def analyse(file, cache=False, search='greedy', style=None):
+    """
+    Beat-track a file
+    :param file: The string path to the *.wav file
+    :param cache: If true, the onset strength envelope is taken from the on-disk cache (see FeatureCache) if possible.
+    The audio is not decoded on a cache hit, so the returned signal is None in that case
+    :param search: "greedy" for state_space_search (with the local tempo curve of Tempogram if Globals.LOCAL_TEMPO is
+    set), "beam" for the multi-hypothesis BeamSearch.beam_search, "hmm" for the joint beat and downbeat decoder
+    BarPointer.bar_pointer_search or "coarse" for the coarse-to-fine tempo estimation and dynamic program
+    CoarseToFine.coarse_to_fine_search (Globals.PYRAMID_DEPTH levels)
+    :param style: Optional style whose tempo prior is used by the tempo estimation, "auto" for the style prior that
+    fits the onset strength envelope best, or None for the global tempo weighting
+    :return: Beats and downbeats in seconds, the onset strength envelope and the signal (mono at OSE_SAMPLE_RATE)
+    """
     # Get tempo period bias
     Globals.TAU_0 = Functions.find_tempo_period_bias()
-    # Load audio file
-    sig, sr = librosa.core.load(file)
-    # Calculate the onset strength envelope
-    ose = calculate_onset_strength_envelope(sig, sr)
-    # Estimate tempo from onset strength envelope
-    tau_est, tau_index, is_duple_tempo = Functions.estimate_tempo(ose)
-    # Get beats and downbeats
-    beats, downbeats = state_space_search(ose, tau_index, is_duple_tempo)
-    # Convert beats and downbeat times to seconds
-    beats = [beat * FFT_HOP / OSE_SAMPLE_RATE for beat in beats]
-    downbeats = [downbeat * FFT_HOP / OSE_SAMPLE_RATE for downbeat in downbeats]
+    sig = None
+    if cache:
+        with Profiling.span('cache'):
+            ose, _ = FeatureCache.onset_strength_envelope(file, file_onset_strength_envelope)
+    else:
+        # Load audio file (mono, directly at the sample rate of the onset strength envelope)
+        with Profiling.span('decode'):
+            sig, sr = Audio.load(file)
+        # Calculate the onset strength envelope
+        ose = calculate_onset_strength_envelope(sig, sr)
+    beats, downbeats = track_onset_strength_envelope(ose, search, style)
     return beats, downbeats, ose, sig
 
 
+def track_onset_strength_envelope(ose, search='greedy', style=None):
+    """
+    Estimate the tempo of an onset strength envelope and search its beats and downbeats
+    (see analyse for the parameters)
+    :return: Beats and downbeats in seconds
+    """
+    # Select the tempo prior of the style
+    prior = None
+    if style == 'auto':
+        style, prior = Functions.nearest_tempo_prior(ose)
+    elif style is not None:
+        import TempoPrior
+        prior = TempoPrior.get_prior(style)
+    # Get beats and downbeats
+    if search == 'coarse':
+        # Estimates the tempo itself, on the coarsest level of the pyramid
+        import CoarseToFine
+        beats, downbeats = CoarseToFine.coarse_to_fine_search(ose, prior=prior)
+        return to_seconds(beats), to_seconds(downbeats)
+    # The optional searches are only imported when they are used, so they do not add to the import time of Main
+    if search == 'hmm':
+        # Decodes tempo, beats and downbeats jointly, so the tempo is not estimated beforehand
+        import BarPointer
+        beats, downbeats = BarPointer.bar_pointer_search(ose)
+        return to_seconds(beats), to_seconds(downbeats)
+    # Estimate tempo from onset strength envelope
+    tau_est, tau_index, is_duple_tempo = Functions.estimate_tempo(ose, prior)
+    if search == 'beam':
+        import BeamSearch
+        beats, downbeats = BeamSearch.beam_search(ose, tau_index, is_duple_tempo)
+    else:
+        if Globals.LOCAL_TEMPO:
+            # The metre is still taken from the global estimate
+            import Tempogram
+            tau_index = Tempogram.tempo_curve(ose, prior)
+        beats, downbeats = state_space_search(ose, tau_index, is_duple_tempo)
+    return to_seconds(beats), to_seconds(downbeats)
+
+
+def to_seconds(frames):
+    """
+    Convert indices of onset strength envelope frames to times in seconds
+    """
+    return [frame * FFT_HOP / OSE_SAMPLE_RATE for frame in frames]
+
+
+def file_onset_strength_envelope(file):
+    """
+    Load an audio file and calculate its onset strength envelope
+    """
+    with Profiling.span('decode'):
+        sig, sr = Audio.load(file)
+    return calculate_onset_strength_envelope(sig, sr)
+
+
+@Profiling.profiled('ose')
 def calculate_onset_strength_envelope(audio, sr):
     """
-    Takes an audio signal and its sample rate and converts it to the onset strength envelope as described in Ellis-07
+    Takes an audio signal and its sample rate and converts it to the onset strength envelope as described in Ellis-07.
+    All steps are calculated in the dtype given by Globals.OSE_DTYPE, and the filters work in place where possible
     """
-    # Resample to 8kHz
-    audio = librosa.core.resample(audio, sr, OSE_SAMPLE_RATE)
+    # scipy.signal takes long to import, so only load it if needed
+    from scipy import signal
+    dtype = Functions.ose_dtype()
+    # Resample to 8kHz (not needed for audio loaded with Audio.load)
+    with Profiling.span('resample'):
+        audio = Audio.resample(audio, sr, OSE_SAMPLE_RATE, Globals.RESAMPLE_QUALITY).astype(dtype, copy=False)
 
     # Calculate STFT with 64ms windows (512 samples given 8kHz sr) and 4ms hop
-    spectrogram = np.abs(librosa.core.stft(audio, n_fft=512, hop_length=FFT_HOP)) ** 2
+    with Profiling.span('stft'):
+        spectrogram = power_spectrogram(audio)
 
     # Map to 40 Mel bands
-    mel_spectrogram = librosa.feature.melspectrogram(audio, OSE_SAMPLE_RATE, spectrogram, n_mels=40)
+    with Profiling.span('mel'):
+        mel_basis = Functions.mel_filterbank(OSE_SAMPLE_RATE, N_FFT, N_MELS).astype(dtype, copy=False)
+        mel_spectrogram = spectrogram @ mel_basis.T
+        del spectrogram
 
-    # Calculate first order difference over time axis
-    fod = np.diff(mel_spectrogram, n=1, axis=1)
-    # Perform half-wave rectification
-    fod[fod < 0] = 0
-
-    # Sum remaining values over frequency-band axis
-    fod = np.sum(fod, axis=0)
+    # Half-wave rectified first order difference over time axis, summed over the frequency-band axis
+    with Profiling.span('difference'):
+        ose = Functions.rectified_difference_sum(mel_spectrogram)
 
     # High-pass resulting signal with cutoff at 0.4Hz
-    ose = Functions.apply_highpass_filter(fod, OSE_SAMPLE_RATE, 0.4, 2)
+    with Profiling.span('highpass'):
+        b, a = Functions.highpass_coefficients(OSE_SAMPLE_RATE, HIGHPASS_CUTOFF, HIGHPASS_ORDER)
+        Functions.filtfilt_inplace(ose, b, a, Globals.OSE_CHUNK_SIZE)
 
-    # Convolve with 20ms Gaussian window
-    M = 0.02 * OSE_SAMPLE_RATE
-    std = np.ceil(M / 12)
-    window = signal.gaussian(M, std, sym=True)
-    ose = signal.convolve(ose, window, mode='same') / sum(window)
+    # Convolve with 20ms Gaussian window (overlap-add FFT convolution)
+    with Profiling.span('smoothing'):
+        ose = signal.oaconvolve(ose, Functions.normalised_smoothing_window(OSE_SAMPLE_RATE, dtype), mode='same')
 
     # Normalise by dividing by standard deviation
-    ose = ose / np.std(ose)
+    with Profiling.span('normalise'):
+        ose /= np.std(ose)
 
     return ose
 
 
-def state_space_search(ose, tau_index, is_duple_tempo):
+def calculate_onset_strength_envelopes(signals, sr):
+    """
+    Batch version of calculate_onset_strength_envelope for a list of signals with the same sample rate.
+    The Mel filterbank, the high-pass coefficients and the smoothing window are only calculated once, and signals of
+    equal length (e.g. the 30s Ballroom clips) are stacked and processed with batched resampling, FFTs and filters
+    :param signals: List of audio signals
+    :param sr: The sample rate of all signals
+    :return: List of onset strength envelopes, in the order of the signals
+    """
+    from scipy import signal
+    dtype = Functions.ose_dtype()
+    mel_basis = Functions.mel_filterbank(OSE_SAMPLE_RATE, N_FFT, N_MELS).astype(dtype, copy=False)
+    b, a = Functions.highpass_coefficients(OSE_SAMPLE_RATE, HIGHPASS_CUTOFF, HIGHPASS_ORDER)
+    window = Functions.normalised_smoothing_window(OSE_SAMPLE_RATE, dtype)
+
+    # Group signals of equal length so that they can be stacked without padding
+    groups = {}
+    for i, sig in enumerate(signals):
+        groups.setdefault(len(sig), []).append(i)
+
+    oses = [None] * len(signals)
+    for indices in groups.values():
+        audio = np.stack([signals[i] for i in indices])
+        # Resample to 8kHz
+        audio = Audio.resample(audio, sr, OSE_SAMPLE_RATE, Globals.RESAMPLE_QUALITY).astype(dtype, copy=False)
+
+        # STFT with 64ms windows and 4ms hop
+        spectrogram = power_spectrogram(audio)
+
+        # Map to 40 Mel bands: (signals, frames, bins) x (bins, bands) -> (signals, frames, bands)
+        mel_spectrogram = spectrogram @ mel_basis.T
+
+        # Half-wave rectified first order difference over time, summed over the Mel bands
+        fod = np.diff(mel_spectrogram, n=1, axis=1)
+        fod[fod < 0] = 0
+        fod = np.sum(fod, axis=2)
+
+        # High-pass filter, convolve with the Gaussian window and normalise each signal
+        ose = signal.filtfilt(b, a, fod, axis=1).astype(dtype, copy=False)
+        ose = signal.oaconvolve(ose, window[np.newaxis, :], mode='same', axes=1)
+        ose /= np.std(ose, axis=1, keepdims=True)
+
+        for row, i in enumerate(indices):
+            oses[i] = ose[row]
+    return oses
+
+
+def file_onset_strength_envelope_chunked(file, path=None):
+    """
+    Calculate the onset strength envelope of an arbitrarily long audio file with bounded memory
+    (see calculate_onset_strength_envelope_chunked)
+    :param file: Path to the audio file
+    :param path: Optional path of a .npy file the envelope is written to (memory-mapped instead of held in memory)
+    :return: The onset strength envelope
+    """
+    length, sr = Audio.info(file)
+    out = None
+    if path is not None:
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=Functions.ose_dtype(),
+                                        shape=(onset_strength_envelope_length(length, sr),))
+    blocks = Audio.blocks(file, Globals.OSE_CHUNK_SIZE * sr // OSE_SAMPLE_RATE)
+    return calculate_onset_strength_envelope_chunked(blocks, sr, length, out)
+
+
+def onset_strength_envelope_length(length, sr):
+    """
+    Number of samples of the onset strength envelope of a signal
+    :param length: The number of samples of the signal
+    :param sr: Its sample rate
+    :return: The length of the envelope
+    """
+    ratio = Fraction(OSE_SAMPLE_RATE, sr)
+    # Length after resampling (as scipy.signal.resample_poly)
+    length = -((-length * ratio.numerator) // ratio.denominator)
+    # One STFT frame per hop (centred frames), minus one for the first order difference
+    return length // FFT_HOP
+
+
+@Profiling.profiled('ose_chunked')
+def calculate_onset_strength_envelope_chunked(blocks, sr, length, out=None):
+    """
+    Chunked version of calculate_onset_strength_envelope for arbitrarily long signals.
+    The resampled signal is processed in blocks of Globals.OSE_CHUNK_SIZE samples, where consecutive blocks share the
+    N_FFT - FFT_HOP samples of the frames that overlap them, and the envelope is assembled in a preallocated array.
+    The high-pass filter, the smoothing and the normalisation are then applied in place, block by block, so apart from
+    the output the memory needed does not depend on the length of the signal.
+    Resampling always uses the polyphase filter (Streaming.StreamingResampler), so the result matches
+    calculate_onset_strength_envelope within float tolerance for RESAMPLE_QUALITY "fast" or audio at OSE_SAMPLE_RATE
+    :param blocks: Iterable of consecutive blocks of the mono signal (e.g. Audio.blocks)
+    :param sr: The sample rate of the signal
+    :param length: The total number of samples of the signal
+    :param out: Optional float array of length onset_strength_envelope_length(length, sr) to write the envelope to,
+    e.g. a np.memmap (by default an array of dtype Globals.OSE_DTYPE is allocated)
+    :return: The onset strength envelope (out if given)
+    """
+    chunk_size = Globals.OSE_CHUNK_SIZE
+    size = onset_strength_envelope_length(length, sr)
+    if out is None:
+        out = np.empty(size, dtype=Functions.ose_dtype())
+    elif out.shape != (size,):
+        raise ValueError("Output array of shape " + str(out.shape) + " given, expected " + str((size,)))
+    mel_basis = Functions.mel_filterbank(OSE_SAMPLE_RATE, N_FFT, N_MELS)
+    window = np.hanning(N_FFT + 1)[:-1]
+    half = N_FFT // 2
+    import Streaming
+    resampler = Streaming.StreamingResampler(sr, OSE_SAMPLE_RATE)
+
+    # Samples of the (reflect-padded) resampled signal that have not been framed yet
+    buffer = np.zeros(0)
+    started = False
+    # Mel spectrum of the last frame of the previous chunk, for the first order difference
+    previous = None
+    position = 0
+    for block in chain(blocks, [None]):
+        final = block is None
+        if final:
+            samples = resampler.process(np.zeros(0), final=True)
+        else:
+            samples = resampler.process(block)
+        buffer = np.concatenate((buffer, samples))
+        if not started:
+            if final and buffer.size <= half:
+                # Signal shorter than the padding: reflect it repeatedly at both ends like np.pad
+                buffer = np.pad(buffer, half, mode='reflect')
+            elif final or buffer.size > half:
+                # Reflect padding at the start of the signal (as in power_spectrogram)
+                buffer = np.concatenate((buffer[half:0:-1], buffer))
+                if final:
+                    buffer = np.concatenate((buffer, buffer[-2:-half - 2:-1]))
+            else:
+                continue
+            started = True
+        elif final:
+            # Reflect padding at the end of the signal
+            buffer = np.concatenate((buffer, buffer[-2:-half - 2:-1]))
+        if buffer.size < N_FFT:
+            continue
+
+        n_frames = (buffer.size - N_FFT) // FFT_HOP + 1
+        for first in range(0, n_frames, chunk_size // FFT_HOP):
+            last = min(first + chunk_size // FFT_HOP, n_frames)
+            # STFT with 64ms windows and 4ms hop, mapped to 40 Mel bands
+            frames = np.lib.stride_tricks.sliding_window_view(buffer[first * FFT_HOP:(last - 1) * FFT_HOP + N_FFT],
+                                                              N_FFT)[::FFT_HOP]
+            mel_spectrogram = (np.abs(np.fft.rfft(frames * window, axis=-1)) ** 2) @ mel_basis.T
+            if previous is not None:
+                mel_spectrogram = np.concatenate((previous, mel_spectrogram))
+            previous = mel_spectrogram[-1:]
+
+            # Half-wave rectified first order difference over time, summed over the Mel bands
+            fod = np.diff(mel_spectrogram, n=1, axis=0)
+            fod[fod < 0] = 0
+            out[position:position + fod.shape[0]] = np.sum(fod, axis=1)
+            position += fod.shape[0]
+        # Keep the samples shared with the next frames
+        buffer = buffer[n_frames * FFT_HOP:]
+    if position != size:
+        raise ValueError("Expected " + str(length) + " samples, got blocks with a different total length")
+
+    # High-pass filter, convolve with the Gaussian window and normalise, in place
+    b, a = Functions.highpass_coefficients(OSE_SAMPLE_RATE, HIGHPASS_CUTOFF, HIGHPASS_ORDER)
+    Functions.filtfilt_inplace(out, b, a, chunk_size)
+    Functions.convolve_inplace(out, Functions.normalised_smoothing_window(OSE_SAMPLE_RATE, out.dtype), chunk_size)
+    out /= Functions.blockwise_std(out, chunk_size)
+    return out
+
+
+def power_spectrogram(audio):
+    """
+    Power spectrogram of centred STFT frames (reflect padding and periodic Hann window like librosa.core.stft)
+    with N_FFT samples per frame and a hop of FFT_HOP samples. The frames are windowed and transformed in blocks of
+    STFT_BLOCK frames, so apart from the output only one block of windowed frames and spectra is allocated
+    :param audio: A signal or a stack of signals (time on the last axis)
+    :return: Array of shape (..., frames, N_FFT / 2 + 1), float32 for float32 signals and float64 otherwise
+    """
+    import scipy.fft
+    dtype = np.result_type(audio.dtype, np.float32)
+    window = np.hanning(N_FFT + 1)[:-1].astype(dtype)
+    padding = [(0, 0)] * (audio.ndim - 1) + [(N_FFT // 2, N_FFT // 2)]
+    audio = np.pad(audio, padding, mode='reflect')
+    frames = np.lib.stride_tricks.sliding_window_view(audio, N_FFT, axis=-1)[..., ::FFT_HOP, :]
+    power = np.empty(frames.shape[:-1] + (N_FFT // 2 + 1,), dtype=dtype)
+    # A block holds STFT_BLOCK frames in total, across all signals of a stack
+    size = max(1, STFT_BLOCK // int(np.prod(frames.shape[:-2])))
+    for first in range(0, frames.shape[-2], size):
+        block = power[..., first:first + size, :]
+        # The windowed frames are the only copy of the frames, and the FFT may overwrite them
+        spectrum = scipy.fft.rfft(frames[..., first:first + size, :] * window, axis=-1, overwrite_x=True)
+        np.abs(spectrum, out=block)
+        np.square(block, out=block)
+    return power
+
+
+@Profiling.profiled('state_space_search')
+def state_space_search(ose, tau_index, is_duple_tempo, window=SEARCH_WINDOW):
     """
     State-space search approach to beat tracking: This function goes through the onset strength envelope
     and finds suitable candidates for beats.
     :param ose: The onset strength envelope from Ellis-07
-    :param tau_index: Initial estimation of distance to next beat
+    :param tau_index: Initial estimation of distance to next beat, or a tempo curve with the distance for every frame
+    (see Tempogram.tempo_curve). With a tempo curve the distance is taken from the curve at every beat instead of
+    being adjusted to the found beats
     :param is_duple_tempo: Whether duple (True) or triple (False) tempo is assumed
+    :param window: Half width of the search space around the expected beat in frames
     :return: The indices of beats and downbeats
     """
     # Found beats are store here
@@ -89,84 +371,96 @@ def state_space_search(ose, tau_index, is_duple_tempo):
     metre = 4 if is_duple_tempo else 3
     beat_numbers = []
 
-    # Find peaks in the onset strength envelope
-    peaks = find_peaks(ose)[0]
+    from scipy.signal import find_peaks
+    # Find peaks in the onset strength envelope (sorted by position)
+    # The plateau edges are needed to decide which peaks find_peaks would find in a slice of the envelope
+    peaks, properties = find_peaks(ose, plateau_size=1)
+    left_edges = properties['left_edges']
+    right_edges = properties['right_edges']
     # Find first peak
     first_peak = peaks[0]
+    tempo = None
+    if np.ndim(tau_index) > 0:
+        tempo = np.asarray(tau_index, dtype=int)
+        tau_index = int(tempo[first_peak])
+
+    # The Numba kernel only supports a constant tempo
+    if Backend.use_numba() and tempo is None:
+        beats, beat_numbers = Backend.kernels().state_space_search(peaks, left_edges, right_edges, ose.size,
+                                                                   tau_index, metre, window)
+        beats = list(beats)
+        downbeats = [beat for beat, beat_number in zip(beats, beat_numbers) if beat_number == 1]
+        return beats, downbeats
+
     # Set the first beat to the first peak in the onset strength envelope
     beats.append(first_peak)
     # Set beat number
     beat_numbers.append(downbeat_counter)
     # Variable to keep track of the current position in the onset strength envelope
     index = first_peak
-    while index + tau_index < ose.size:
-        # Look for next peak in the range of (index + tau_index) +/- window
-        window = 24  # 96ms
+    # The tempo adaptation can shrink the distance to the next beat to zero or below. The search then stops, and only
+    # peaks after the current position are accepted, so that index strictly increases and the search terminates
+    while tau_index >= 1 and index + tau_index < ose.size:
         # The exact position of the next expected beat, according to the current tempo estimate
         expected = index + tau_index
-        # The search space around the expected beat
-        space = np.arange(expected - window, expected + window)
-        # Flag indicating whether a peak was found in the current search space
-        found = False
-        # Go through the search space and look for a peak
-        for candidate in space:
-            if candidate in peaks:
-                found = True
-                # Get difference of expectation
-                diff = expected - candidate
-                # Adjust assumed tempo
-                if diff != 0:
-                    tau_index = int((tau_index * 2 - diff) / 2)
-                # Update current position in the onset strength envelope
-                index = candidate
-                # Add found beat to list of beats
-                beats.append(candidate)
-
-                # Reset downbeat counter if it is over the metre value
-                if downbeat_counter > metre:
-                    downbeat_counter = 1
-                # Append current beat number to beat numbers array
-                beat_numbers.append(downbeat_counter)
-                downbeat_counter = downbeat_counter + 1
-                break
-        # If no suitable candidate for a beat was found in the given search space
-        # Start looking for the next peak starting from the current position + a given window size
-        # The size of the window is increased until the next peak is found
-        if found is False:
-            # Assume that there is a longer break
-            # Look for next peak and start again from there
-            candidate = None
-            # Multiplicator for the window: This increases in order to extend the search window
-            # if no suitable candidate has been found yet
-            look_ahead = 1
-            while candidate is None and index + window * look_ahead <= ose.size:
-                ext_window = window * look_ahead
-                cur_peaks = find_peaks(ose[index + tau_index:index + tau_index + ext_window])[0]
-                look_ahead = look_ahead + 1
-                # If a peak was found, choose it for the next beat candidate
-                if len(cur_peaks) > 0:
-                    candidate = index + cur_peaks[0]
-                    index = candidate
-                    break
-            if candidate is None:
-                # Reached the end of the onset strength envelope
-                # Collect indices of downbeats and return results
-                downbeat_indices = [i for i, x in enumerate(beat_numbers) if x == 1]
-                # Convert to onset strength envelope indices
-                downbeats = [beats[i] for i in downbeat_indices]
-                return beats, downbeats
-            else:
-                # If a candidate was found through the extended search append it and continue
-                beats.append(candidate)
-                # The extended search usually happens when there is a longer break in the piece
-                # Therefore the downbeat counter is reset to 1 after break, assuming that the found beat
-                # will be a downbeat
+        # The first peak after the current position in the search space [expected - window, expected + window)
+        # around the expected beat
+        i = np.searchsorted(peaks, max(expected - window, index + 1), side='left')
+        if i < peaks.size and peaks[i] < expected + window:
+            candidate = peaks[i]
+            # Get difference of expectation
+            diff = expected - candidate
+            # Adjust assumed tempo
+            if diff != 0:
+                tau_index = int((tau_index * 2 - diff) / 2)
+            # Update current position in the onset strength envelope
+            index = candidate
+            if tempo is not None:
+                tau_index = int(tempo[index])
+            # Add found beat to list of beats
+            beats.append(candidate)
+
+            # Reset downbeat counter if it is over the metre value
+            if downbeat_counter > metre:
                 downbeat_counter = 1
-                beat_numbers.append(downbeat_counter)
-                downbeat_counter = downbeat_counter + 1
+            # Append current beat number to beat numbers array
+            beat_numbers.append(downbeat_counter)
+            downbeat_counter = downbeat_counter + 1
+            continue
+
+        # If no suitable candidate for a beat was found in the given search space
+        # Assume that there is a longer break and look for the next peak after the expected beat.
+        # The search window starting at the expected beat is extended by multiples of the window size until it
+        # contains a peak, as long as index + window * look_ahead does not exceed the envelope
+        start = expected
+        # The first peak that lies completely inside a window starting at "start" (the left neighbour of the
+        # plateau has to be inside the window as well)
+        j = np.searchsorted(left_edges, start + 1, side='left')
+        candidate = None
+        if j < peaks.size:
+            # Smallest multiplicator for which the window [start, start + window * look_ahead) also contains the
+            # right neighbour of the plateau, i.e. right_edges[j] + 1 <= start + window * look_ahead - 1
+            look_ahead = max(1, -((start - 2 - right_edges[j]) // window))
+            if index + window * look_ahead <= ose.size:
+                # The peak position is relative to the window, but it is added to the current position
+                candidate = index + (peaks[j] - start)
+                index = candidate
+                if tempo is not None:
+                    tau_index = int(tempo[index])
+        if candidate is None:
+            # Reached the end of the onset strength envelope
+            break
+        # If a candidate was found through the extended search append it and continue
+        beats.append(candidate)
+        # The extended search usually happens when there is a longer break in the piece
+        # Therefore the downbeat counter is reset to 1 after break, assuming that the found beat
+        # will be a downbeat
+        downbeat_counter = 1
+        beat_numbers.append(downbeat_counter)
+        downbeat_counter = downbeat_counter + 1
 
     # Get indices of downbeats
     downbeat_indices = [i for i, x in enumerate(beat_numbers) if x == 1]
     # Convert to frame indices
     downbeats = [beats[i] for i in downbeat_indices]
-    return beats, downbeats
\ No newline at end of file
+    return beats, downbeats
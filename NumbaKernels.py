@@ -0,0 +1,123 @@
+import numpy as np
+from numba import njit
+
+# All kernels are scalar versions of the NumPy code they replace and produce identical results:
+# Sums are evaluated in the same order and ties are resolved to the first maximum like np.argmax.
+# cache=True stores the compiled machine code next to this file (or in NUMBA_CACHE_DIR)
+
+
+@njit(cache=True)
+def forward_pass(ose, kernel, longest, shortest):
+    """
+    Ellis-07 forward pass, see Ellis_07_Search.forward_pass
+    :param ose: The onset strength envelope
+    :param kernel: The transition penalties returned by Ellis_07_Search.transition_kernel
+    :param longest: Largest distance between two beats in frames
+    :param shortest: Smallest distance between two beats in frames (after the lead-in)
+    :return: The objective function C and the indices of the previous beats
+    """
+    n = ose.size
+    C = np.full(n, -np.inf)
+    P_indices = np.zeros(n, dtype=np.int64)
+    if n == 0:
+        return C, P_indices
+    C[0] = ose[0]
+    for t in range(1, n):
+        if t < shortest:
+            # Lead-in: Every earlier frame is a possible predecessor
+            first = 0
+            last = t - 1
+        else:
+            first = max(0, t - longest)
+            last = t - shortest
+        best = -np.inf
+        best_index = first
+        for j in range(first, last + 1):
+            value = kernel[t - j] + C[j]
+            if value > best:
+                best = value
+                best_index = j
+        P_indices[t] = best_index
+        C[t] = ose[t] + best
+    return C, P_indices
+
+
+@njit(cache=True)
+def state_space_search(peaks, left_edges, right_edges, size, tau_index, metre, window):
+    """
+    Greedy peak walk of Main.state_space_search
+    :param peaks: Sorted peak positions returned by find_peaks
+    :param left_edges: Left plateau edges of the peaks
+    :param right_edges: Right plateau edges of the peaks
+    :param size: Length of the onset strength envelope
+    :param tau_index: Initial estimation of distance to next beat
+    :param metre: 3 or 4
+    :param window: Half size of the search space around the expected beat
+    :return: Arrays of beat indices and beat numbers
+    """
+    beats = np.empty(64, dtype=np.int64)
+    beat_numbers = np.empty(64, dtype=np.int64)
+    downbeat_counter = 1
+    index = peaks[0]
+    beats[0] = index
+    beat_numbers[0] = downbeat_counter
+    count = 1
+    # Stop when the tempo collapses and only accept peaks after index, like Main.state_space_search
+    while tau_index >= 1 and index + tau_index < size:
+        expected = index + tau_index
+        i = np.searchsorted(peaks, max(expected - window, index + 1))
+        if i < peaks.size and peaks[i] < expected + window:
+            candidate = peaks[i]
+            diff = expected - candidate
+            if diff != 0:
+                tau_index = int((tau_index * 2 - diff) / 2)
+            index = candidate
+            if downbeat_counter > metre:
+                downbeat_counter = 1
+            beat_number = downbeat_counter
+            downbeat_counter = downbeat_counter + 1
+        else:
+            # Extended search
+            start = expected
+            j = np.searchsorted(left_edges, start + 1)
+            if j == peaks.size:
+                break
+            look_ahead = max(1, -((start - 2 - right_edges[j]) // window))
+            if index + window * look_ahead > size:
+                break
+            index = index + (peaks[j] - start)
+            beat_number = 1
+            downbeat_counter = 2
+        if count == beats.size:
+            beats = np.concatenate((beats, np.empty_like(beats)))
+            beat_numbers = np.concatenate((beat_numbers, np.empty_like(beat_numbers)))
+        beats[count] = index
+        beat_numbers[count] = beat_number
+        count = count + 1
+    return beats[:count], beat_numbers[:count]
+
+
+@njit(cache=True)
+def tempo_period_strengths(ac, weighting, multiple_weighting, max_lag, search_range):
+    """
+    Weighted autocorrelation and duple/triple tempo period strengths of Functions.tempo_period_strengths
+    :param ac: The autocorrelation of the onset strength envelope
+    :param weighting: The tempo weighting window for the lags of ac
+    :param multiple_weighting: The weighting window of the multiples in TPS2 and TPS3
+    :param max_lag: The number of lags of the tempo period strengths (plus one)
+    :param search_range: Number of lags searched for duple and triple tempo
+    :return: TPS, TPS2 and TPS3
+    """
+    TPS = np.zeros(max_lag - 1)
+    multiples = np.zeros(max_lag - 1)
+    for i in range(ac.size - 1):
+        TPS[i] = weighting[i + 1] * ac[i + 1]
+        multiples[i] = multiple_weighting[i + 1] * ac[i + 1]
+    TPS2 = np.empty(search_range - 1)
+    TPS3 = np.empty(search_range - 1)
+    for tau in range(1, search_range):
+        TPS2[tau - 1] = (TPS[tau] + 0.5 * multiples[2 * tau] + 0.25 * multiples[2 * tau - 1]
+                         + 0.25 * multiples[2 * tau + 1])
+        TPS3[tau - 1] = (TPS[tau] + 0.33 * multiples[3 * tau] + 0.33 * multiples[3 * tau - 1]
+                         + 0.33 * multiples[3 * tau + 1])
+    return TPS, TPS2, TPS3
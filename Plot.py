@@ -2,16 +2,15 @@ import matplotlib.pyplot as plt
 import numpy as np
 import librosa
 import librosa.display
-import matplotlib as mpl
-
-# Increse DPI (resolution) of plots
-mpl.rcParams['figure.dpi'] = 300
 
 import Globals
 
+# Increase DPI (resolution) of plots
+DPI = 300
+
 
 def plot_mel_spectrogram(mel_spectrogram, sr):
-    plt.figure(figsize=(10, 4))
+    plt.figure(figsize=(10, 4), dpi=DPI)
     S_dB = librosa.power_to_db(mel_spectrogram, ref=np.max)
     librosa.display.specshow(S_dB, x_axis='time',
                              y_axis='mel',
@@ -24,7 +23,7 @@ def plot_mel_spectrogram(mel_spectrogram, sr):
     plt.show()
 
 def plot_OSE(ose, beats):
-    plt.figure(figsize=(10, 4))
+    plt.figure(figsize=(10, 4), dpi=DPI)
     x = np.arange(ose.size)
     plt.plot(x, ose)
     # Plot beats
@@ -36,7 +35,7 @@ def plot_OSE(ose, beats):
     plt.show()
 
 def plot_evaluation(original, found, original_down, found_down, ose, ellis=False):
-    plt.figure(figsize=(10, 4))
+    plt.figure(figsize=(10, 4), dpi=DPI)
     x = np.arange(ose.size)
     to_seconds = Globals.FFT_HOP / Globals.OSE_SAMPLE_RATE
     if ellis:
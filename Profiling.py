@@ -0,0 +1,156 @@
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+# Profiling is disabled by default, spans are no-ops then
+enabled = False
+# Recorded spans of this process: One dictionary per span and file
+records = []
+# File the current spans belong to
+current_file = None
+# Names and child peaks of the open spans
+_stack = []
+_disabled_span = nullcontext()
+
+
+def enable():
+    """
+    Start recording spans (and tracing memory allocations)
+    """
+    # tracemalloc is only imported when profiling is used, as importing it is not free
+    import tracemalloc
+    global enabled
+    enabled = True
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    import tracemalloc
+    global enabled
+    enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def span(name):
+    """
+    Context manager that records wall time, CPU time and the peak of allocated bytes of the enclosed stage.
+    Nested spans are recorded with the names of their parents, e.g. "analyse/ose/stft".
+    If profiling is disabled a shared no-op context manager is returned
+    :param name: Name of the stage
+    """
+    if not enabled:
+        return _disabled_span
+    return _span(name)
+
+
+@contextmanager
+def _span(name):
+    import tracemalloc
+    # tracemalloc only keeps one peak, so the peak of the parent up to now is remembered before it is reset
+    current, parent_peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    entry = {'name': name, 'child_peak': 0}
+    _stack.append(entry)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        peak = max(tracemalloc.get_traced_memory()[1], entry['child_peak'])
+        stage = "/".join(e['name'] for e in _stack)
+        _stack.pop()
+        if _stack:
+            _stack[-1]['child_peak'] = max(_stack[-1]['child_peak'], parent_peak, peak)
+        records.append({'file': current_file, 'stage': stage, 'wall': wall, 'cpu': cpu,
+                        'peak_bytes': max(0, peak - current)})
+
+
+def profiled(name):
+    """
+    Decorator that wraps a whole function in a span
+    :param name: Name of the stage
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with _span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def profile_file(file):
+    """
+    Assign all spans recorded in the enclosed code to a file
+    :param file: Path of the analysed file
+    """
+    global current_file
+    previous = current_file
+    current_file = file
+    try:
+        yield
+    finally:
+        current_file = previous
+
+
+def take_records():
+    """
+    Return and clear the spans recorded so far (e.g. to send them from a worker process to the main process)
+    """
+    global records
+    taken = records
+    records = []
+    return taken
+
+
+def report(span_records):
+    """
+    Aggregate spans per stage
+    :param span_records: List of recorded spans
+    :return: Dictionary mapping stages to count, total and mean wall time, total CPU time (in seconds) and maximum
+    peak of allocated bytes
+    """
+    stages = {}
+    for record in span_records:
+        stage = stages.setdefault(record['stage'], {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_bytes': 0})
+        stage['count'] += 1
+        stage['wall'] += record['wall']
+        stage['cpu'] += record['cpu']
+        stage['peak_bytes'] = max(stage['peak_bytes'], record['peak_bytes'])
+    for stage in stages.values():
+        stage['mean_wall'] = stage['wall'] / stage['count']
+    return stages
+
+
+def format_report(stages):
+    """
+    Format an aggregated report as text table
+    """
+    lines = ["Stage | Count | Wall (s) | Mean wall (ms) | CPU (s) | Peak (MB)"]
+    for name in sorted(stages):
+        stage = stages[name]
+        lines.append(name + " | " + str(stage['count']) + " | " + str(round(stage['wall'], 3)) + " | "
+                     + str(round(stage['mean_wall'] * 1000, 2)) + " | " + str(round(stage['cpu'], 3)) + " | "
+                     + str(round(stage['peak_bytes'] / 1024 ** 2, 2)))
+    return "\n".join(lines)
+
+
+def save_report(path, span_records):
+    """
+    Write the per-file spans and the aggregated report to a JSON file and return the text table
+    :param path: Path of the JSON file
+    :param span_records: List of recorded spans
+    :return: The report as text table
+    """
+    stages = report(span_records)
+    with open(path, 'w') as f:
+        json.dump({'stages': stages, 'spans': span_records}, f, indent=1)
+    return format_report(stages)
@@ -0,0 +1,313 @@
+"""
+Local HTTP service for the beat tracker. Run from the repository root, e.g.:
+    python Service.py --port 8765 --workers 4
+    python Service.py --unix /tmp/beattracker.sock
+Endpoints:
+    POST /track with the audio file itself as body (search and style as query parameters, e.g. /track?search=hmm),
+    or with a JSON body {"path": "...", "search": "greedy", "style": null} to track a file below the --root folder of
+    the service (paths are rejected if the service was started without --root).
+    The response is {"beats": [...], "downbeats": [...]} with times in seconds
+    GET /health returns the number of queued requests and batches in progress
+Concurrent requests are collected into micro-batches for Main.calculate_onset_strength_envelopes and tracked in a
+pool of warm worker processes. If the queue is full, requests are rejected with 503 instead of piling up
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+import Audio
+import Functions
+import Globals
+import Main
+import TempoPrior
+from Globals import OSE_SAMPLE_RATE
+
+# Largest number of requests tracked together
+BATCH_SIZE = 8
+# Time in seconds a batch waits for more requests after its first one
+BATCH_WINDOW = 0.01
+# Largest number of requests waiting for a batch, further requests are rejected
+QUEUE_DEPTH = 64
+# Largest accepted request body in bytes
+MAX_BODY = 200 * 1024 ** 2
+# Reason phrases of the status codes used by the service
+REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 413: 'Payload Too Large',
+           422: 'Unprocessable Entity', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+# Beat searches of Main.track_onset_strength_envelope
+SEARCHES = ('greedy', 'beam', 'hmm', 'coarse')
+
+
+def warm_up():
+    """
+    Initializer of the worker processes: Load the tempo prior, build the cached filterbank, filter coefficients and
+    windows and import (or compile) everything the pipeline needs, so the first request is as fast as the others
+    """
+    Globals.TAU_0 = Functions.find_tempo_period_bias()
+    TempoPrior.get_prior()
+    sig = np.random.default_rng(0).normal(0, 0.1, 10 * OSE_SAMPLE_RATE).astype(np.float32)
+    for ose in Main.calculate_onset_strength_envelopes([sig], OSE_SAMPLE_RATE):
+        Main.track_onset_strength_envelope(ose)
+
+
+def track_batch(items):
+    """
+    Beat-track a batch of requests (runs in the worker processes)
+    :param items: List of requests, dictionaries with the "path" of the audio file or the file contents as "audio",
+    and the "search" and "style" passed to Main.track_onset_strength_envelope
+    :return: List of results, dictionaries with "beats" and "downbeats" in seconds or an "error" message
+    """
+    results = [None] * len(items)
+    signals = []
+    indices = []
+    for i, item in enumerate(items):
+        try:
+            signals.append(decode(item))
+            indices.append(i)
+        except Exception as e:
+            results[i] = {'error': "Could not decode the audio: " + str(e)}
+
+    oses = Main.calculate_onset_strength_envelopes(signals, OSE_SAMPLE_RATE)
+    for i, ose in zip(indices, oses):
+        try:
+            beats, downbeats = Main.track_onset_strength_envelope(ose, items[i]['search'], items[i]['style'])
+            results[i] = {'beats': beats, 'downbeats': downbeats}
+        except Exception as e:
+            results[i] = {'error': "Could not track the beats: " + str(e)}
+    return results
+
+
+def decode(item):
+    """
+    Decode the audio of a request to mono at OSE_SAMPLE_RATE
+    """
+    if item.get('audio') is None:
+        return Audio.load(item['path'])[0]
+    # The decoders read from files (uncompressed WAV files are memory-mapped)
+    fd, path = tempfile.mkstemp(suffix=".audio")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(item['audio'])
+        return np.array(Audio.load(path)[0])
+    finally:
+        os.remove(path)
+
+
+class BeatTrackingService:
+    """
+    Accepts requests, collects them into micro-batches and runs the batches in a pool of worker processes.
+    At most one batch per worker is in progress, and at most queue_depth requests wait for a batch.
+    Requests can only name files below root (no files at all if root is None)
+    """
+
+    def __init__(self, workers, batch_size=BATCH_SIZE, batch_window=BATCH_WINDOW, queue_depth=QUEUE_DEPTH, root=None):
+        self.workers = workers
+        self.root = os.path.realpath(root) if root is not None else None
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.queue = asyncio.Queue(maxsize=queue_depth)
+        self.slots = asyncio.Semaphore(workers)
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=warm_up)
+        self.batches = set()
+        self.batcher = None
+
+    async def start(self):
+        # Start all workers (and run their warm-up) before accepting requests
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, os.getpid) for _ in range(self.workers)))
+        self.batcher = asyncio.ensure_future(self.collect_batches())
+
+    async def close(self):
+        if self.batcher is not None:
+            self.batcher.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def track(self, item):
+        """
+        Queue a request and wait for its result
+        :raises asyncio.QueueFull: If the queue is full
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((item, future))
+        return await future
+
+    async def collect_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Wait for a free worker. Meanwhile new requests fill the queue, which is the backpressure
+            await self.slots.acquire()
+            task = asyncio.ensure_future(self.run_batch(batch))
+            self.batches.add(task)
+            task.add_done_callback(self.batches.discard)
+
+    async def run_batch(self, batch):
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor, track_batch, [item for item, _ in batch])
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.slots.release()
+
+    async def handle(self, reader, writer):
+        """
+        Handle one HTTP request (the connection is closed afterwards)
+        """
+        try:
+            status, response = await self.respond(reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        except ValueError:
+            status, response = 400, {'error': "Malformed HTTP request"}
+        body = json.dumps(response).encode()
+        writer.write(("HTTP/1.1 " + str(status) + " " + REASONS[status] + "\r\n"
+                      + "Content-Type: application/json\r\n"
+                      + "Content-Length: " + str(len(body)) + "\r\n"
+                      + ("Retry-After: 1\r\n" if status == 503 else "")
+                      + "Connection: close\r\n\r\n").encode() + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    def resolve(self, path):
+        """
+        Resolve a requested path relative to the root folder
+        :return: The real path, or None if it is not below the root folder (or there is no root folder)
+        """
+        if self.root is None:
+            return None
+        path = os.path.realpath(os.path.join(self.root, path))
+        if os.path.commonpath([path, self.root]) != self.root:
+            return None
+        return path
+
+    async def respond(self, reader):
+        """
+        Read a request and process it
+        :return: The status code and the JSON response
+        """
+        method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length > MAX_BODY:
+            return 413, {'error': "The request body is larger than " + str(MAX_BODY) + " bytes"}
+        body = await reader.readexactly(length)
+
+        url = urlsplit(target)
+        if method == 'GET' and url.path == '/health':
+            return 200, {'queued': self.queue.qsize(), 'batches': len(self.batches), 'workers': self.workers}
+        if method != 'POST' or url.path != '/track':
+            return 404, {'error': "Use POST /track or GET /health"}
+
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if headers.get('content-type', '').startswith('application/json'):
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                return 400, {'error': "Invalid JSON body"}
+            if not isinstance(payload, dict):
+                return 400, {'error': "The JSON body has to be an object"}
+            query.update(payload)
+            item = {'path': query.get('path'), 'audio': None}
+        else:
+            item = {'path': query.get('path'), 'audio': body if length > 0 else None}
+        if item['path'] is None and item['audio'] is None:
+            return 400, {'error': "Send the audio file as body or its path"}
+        item['search'] = query.get('search', 'greedy')
+        item['style'] = query.get('style')
+        if item['search'] not in SEARCHES:
+            return 400, {'error': "Unknown search, use one of " + ", ".join(SEARCHES)}
+        if item['style'] is not None and not isinstance(item['style'], str):
+            return 400, {'error': "The style has to be a string"}
+        if item['path'] is not None:
+            if not isinstance(item['path'], str):
+                return 400, {'error': "The path has to be a string"}
+            item['path'] = self.resolve(item['path'])
+            if item['path'] is None:
+                return 403, {'error': "Only files below the root folder of the service can be tracked"}
+
+        try:
+            result = await self.track(item)
+        except asyncio.QueueFull:
+            return 503, {'error': "Too many requests in the queue"}
+        except Exception as e:
+            return 500, {'error': str(e)}
+        return (422 if 'error' in result else 200), result
+
+
+async def serve(host='127.0.0.1', port=8765, unix=None, workers=None, batch_size=BATCH_SIZE,
+                batch_window=BATCH_WINDOW, queue_depth=QUEUE_DEPTH, root=None):
+    """
+    Run the service until it is cancelled
+    :param host: Host name to listen on
+    :param port: TCP port to listen on
+    :param unix: If given, the path of a Unix socket to listen on instead of the TCP port
+    :param workers: Number of worker processes, defaults to the number of CPUs
+    :param root: Folder whose files can be tracked by path, None to only accept audio sent as request body
+    """
+    service = BeatTrackingService(workers or os.cpu_count(), batch_size, batch_window, queue_depth, root)
+    await service.start()
+    if unix is not None:
+        server = await asyncio.start_unix_server(service.handle, unix)
+        print("Listening on " + unix)
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+        print("Listening on http://" + host + ":" + str(port))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP service for the beat tracker")
+    parser.add_argument('--host', default='127.0.0.1', help="Host name to listen on")
+    parser.add_argument('--port', type=int, default=8765, help="TCP port to listen on")
+    parser.add_argument('--unix', default=None, help="Listen on this Unix socket instead of the TCP port")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Largest number of requests per batch")
+    parser.add_argument('--batch-window', type=float, default=BATCH_WINDOW * 1000,
+                        help="Time in ms a batch waits for more requests")
+    parser.add_argument('--queue-depth', type=int, default=QUEUE_DEPTH,
+                        help="Largest number of waiting requests before requests are rejected")
+    parser.add_argument('--root', default=None,
+                        help="Folder whose files can be tracked by path (default: only audio sent as body)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, args.workers, args.batch_size, args.batch_window / 1000,
+                          args.queue_depth, args.root))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
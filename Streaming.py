@@ -0,0 +1,373 @@
+from collections import deque
+from fractions import Fraction
+
+import numpy as np
+from scipy.signal import firwin, lfilter, lfilter_zi, upfirdn
+
+import Globals
+import Functions
+from Globals import OSE_SAMPLE_RATE, FFT_HOP, N_FFT, N_MELS, HIGHPASS_CUTOFF, HIGHPASS_ORDER
+
+# Look for the next beat in the range of (index + tau_index) +/- SEARCH_WINDOW (96ms), as in Main.state_space_search
+SEARCH_WINDOW = 24
+# Seconds of audio used for the first tempo estimate before beats are emitted
+WARM_UP = 8
+# Smallest F-measure of the streaming beats after the warm-up w.r.t. the offline beats (see compare_with_offline)
+OFFLINE_AGREEMENT = 0.8
+
+
+class StreamingResampler:
+    """
+    Polyphase resampler that can be fed with consecutive blocks of audio.
+    Only the input samples still needed by the filter are kept between blocks
+    """
+
+    def __init__(self, sr_in, sr_out):
+        ratio = Fraction(sr_out, sr_in)
+        self.up = ratio.numerator
+        self.down = ratio.denominator
+        if self.up == self.down:
+            return
+        # Same anti-aliasing filter as scipy.signal.resample_poly
+        max_rate = max(self.up, self.down)
+        self.half_len = 10 * max_rate
+        self.h = firwin(2 * self.half_len + 1, 1 / max_rate, window=('kaiser', 5.0)) * self.up
+        # Output sample k is centred on the upsampled position k * down. upfirdn can only produce these positions if
+        # the buffer starts at an input index b with b * up = half_len (mod down)
+        self.phase = self.half_len * pow(self.up, -1, self.down) % self.down
+        # Absolute index of the first buffered input sample (samples before the start of the stream are zeros)
+        self.buffer_start = self._aligned_start(0)
+        self.buffer = np.zeros(-self.buffer_start)
+        # Index of the next output sample
+        self.next_out = 0
+
+    def _aligned_start(self, k):
+        """
+        Latest aligned buffer start from which output sample k can be calculated
+        """
+        first_input = -((self.half_len - k * self.down) // self.up)  # ceil((k * down - half_len) / up)
+        return first_input - (first_input - self.phase) % self.down
+
+    def process(self, block, final=False):
+        """
+        Resample the next block of audio
+        :param block: The audio samples
+        :param final: If true, the stream is padded with zeros so that all remaining output samples are produced
+        :return: The resampled samples
+        """
+        if self.up == self.down:
+            return np.asarray(block, dtype=float)
+        self.buffer = np.concatenate((self.buffer, block))
+        available = self.buffer_start + self.buffer.size
+        if final:
+            # Remaining output samples of the stream (same length as scipy.signal.resample_poly)
+            end = -((-available * self.up) // self.down)
+            self.buffer = np.concatenate((self.buffer, np.zeros(self.half_len // self.up + 1)))
+        else:
+            # Output sample k needs all input samples up to (k * down + half_len) / up
+            end = (available * self.up - self.half_len - 1) // self.down + 1
+        if end <= self.next_out:
+            return np.zeros(0)
+
+        y = upfirdn(self.h, self.buffer, self.up, self.down)
+        first = (self.next_out * self.down - self.buffer_start * self.up + self.half_len) // self.down
+        out = y[first:first + end - self.next_out]
+        self.next_out = end
+
+        # Drop the input samples that are not needed any more
+        start = self._aligned_start(self.next_out)
+        self.buffer = self.buffer[start - self.buffer_start:]
+        self.buffer_start = start
+        return out
+
+
+class StreamingBeatTracker:
+    """
+    Incremental version of Main.beatTracker: Audio is passed in blocks and beats and downbeats are returned as soon
+    as they are found. The onset strength envelope is calculated with causal filters and running normalisation
+    statistics, only a bounded history of it is kept for the tempo estimation, so memory is constant per stream.
+    Beats are emitted once the search window around the expected beat has been seen, i.e. with a latency of
+    about tau + SEARCH_WINDOW frames plus half the smoothing window
+    """
+
+    def __init__(self, sr, warm_up=WARM_UP, tempo_update=2):
+        """
+        :param sr: The sample rate of the audio blocks
+        :param warm_up: Seconds of audio used for the first tempo estimate before beats are emitted
+        :param tempo_update: Interval in seconds between tempo re-estimations
+        """
+        # Get tempo period bias (the tempo weighting of Functions.estimate_tempo is zero without it)
+        Globals.TAU_0 = Functions.find_tempo_period_bias()
+        self.resampler = StreamingResampler(sr, OSE_SAMPLE_RATE)
+        # Convert seconds to onset strength envelope frames
+        self.warm_up = int(warm_up * OSE_SAMPLE_RATE / FFT_HOP)
+        self.tempo_update = int(tempo_update * OSE_SAMPLE_RATE / FFT_HOP)
+
+        # STFT state: Centred frames, so the stream starts with N_FFT / 2 zeros
+        self.samples = np.zeros(N_FFT // 2)
+        self.stft_window = np.hanning(N_FFT + 1)[:-1]
+        self.mel_basis = Functions.mel_filterbank(OSE_SAMPLE_RATE, N_FFT, N_MELS)
+        self.previous_mel = None
+
+        # High-pass state (causal filter instead of filtfilt)
+        self.b, self.a = Functions.highpass_coefficients(OSE_SAMPLE_RATE, HIGHPASS_CUTOFF, HIGHPASS_ORDER)
+        self.zi = None
+
+        # Smoothing state: The last samples needed for the convolution with the Gaussian window
+        self.smoothing_window = Functions.smoothing_window(OSE_SAMPLE_RATE)
+        self.smoothing_window = self.smoothing_window / sum(self.smoothing_window)
+        # The convolution is centred like mode='same', which delays the output by half the window
+        self.smoothing_delay = (self.smoothing_window.size - 1) // 2
+        self.smoothing_history = np.zeros(self.smoothing_window.size - 1)
+        self.smoothed_frames = 0
+
+        # Running mean and variance of the smoothed envelope for the normalisation
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+        # Bounded onset strength envelope history (enough for the lags searched by Functions.estimate_tempo)
+        self.history = np.zeros(3 * Functions.TEMPO_SEARCH_RANGE)
+        # Number of onset strength envelope frames seen so far
+        self.frames = 0
+        self.next_tempo_update = self.warm_up
+        # Peaks that have been confirmed by their right neighbour and are not behind the search position yet
+        self.peaks = deque()
+
+        # Search state, as in Main.state_space_search
+        self.tau_index = None
+        self.is_duple_tempo = True
+        self.index = None
+        self.downbeat_counter = 1
+        self.finished = False
+
+    def process(self, block):
+        """
+        Analyse the next block of audio
+        :param block: Mono audio samples at the sample rate passed to the constructor
+        :return: The new beats and downbeats in seconds
+        """
+        audio = self.resampler.process(np.asarray(block, dtype=float))
+        return self._process_audio(audio, final=False)
+
+    def flush(self):
+        """
+        Signal the end of the stream and return the remaining beats and downbeats in seconds
+        """
+        audio = self.resampler.process(np.zeros(0), final=True)
+        # Pad the end of the stream like the centred STFT does
+        audio = np.concatenate((audio, np.zeros(N_FFT // 2)))
+        return self._process_audio(audio, final=True)
+
+    def _process_audio(self, audio, final):
+        ose = self._onset_strength(audio, final)
+        self._append_history(ose)
+
+        # Tempo estimation on the bounded history
+        if self.frames >= self.next_tempo_update or (final and self.tau_index is None and self.frames > 0):
+            history = self.history[-min(self.frames, self.history.size):]
+            tau_est, tau_index, is_duple_tempo = Functions.estimate_tempo(history)
+            # A tempo of 0 frames would find the current beat as its own successor forever, so such an estimate is
+            # ignored. Otherwise tempo and metre are updated together, so the metre always belongs to the tempo searched
+            if tau_index > 0:
+                self.tau_index = int(tau_index)
+                self.is_duple_tempo = is_duple_tempo
+            self.next_tempo_update = self.frames + self.tempo_update
+
+        beats = []
+        downbeats = []
+        if self.tau_index is None:
+            return beats, downbeats
+        for beat, beat_number in self._search(final):
+            beats.append(beat * FFT_HOP / OSE_SAMPLE_RATE)
+            if beat_number == 1:
+                downbeats.append(beat * FFT_HOP / OSE_SAMPLE_RATE)
+        return beats, downbeats
+
+    def _onset_strength(self, audio, final):
+        """
+        Causal onset strength envelope of the next resampled audio samples
+        """
+        # STFT frames that can be calculated from the buffered samples
+        self.samples = np.concatenate((self.samples, audio))
+        n_frames = 1 + (self.samples.size - N_FFT) // FFT_HOP if self.samples.size >= N_FFT else 0
+        frames = np.lib.stride_tricks.sliding_window_view(self.samples, N_FFT)[::FFT_HOP][:n_frames]
+        spectrogram = np.abs(np.fft.rfft(frames * self.stft_window, axis=1)) ** 2
+        self.samples = self.samples[n_frames * FFT_HOP:]
+        mel_spectrogram = self.mel_basis @ spectrogram.T
+
+        # Half-wave rectified first order difference, summed over the Mel bands
+        if self.previous_mel is not None:
+            mel_spectrogram = np.hstack((self.previous_mel, mel_spectrogram))
+        if mel_spectrogram.shape[1] == 0:
+            return np.zeros(0)
+        self.previous_mel = mel_spectrogram[:, -1:]
+        fod = np.diff(mel_spectrogram, n=1, axis=1)
+        fod = np.sum(np.maximum(fod, 0), axis=0)
+        if fod.size == 0:
+            return fod
+
+        # High-pass filter
+        if self.zi is None:
+            self.zi = lfilter_zi(self.b, self.a) * fod[0]
+        fod, self.zi = lfilter(self.b, self.a, fod, zi=self.zi)
+
+        # Convolve with the Gaussian window
+        if final:
+            fod = np.concatenate((fod, np.zeros(self.smoothing_delay)))
+        smoothed = np.convolve(np.concatenate((self.smoothing_history, fod)), self.smoothing_window, mode='valid')
+        self.smoothing_history = np.concatenate((self.smoothing_history, fod))[-self.smoothing_history.size:]
+        # Skip the first outputs, they belong to negative frame indices
+        skip = max(0, self.smoothing_delay - self.smoothed_frames)
+        self.smoothed_frames += smoothed.size
+        smoothed = smoothed[skip:]
+        if smoothed.size == 0:
+            return smoothed
+
+        # Normalise by the running standard deviation (Chan et al. parallel variance update)
+        count = self.count + smoothed.size
+        delta = np.mean(smoothed) - self.mean
+        self.m2 += np.sum((smoothed - np.mean(smoothed)) ** 2) + delta ** 2 * self.count * smoothed.size / count
+        self.mean += delta * smoothed.size / count
+        self.count = count
+        std = np.sqrt(self.m2 / self.count)
+        return smoothed / std if std > 0 else smoothed
+
+    def _append_history(self, ose):
+        """
+        Append new frames to the bounded history and record the peaks that can be confirmed
+        """
+        if ose.size == 0:
+            return
+        # The last two known frames are needed to confirm a peak at the last known frame
+        previous = self.history[self.history.size - min(self.frames, 2):]
+        self.history = np.concatenate((self.history, ose))[-self.history.size:]
+        start = self.frames
+        self.frames += ose.size
+
+        values = np.concatenate((previous, ose))
+        offset = start - len(previous)
+        # Strict local maxima (frame i is confirmed once frame i + 1 is known)
+        is_peak = (values[1:-1] > values[:-2]) & (values[1:-1] > values[2:])
+        for peak in np.flatnonzero(is_peak) + 1 + offset:
+            if peak > 0:
+                self.peaks.append(int(peak))
+
+    def _search(self, final):
+        """
+        Advance the greedy search of Main.state_space_search as far as the seen frames allow
+        :return: List of (beat index, beat number) tuples
+        """
+        found_beats = []
+        if self.finished:
+            return found_beats
+        window = SEARCH_WINDOW
+        # Frames of the onset strength envelope that are known
+        known = self.frames
+
+        if self.index is None:
+            if len(self.peaks) == 0:
+                return found_beats
+            # Set the first beat to the first peak in the onset strength envelope
+            self.index = self.peaks[0]
+            found_beats.append((self.index, self.downbeat_counter))
+
+        while True:
+            # Forget peaks that can not be candidates any more
+            while self.peaks and self.peaks[0] < self.index - window:
+                self.peaks.popleft()
+            # The tempo adaptation can shrink the distance to the next beat to zero or below, the search then waits for
+            # the next tempo estimate (as in Main.state_space_search, only peaks after the current beat are candidates)
+            if self.tau_index < 1 or (final and self.index + self.tau_index >= known):
+                self.finished = final
+                return found_beats
+            expected = self.index + self.tau_index
+
+            # Look for a peak in the search space around the expected beat
+            candidate = next((p for p in self.peaks if max(expected - window, self.index + 1) <= p < expected + window),
+                             None)
+            if candidate is not None:
+                diff = expected - candidate
+                if diff != 0:
+                    self.tau_index = int((self.tau_index * 2 - diff) / 2)
+                self.index = candidate
+                if self.downbeat_counter > self.metre:
+                    self.downbeat_counter = 1
+                found_beats.append((candidate, self.downbeat_counter))
+                self.downbeat_counter = self.downbeat_counter + 1
+                continue
+            if not final and known < expected + window + 1:
+                # The search space has not been seen completely yet
+                return found_beats
+
+            # Extended search: The first peak after the expected beat, mapped back by tau_index like the
+            # look-ahead loop of Main.state_space_search
+            start = expected
+            peak = next((p for p in self.peaks if p >= start + 1), None)
+            if peak is not None:
+                look_ahead = max(1, -((start - 2 - peak) // window))
+                if self.index + window * look_ahead > known:
+                    if not final:
+                        return found_beats
+                    peak = None
+            if peak is None:
+                if final:
+                    self.finished = True
+                # Otherwise wait for the next peak
+                return found_beats
+            self.index = self.index + (peak - start)
+            # The downbeat counter is reset after a break, assuming that the found beat is a downbeat
+            self.downbeat_counter = 1
+            found_beats.append((self.index, self.downbeat_counter))
+            self.downbeat_counter = self.downbeat_counter + 1
+
+    @property
+    def metre(self):
+        # Supported metres are 3/4 and 4/4
+        return 4 if self.is_duple_tempo else 3
+
+
+def track_file(file, block_size=4096):
+    """
+    Beat-track a file block by block with the StreamingBeatTracker
+    :param file: Path to the audio file
+    :param block_size: Number of samples per block
+    :return: Lists of beats and downbeats in seconds
+    """
+    import librosa
+    sr = librosa.get_samplerate(file)
+    tracker = StreamingBeatTracker(sr)
+    beats = []
+    downbeats = []
+    for block in librosa.stream(file, block_length=1, frame_length=block_size, hop_length=block_size,
+                                mono=True, fill_value=None):
+        new_beats, new_downbeats = tracker.process(block)
+        beats.extend(new_beats)
+        downbeats.extend(new_downbeats)
+    new_beats, new_downbeats = tracker.flush()
+    beats.extend(new_beats)
+    downbeats.extend(new_downbeats)
+    return beats, downbeats
+
+
+def compare_with_offline(file, block_size=4096):
+    """
+    Check that the streaming beats converge to the offline Main.beatTracker output: Beats found after the
+    warm-up are scored against the offline beats
+    :param file: Path to a Ballroom *.wav file
+    :param block_size: Number of samples per block
+    :return: The F-measure of the streaming beats w.r.t. the offline beats
+    :raises AssertionError: If the F-measure is below OFFLINE_AGREEMENT
+    """
+    import mir_eval
+    import Main
+
+    beats, downbeats = track_file(file, block_size)
+    offline_beats, offline_downbeats = Main.beatTracker(file)
+    beats = np.array(beats)
+    offline_beats = np.array(offline_beats)
+    # The streaming tempo is only estimated after the warm-up
+    f_measure = mir_eval.beat.f_measure(offline_beats[offline_beats >= WARM_UP], beats[beats >= WARM_UP])
+    print("Streaming vs. offline F-measure for " + str(file) + ": " + str(round(f_measure, 2)))
+    assert f_measure >= OFFLINE_AGREEMENT, "Streaming beats of " + str(file) + " do not converge to the offline beats"
+    return f_measure
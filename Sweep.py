@@ -0,0 +1,228 @@
+"""
+Parameter sweeps over the Ballroom dataset. Run from the repository root, e.g.:
+    python Sweep.py --search greedy ellis --window 16 24 32 --alpha 10 30 100 --margin 50 70 --jobs 4
+Every configuration of the grid is evaluated on every file. The analysis is a chain of memoized stages per file
+(onset strength envelope -> autocorrelation -> tempo -> beats -> scores), and a stage is keyed only by the
+parameters it depends on, so it is computed exactly once per distinct upstream configuration
+"""
+import argparse
+import csv
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+import Ellis_07_Search
+import Evaluation
+import Evaluation_mir_eval
+import FeatureCache
+import Functions
+import Globals
+import Main
+from Globals import OSE_SAMPLE_RATE, FFT_HOP
+
+# Default file the table of a sweep is written to
+SWEEP_FILE = "sweep.csv"
+# Values of the parameters that are not swept
+DEFAULTS = {'search': 'greedy', 'weighting_curve': Functions.WEIGHTING_CURVE, 'window': Main.SEARCH_WINDOW,
+            'alpha': Ellis_07_Search.ALPHA, 'margin': Evaluation.MARGIN}
+# Parameters each stage depends on, directly or through the stages before it
+STAGE_PARAMETERS = {
+    'ose': (),
+    'autocorrelation': (),
+    'tempo': ('weighting_curve',),
+    'beats': ('weighting_curve', 'search', 'window', 'alpha'),
+    'scores': ('weighting_curve', 'search', 'window', 'alpha', 'margin'),
+}
+# Parameters that are only used by one of the beat searches
+SEARCH_PARAMETERS = {'greedy': ('window',), 'ellis': ('alpha',)}
+# Columns of the result table
+COLUMNS = ['file', 'search', 'weighting_curve', 'window', 'alpha', 'margin', 'f_measure', 'cemgil']
+
+
+def configurations(grid):
+    """
+    All configurations of a parameter grid. Parameters not used by the beat search of a configuration are set to
+    None, and configurations that only differ in such parameters are only returned once
+    :param grid: Dictionary from parameter name (see DEFAULTS) to the list of its values
+    :return: List of configurations (dictionaries with a value for every parameter)
+    """
+    unknown = set(grid) - set(DEFAULTS)
+    if unknown:
+        raise ValueError("Unknown parameters " + str(sorted(unknown)) + ", use some of " + str(sorted(DEFAULTS)))
+    configs = []
+    for values in itertools.product(*grid.values()):
+        config = dict(DEFAULTS, **dict(zip(grid.keys(), values)))
+        if config['search'] not in SEARCH_PARAMETERS:
+            raise ValueError("Unknown search " + str(config['search']) + ", use one of " + str(list(SEARCH_PARAMETERS)))
+        for search, parameters in SEARCH_PARAMETERS.items():
+            if search != config['search']:
+                config.update(dict.fromkeys(parameters))
+        if config not in configs:
+            configs.append(config)
+    return configs
+
+
+def stage_key(stage, config):
+    """
+    Memoization key of a stage: The stage and the values of the parameters it depends on
+    """
+    return (stage,) + tuple(config[name] for name in STAGE_PARAMETERS[stage])
+
+
+def sweep_file(file, configs, cache=True):
+    """
+    Evaluate all configurations on one file
+    :param file: Path to the *.wav file
+    :param configs: List of configurations returned by configurations
+    :param cache: Whether the onset strength envelope is taken from the on-disk cache (see FeatureCache)
+    :return: The rows of the result table for this file and the number of computations per stage
+    """
+    Globals.TAU_0 = Functions.find_tempo_period_bias()
+    memo = {}
+    computations = dict.fromkeys(STAGE_PARAMETERS, 0)
+
+    def stage(name, config, compute):
+        key = stage_key(name, config)
+        if key not in memo:
+            memo[key] = compute()
+            computations[name] += 1
+        return memo[key]
+
+    # Correct beat times in seconds
+    filename = os.path.splitext(os.path.basename(file))[0] + ".beats"
+    reference_beats, _ = Evaluation.get_beats_from_file(filename, in_seconds=True)
+
+    rows = []
+    for config in configs:
+        ose = stage('ose', config, lambda: onset_strength_envelope(file, cache))
+        ac = stage('autocorrelation', config,
+                   lambda: Functions.autocorrelate(ose, 3 * Functions.TEMPO_SEARCH_RANGE))
+        tempo = stage('tempo', config, lambda: estimate_tempo(ac, config['weighting_curve']))
+        beats = stage('beats', config, lambda: search(ose, tempo, config))
+        scores = stage('scores', config, lambda: score(reference_beats, beats, config['margin']))
+        rows.append(dict(config, file=file, **scores))
+    return rows, computations
+
+
+def onset_strength_envelope(file, cache):
+    if cache:
+        return FeatureCache.onset_strength_envelope(file, Main.file_onset_strength_envelope)[0]
+    return Main.file_onset_strength_envelope(file)
+
+
+def estimate_tempo(ac, weighting_curve):
+    """
+    Tempo estimation of Functions.estimate_tempo from an already calculated autocorrelation
+    :return: The estimated tempo in OSE frames and whether duple (True) or triple (False) tempo is assumed
+    """
+    weighting = Functions.tempo_weighting_window(ac.size, weighting_curve)
+    _, tau_index, is_duple_tempo = Functions.tempo_from_strengths(*Functions.tempo_period_strengths(ac, weighting))
+    return tau_index, is_duple_tempo
+
+
+def search(ose, tempo, config):
+    """
+    Beat search of a configuration
+    :return: The beat times in seconds
+    """
+    tau_index, is_duple_tempo = tempo
+    if config['search'] == 'ellis':
+        beats, _, _ = Ellis_07_Search.ellis_07_search(ose, tau_index, config['alpha'])
+    else:
+        beats, _ = Main.state_space_search(ose, tau_index, is_duple_tempo, config['window'])
+    return np.array(beats) * FFT_HOP / OSE_SAMPLE_RATE
+
+
+def score(reference_beats, estimated_beats, margin):
+    """
+    Score estimated beats against the correct ones with mir_eval
+    :param margin: Width of the allowed inaccuracy window of the F-measure in ms, centred on the correct beat like
+    Evaluation.MARGIN (a margin of 70 allows deviations of +/- 35ms)
+    :return: Dictionary with the F-measure and the Cemgil score
+    """
+    # mir_eval (and its dependencies) are only needed for scoring
+    import mir_eval
+    reference_beats = mir_eval.beat.trim_beats(np.array(reference_beats))
+    estimated_beats = mir_eval.beat.trim_beats(estimated_beats)
+    # mir_eval's threshold is the largest deviation in seconds, i.e. half the window
+    return {'f_measure': mir_eval.beat.f_measure(reference_beats, estimated_beats, f_measure_threshold=margin / 2000),
+            'cemgil': mir_eval.beat.cemgil(reference_beats, estimated_beats)[0]}
+
+
+def sweep(grid, limit=None, jobs=1, cache=True, output=SWEEP_FILE):
+    """
+    Evaluate a parameter grid on the files in the folder 'BallroomData'. The files are distributed over worker
+    processes, each of which evaluates the whole grid on its files, so no stage is computed twice
+    :param grid: Dictionary from parameter name (see DEFAULTS) to the list of its values
+    :param limit: Optionally limit the number of files
+    :param jobs: Number of worker processes. With 1 job the files are analysed serially in this process
+    :param cache: Whether the onset strength envelopes are taken from the on-disk cache (see FeatureCache)
+    :param output: Optional path of the CSV file the table (one row per file and configuration) is written to
+    :return: The rows of the table
+    """
+    files = Evaluation_mir_eval.find_files(limit)
+    configs = configurations(grid)
+    work = partial(sweep_file, configs=configs, cache=cache)
+    if jobs == 1:
+        results = list(map(work, files))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(work, files))
+
+    rows = [row for file_rows, _ in results for row in file_rows]
+    computations = dict.fromkeys(STAGE_PARAMETERS, 0)
+    for _, file_computations in results:
+        for name, count in file_computations.items():
+            computations[name] += count
+    print(str(len(files)) + " files x " + str(len(configs)) + " configurations, computed stages: "
+          + ", ".join(name + " " + str(count) for name, count in computations.items()))
+
+    if output is not None:
+        with open(output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    print_summary(rows)
+    return rows
+
+
+def print_summary(rows):
+    """
+    Print the mean scores of every configuration, best F-measure first
+    """
+    parameters = COLUMNS[1:-2]
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row[name] for name in parameters), []).append(row)
+    summary = [(values, np.mean([row['f_measure'] for row in group]), np.mean([row['cemgil'] for row in group]))
+               for values, group in groups.items()]
+    summary.sort(key=lambda entry: entry[1], reverse=True)
+    print(" | ".join(parameters) + " | Mean F-measure | Mean Cemgil score")
+    for values, f_measure, cemgil in summary:
+        print(" | ".join("-" if value is None else str(value) for value in values) + " | "
+              + str(round(f_measure, 3)) + " | " + str(round(cemgil, 3)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep parameters of the beat tracker over the Ballroom dataset")
+    parser.add_argument('--search', nargs='+', choices=list(SEARCH_PARAMETERS), help="Beat searches")
+    parser.add_argument('--weighting-curve', nargs='+', type=float,
+                        help="Widths of the tempo weighting in octaves")
+    parser.add_argument('--window', nargs='+', type=int, help="Search windows of the greedy search in frames")
+    parser.add_argument('--alpha', nargs='+', type=float, help="Transition weights of the Ellis-07 search")
+    parser.add_argument('--margin', nargs='+', type=int,
+                        help="Widths of the F-measure tolerance window in ms (+/- half of it)")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of worker processes")
+    parser.add_argument('--limit', type=int, default=None, help="Only analyse the first LIMIT files")
+    parser.add_argument('--output', default=SWEEP_FILE, help="CSV file the table is written to")
+    parser.add_argument('--no-cache', action='store_true', help="Always recompute the onset strength envelopes")
+    args = parser.parse_args()
+    grid = {name: getattr(args, name) for name in DEFAULTS if getattr(args, name) is not None}
+    sweep(grid, limit=args.limit, jobs=args.jobs, cache=not args.no_cache, output=args.output)
+
+
+if __name__ == "__main__":
+    main()
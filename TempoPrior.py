@@ -0,0 +1,247 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import Globals
+
+# Folder with the *.beats annotation files the prior is learned from
+ANNOTATIONS_FOLDER = "BallroomAnnotations-master"
+# Folder with the audio files, organised in one folder per style. The annotation files themselves are not organised
+# by style, so the style of an annotation file is the folder of the audio file with the same name
+AUDIO_FOLDER = "BallroomData"
+# Scalar tempo period bias written by earlier versions, used if neither annotations nor a saved prior are available
+LEGACY_BIAS_FILE = "tempo_period_bias.txt"
+# Tempo histogram with 1 BPM bins from MIN_BPM to MAX_BPM
+MIN_BPM = 30
+MAX_BPM = 300
+# Width of the log-Gaussian kernel that smooths the tempo distribution, in octaves
+BANDWIDTH = 0.1
+# Lags with a weighting below this value (relative to the maximum) are outside the range of a prior
+LAG_THRESHOLD = 1e-3
+# Number of lags over which the lag range of a prior is determined (3 * Functions.TEMPO_SEARCH_RANGE)
+LAG_RANGE_LENGTH = 6000
+
+# Prior of this process and its per-style priors, loaded on first use (see get_prior)
+_prior = None
+_style_priors = {}
+
+
+class TempoPrior:
+    """
+    Tempo distribution of an annotated corpus: The tempo of every annotation file, stored with the modification time
+    of the file so that only new or changed files have to be read again, and a histogram of all tempi
+    """
+
+    def __init__(self, entries, default_bpm=None):
+        """
+        :param entries: Dictionary from annotation file (relative to the annotations folder) to a dictionary with its
+        modification time "mtime" (in ns), its tempo "bpm" and its "style" (None if unknown)
+        :param default_bpm: Mean tempo used if there are no entries (e.g. from LEGACY_BIAS_FILE)
+        """
+        self.entries = entries
+        self.default_bpm = default_bpm
+        # Tempo weighting windows per number of lags
+        self._windows = {}
+
+    def tempos(self):
+        """
+        The tempi of all annotation files in BPM
+        """
+        return np.array([entry['bpm'] for entry in self.entries.values()], dtype=float)
+
+    def mean_bpm(self):
+        """
+        The mean tempo in BPM (the scalar tempo period bias Globals.TAU_0)
+        """
+        if not self.entries:
+            if self.default_bpm is None:
+                raise ValueError("No tempo annotations in " + ANNOTATIONS_FOLDER + " and no saved tempo prior")
+            return self.default_bpm
+        return float(np.mean(self.tempos()))
+
+    def histogram(self):
+        """
+        Histogram of the tempi
+        :return: The number of files per bin and the bin edges in BPM
+        """
+        return np.histogram(np.clip(self.tempos(), MIN_BPM, MAX_BPM), bins=np.arange(MIN_BPM, MAX_BPM + 1))
+
+    def weighting(self, length):
+        """
+        Learned replacement of the log-Gaussian tempo weighting window (Functions.get_tempo_weighting_window):
+        The tempo histogram converted to beat periods in OSE frames and smoothed with a log-Gaussian kernel
+        :param length: The number of lags
+        :return: The (read-only) window for the lags 0 to length - 1, scaled to a maximum of 1 (the value for lag 0 is 0)
+        """
+        if length in self._windows:
+            return self._windows[length]
+        counts, edges = self.histogram()
+        if not counts.any():
+            raise ValueError("No tempo annotations to learn the tempo distribution from")
+        bpm = (edges[:-1] + edges[1:]) / 2
+        periods = 60 / bpm * Globals.OSE_SAMPLE_RATE / Globals.FFT_HOP
+        lags = np.arange(1, length)
+        # Sum of log-Gaussians around the period of every bin, weighted by the number of files in the bin
+        distance = np.log2(lags[:, np.newaxis] / periods[np.newaxis, counts > 0]) / BANDWIDTH
+        window = np.zeros(length)
+        window[1:] = np.exp(-0.5 * distance ** 2) @ counts[counts > 0]
+        window /= window.max()
+        window.setflags(write=False)
+        self._windows[length] = window
+        return window
+
+    def lag_range(self):
+        """
+        Range of beat periods covered by the prior, i.e. the lags whose weighting is at least LAG_THRESHOLD
+        :return: The shortest and the longest lag in OSE frames
+        """
+        lags = np.flatnonzero(self.weighting(LAG_RANGE_LENGTH) >= LAG_THRESHOLD)
+        return int(lags[0]), int(lags[-1])
+
+    def styles(self):
+        """
+        The styles of the annotation files, sorted by name
+        """
+        return sorted({entry['style'] for entry in self.entries.values() if entry.get('style') is not None})
+
+    def for_style(self, style):
+        """
+        The prior of the annotation files of one style
+        :param style: The name of the style (folder in AUDIO_FOLDER)
+        :return: A new TempoPrior
+        :raises ValueError: If there are no annotation files of this style
+        """
+        entries = {key: entry for key, entry in self.entries.items() if entry.get('style') == style}
+        if not entries:
+            raise ValueError("Unknown style " + str(style) + ", use one of " + str(self.styles()))
+        return TempoPrior(entries)
+
+    def to_json(self):
+        counts, edges = self.histogram()
+        return {'entries': self.entries, 'histogram': {'bpm': edges[:-1].tolist(), 'counts': counts.tolist()}}
+
+
+def beats_file_tempo(path):
+    """
+    Reads a *.beats file, counts the beats and extracts the tempo
+    :param path: Path to the *.beats file
+    :return: The BPM measure of the file
+    """
+    with open(path) as f:
+        lines = f.read().splitlines()
+    # Get the time of the last beat (the second column holds the beat number)
+    last_beat = float(lines[-1].split()[0])
+    # Tempo will be the number of beats, i.e. number of lines divided by the time of the last beat
+    return 60 * len(lines) / last_beat
+
+
+def get_prior(style=None):
+    """
+    The tempo prior of this process. It is loaded (and updated with new or changed annotation files) on the first
+    call only, later calls return the same object
+    :param style: If given, the prior of the annotation files of this style
+    """
+    global _prior
+    if _prior is None:
+        _prior = update()
+    if style is None:
+        return _prior
+    if style not in _style_priors:
+        _style_priors[style] = _prior.for_style(style)
+    return _style_priors[style]
+
+
+def style_priors():
+    """
+    The priors of all styles
+    :return: Dictionary from style to its prior
+    """
+    return {style: get_prior(style) for style in get_prior().styles()}
+
+
+def audio_styles(folder=AUDIO_FOLDER):
+    """
+    Styles of the audio files, taken from the folders they are in
+    :param folder: Folder with one sub-folder per style
+    :return: Dictionary from file name (without extension) to style, empty if the folder does not exist
+    """
+    styles = {}
+    for root, _, files in os.walk(folder):
+        if root == folder:
+            continue
+        for name in files:
+            styles[os.path.splitext(name)[0]] = os.path.basename(root)
+    return styles
+
+
+def update(folder=ANNOTATIONS_FOLDER, path=None):
+    """
+    Load the saved tempo prior and update it incrementally: Only annotation files that are new or whose modification
+    time changed are read, entries of deleted files are removed. The prior is saved again if it changed
+    :param folder: Folder with the *.beats files. If it does not exist, the saved prior is used as it is
+    :param path: The JSON file of the prior, defaults to Globals.TEMPO_PRIOR_FILE
+    :return: The updated prior, which also becomes the prior of this process
+    """
+    global _prior
+    if path is None:
+        path = Globals.TEMPO_PRIOR_FILE
+    saved = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            saved = json.load(f)['entries']
+
+    if os.path.isdir(folder):
+        entries = {}
+        for root, _, files in os.walk(folder):
+            for name in files:
+                if not name.endswith(".beats"):
+                    continue
+                file = os.path.join(root, name)
+                key = os.path.relpath(file, folder).replace(os.sep, '/')
+                mtime = os.stat(file).st_mtime_ns
+                if key in saved and saved[key]['mtime'] == mtime:
+                    entries[key] = dict(saved[key])
+                else:
+                    entries[key] = {'mtime': mtime, 'bpm': beats_file_tempo(file)}
+        # Annotation files in sub-folders are labelled with their folder, the others with the style of their audio
+        styles = audio_styles()
+        for key, entry in entries.items():
+            stem = os.path.splitext(os.path.basename(key))[0]
+            entry['style'] = key.split('/')[0] if '/' in key else styles.get(stem, entry.get('style'))
+    else:
+        entries = saved
+
+    prior = TempoPrior(entries, legacy_bias())
+    if entries != saved:
+        save(prior, path)
+    _prior = prior
+    _style_priors.clear()
+    return prior
+
+
+def legacy_bias():
+    """
+    The mean tempo saved in LEGACY_BIAS_FILE, or None if there is none
+    """
+    if not os.path.exists(LEGACY_BIAS_FILE) or os.stat(LEGACY_BIAS_FILE).st_size == 0:
+        return None
+    with open(LEGACY_BIAS_FILE) as f:
+        return float(f.read())
+
+
+def save(prior, path):
+    """
+    Save a tempo prior. It is written to a temporary file that is renamed afterwards, so that concurrent processes
+    never read a partial file
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(prior.to_json(), f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
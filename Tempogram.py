@@ -0,0 +1,91 @@
+import numpy as np
+from scipy.fft import next_fast_len
+
+import Functions
+import Profiling
+from Globals import OSE_SAMPLE_RATE, FFT_HOP
+
+# Length of the analysis windows in seconds (at least four beats at 40 BPM)
+WINDOW = 6
+# Hop between two analysis windows in seconds
+HOP = 0.1
+# Longest beat period in seconds the local tempo can have (40 BPM)
+MAX_PERIOD = 1.5
+# Length of the median filter over the windows that removes single outliers (e.g. octave errors) from the tempo curve
+SMOOTHING = 5
+# Number of windows transformed at once (bounds the memory of the batched FFT)
+BATCH_SIZE = 256
+
+
+def seconds_to_frames(seconds):
+    return int(round(seconds * OSE_SAMPLE_RATE / FFT_HOP))
+
+
+def local_autocorrelations(ose, window, hop, max_lag, batch_size=BATCH_SIZE):
+    """
+    Autocorrelations of sliding windows of the onset strength envelope. The windows are strided views of the
+    envelope, and all windows of a batch are transformed with one FFT along the last axis instead of calling
+    Functions.autocorrelate once per window
+    :param ose: The onset strength envelope (at least window frames long)
+    :param window: Length of the windows in frames
+    :param hop: Hop between two windows in frames
+    :param max_lag: The number of lags to calculate
+    :param batch_size: Number of windows transformed at once
+    :return: Array of shape (number of windows, max_lag), row k holds the autocorrelation of ose[k * hop:][:window]
+    """
+    frames = np.lib.stride_tricks.sliding_window_view(ose, window)[::hop]
+    n_fft = next_fast_len(window + max_lag)
+    ac = np.empty((frames.shape[0], max_lag))
+    for start in range(0, frames.shape[0], batch_size):
+        spectrum = np.fft.rfft(frames[start:start + batch_size], n=n_fft, axis=1)
+        ac[start:start + batch_size] = np.fft.irfft(np.abs(spectrum) ** 2, n=n_fft, axis=1)[:, :max_lag]
+    return ac
+
+
+@Profiling.profiled('tempogram')
+def tempogram(ose, prior=None, window=WINDOW, hop=HOP, max_period=MAX_PERIOD):
+    """
+    Weighted autocorrelation (the tempo period strengths of Functions.tempo_period_strengths) of sliding windows of
+    the onset strength envelope
+    :param ose: The onset strength envelope
+    :param prior: Optional TempoPrior used instead of the global tempo weighting
+    :param window: Length of the windows in seconds (shortened to the envelope if it is shorter)
+    :param hop: Hop between two windows in seconds
+    :param max_period: Longest beat period in seconds
+    :return: Array of shape (number of windows, lags), entry [k, lag] is the strength of a beat period of lag frames
+    in window k (which starts at frame k * hop), and the window and hop in frames
+    """
+    window = max(2, min(seconds_to_frames(window), ose.size))
+    hop = max(1, seconds_to_frames(hop))
+    max_lag = min(seconds_to_frames(max_period) + 1, window)
+    with Profiling.span('autocorrelation'):
+        ac = local_autocorrelations(np.asarray(ose, dtype=float), window, hop, max_lag)
+    weighting = prior.weighting(max_lag) if prior is not None else Functions.tempo_weighting_window(max_lag)
+    return ac * weighting, window, hop
+
+
+def tempo_curve(ose, prior=None, window=WINDOW, hop=HOP, max_period=MAX_PERIOD, smoothing=SMOOTHING):
+    """
+    Local tempo of every frame of the onset strength envelope, for pieces whose tempo changes. The strongest beat
+    period of every window of the tempogram is median-filtered over smoothing windows, and every frame takes the
+    tempo of the window centred closest to it, so the curve is constant for hop seconds at a time.
+    The curve can be passed as tau_index to Main.state_space_search and Ellis_07_Search.ellis_07_search
+    :param ose: The onset strength envelope
+    :param prior: Optional TempoPrior used instead of the global tempo weighting
+    :param window: Length of the windows in seconds
+    :param hop: Hop between two windows in seconds
+    :param max_period: Longest beat period in seconds
+    :param smoothing: Length of the median filter in windows (1 disables the filter)
+    :return: Integer array with the tempo of every frame of the envelope, in the convention of the tau_index of
+    Functions.estimate_tempo (the index of the strongest lag in the tempo period strengths, i.e. the lag - 1, at
+    least 1)
+    """
+    strengths, window, hop = tempogram(ose, prior, window, hop, max_period)
+    # Entry i of strengths[:, 1:] is the lag i + 1, like TPS in Functions.tempo_period_strengths (lag 0 has weight 0)
+    periods = np.maximum(np.argmax(strengths[:, 1:], axis=1), 1)
+    if smoothing > 1 and periods.size > 1:
+        # scipy.ndimage is only needed here, so it does not add to the import time of Main
+        from scipy.ndimage import median_filter
+        periods = median_filter(periods, smoothing, mode='nearest')
+    nearest = np.round((np.arange(ose.size) - window / 2) / hop).astype(int)
+    return periods[np.clip(nearest, 0, periods.size - 1)]
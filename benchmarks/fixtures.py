@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+import soundfile
+
+# Sample rate of the generated fixtures
+SAMPLE_RATE = 22050
+# Folder the fixtures are written to (they are deterministic, so existing files are reused)
+FIXTURE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# Time of the first beat in seconds
+OFFSET = 0.5
+
+
+def beat_times(bpm, metre, seconds):
+    """
+    Ground truth of a fixture
+    :return: Beat times and downbeat times in seconds
+    """
+    beats = np.arange(OFFSET, seconds, 60 / bpm)
+    downbeats = beats[::metre]
+    return beats, downbeats
+
+
+def click(frequency, length, sr):
+    """
+    Exponentially decaying sine click
+    """
+    t = np.arange(int(length * sr)) / sr
+    return np.sin(2 * np.pi * frequency * t) * np.exp(-t * 60)
+
+
+def click_track(bpm, metre, seconds, sr=SAMPLE_RATE):
+    """
+    Metronome: A high click on every downbeat and a lower click on all other beats
+    """
+    sig = np.zeros(int(seconds * sr))
+    beats, _ = beat_times(bpm, metre, seconds)
+    accent = click(1760, 0.05, sr)
+    normal = click(880, 0.05, sr)
+    for i, beat in enumerate(beats):
+        sound = accent if i % metre == 0 else normal
+        start = int(beat * sr)
+        end = min(start + sound.size, sig.size)
+        sig[start:end] += sound[:end - start]
+    return 0.5 * sig
+
+
+def drum_loop(bpm, metre, seconds, sr=SAMPLE_RATE, seed=0):
+    """
+    Simple drum pattern: Kick on the downbeat (and on beat 3 in 4/4), snare on the other beats and hi-hats on every
+    eighth note, with a fixed noise seed so the file is reproducible
+    """
+    rng = np.random.default_rng(seed)
+    sig = np.zeros(int(seconds * sr))
+    t = np.arange(int(0.2 * sr)) / sr
+    kick = np.sin(2 * np.pi * (50 + 100 * np.exp(-t * 30)) * t) * np.exp(-t * 20)
+    snare = rng.normal(0, 0.5, t.size) * np.exp(-t * 35)
+    hat = np.diff(rng.normal(0, 0.3, int(0.03 * sr) + 1)) * np.exp(-np.arange(int(0.03 * sr)) / sr * 150)
+
+    beats, _ = beat_times(bpm, metre, seconds)
+    half = 30 / bpm
+    for i, beat in enumerate(beats):
+        position = i % metre
+        sounds = [(beat, hat), (beat + half, hat)]
+        if position == 0 or (metre == 4 and position == 2):
+            sounds.append((beat, kick))
+        else:
+            sounds.append((beat, snare))
+        for time, sound in sounds:
+            start = int(time * sr)
+            end = min(start + sound.size, sig.size)
+            if start < sig.size:
+                sig[start:end] += sound[:end - start]
+    return 0.5 * sig / max(1, np.max(np.abs(sig)))
+
+
+GENERATORS = {'click': click_track, 'drums': drum_loop}
+
+
+def fixture(kind, bpm, metre, seconds):
+    """
+    Path of a fixture WAV file, generated on first use
+    :param kind: "click" or "drums"
+    :param bpm: Tempo in BPM
+    :param metre: Beats per bar (3 or 4)
+    :param seconds: Duration in seconds
+    :return: The path
+    """
+    os.makedirs(FIXTURE_FOLDER, exist_ok=True)
+    path = os.path.join(FIXTURE_FOLDER, kind + "_" + str(bpm) + "bpm_" + str(metre) + "-4_" + str(seconds) + "s.wav")
+    if not os.path.exists(path):
+        sig = GENERATORS[kind](bpm, metre, seconds)
+        # Write to a temporary name first so that an interrupted run never leaves a truncated fixture
+        soundfile.write(path + ".tmp", sig, SAMPLE_RATE, subtype='PCM_16', format='WAV')
+        os.replace(path + ".tmp", path)
+    return path
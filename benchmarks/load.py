@@ -0,0 +1,152 @@
+"""
+Load generator for the beat tracking service (Service.py). Run from the repository root, e.g.:
+    python -m benchmarks.load --start --requests 200 --concurrency 16
+    python -m benchmarks.load --port 8765 --upload
+With --start the service is started on localhost for the run (with the fixture folder as --root, a service
+started separately needs "--root benchmarks/fixtures" unless --upload is used). The requests use the synthetic
+fixtures, and the report contains the throughput and the p50/p99 latency of the accepted requests
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from benchmarks import fixtures
+
+# Fixtures the requests cycle through (kind, bpm, metre, seconds)
+FIXTURES = [('drums', 90, 4, 30), ('click', 120, 4, 30), ('drums', 160, 3, 30), ('click', 200, 4, 30)]
+# Seconds to wait for a service started with --start
+STARTUP_TIMEOUT = 120
+
+
+async def request(host, port, unix, method, target, body=b'', content_type='application/json'):
+    """
+    Send one HTTP request
+    :return: The status code and the decoded JSON response
+    """
+    if unix is not None:
+        reader, writer = await asyncio.open_unix_connection(unix)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write((method + " " + target + " HTTP/1.1\r\nHost: " + host + "\r\n"
+                      + "Content-Type: " + content_type + "\r\n"
+                      + "Content-Length: " + str(len(body)) + "\r\nConnection: close\r\n\r\n").encode() + body)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+        return status, json.loads(await reader.readexactly(length))
+    finally:
+        writer.close()
+
+
+async def wait_until_ready(host, port, unix, timeout=STARTUP_TIMEOUT):
+    start = time.perf_counter()
+    while True:
+        try:
+            status, _ = await request(host, port, unix, 'GET', '/health')
+            if status == 200:
+                return
+        except OSError:
+            pass
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError("The service did not start within " + str(timeout) + "s")
+        await asyncio.sleep(0.5)
+
+
+async def generate_load(host, port, unix, requests, concurrency, upload):
+    """
+    Send requests with a fixed number of concurrent clients
+    :param upload: If true, the audio files are sent as request body instead of their paths
+    :return: List of (status, latency in seconds, seconds of audio) tuples and the total time in seconds
+    """
+    paths = [fixtures.fixture(*fixture) for fixture in FIXTURES]
+    cases = itertools.islice(itertools.cycle(zip(paths, FIXTURES)), requests)
+    results = []
+
+    async def client():
+        for path, fixture in cases:
+            if upload:
+                with open(path, 'rb') as f:
+                    body = f.read()
+                content_type = 'audio/wav'
+            else:
+                body = json.dumps({'path': os.path.abspath(path)}).encode()
+                content_type = 'application/json'
+            start = time.perf_counter()
+            try:
+                status, _ = await request(host, port, unix, 'POST', '/track', body, content_type)
+            except OSError:
+                status = None
+            results.append((status, time.perf_counter() - start, fixture[3]))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return results, time.perf_counter() - start
+
+
+def report(results, elapsed):
+    """
+    Print the throughput and latency of a load test
+    """
+    accepted = [(latency, seconds) for status, latency, seconds in results if status == 200]
+    rejected = sum(1 for status, _, _ in results if status == 503)
+    failed = len(results) - len(accepted) - rejected
+    print("Requests: " + str(len(results)) + " (" + str(len(accepted)) + " tracked, " + str(rejected)
+          + " rejected with 503, " + str(failed) + " failed) in " + str(round(elapsed, 2)) + "s")
+    if not accepted:
+        return
+    latencies = np.array([latency for latency, _ in accepted]) * 1000
+    print("Throughput: " + str(round(len(accepted) / elapsed, 2)) + " requests/s, "
+          + str(round(sum(seconds for _, seconds in accepted) / elapsed, 1)) + " audio seconds/s")
+    print("Latency: p50 " + str(round(np.percentile(latencies, 50), 1)) + "ms, p99 "
+          + str(round(np.percentile(latencies, 99), 1)) + "ms, max " + str(round(latencies.max(), 1)) + "ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the beat tracking service")
+    parser.add_argument('--host', default='127.0.0.1', help="Host name of the service")
+    parser.add_argument('--port', type=int, default=8765, help="TCP port of the service")
+    parser.add_argument('--unix', default=None, help="Unix socket of the service (instead of the TCP port)")
+    parser.add_argument('--start', action='store_true', help="Start the service for the duration of the test")
+    parser.add_argument('--workers', type=int, default=None, help="Number of workers of a service started here")
+    parser.add_argument('--requests', type=int, default=100, help="Total number of requests")
+    parser.add_argument('--concurrency', type=int, default=8, help="Number of concurrent clients")
+    parser.add_argument('--upload', action='store_true', help="Send the audio instead of the file path")
+    args = parser.parse_args()
+
+    service = None
+    if args.start:
+        command = [sys.executable, 'Service.py']
+        command += ['--unix', args.unix] if args.unix is not None else ['--host', args.host, '--port', str(args.port)]
+        if args.workers is not None:
+            command += ['--workers', str(args.workers)]
+        # Requests name the fixture files, which the service only reads below its root folder
+        command += ['--root', fixtures.FIXTURE_FOLDER]
+        service = subprocess.Popen(command)
+    try:
+        asyncio.run(wait_until_ready(args.host, args.port, args.unix))
+        results, elapsed = asyncio.run(generate_load(args.host, args.port, args.unix, args.requests,
+                                                     args.concurrency, args.upload))
+        report(results, elapsed)
+    finally:
+        if service is not None:
+            service.terminate()
+            service.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Reproducible benchmark suite on synthetic fixtures with known ground truth.
+Run from the repository root:
+    python -m benchmarks.suite run --output results.json [--full]
+    python -m benchmarks.suite compare baseline.json results.json [--threshold 0.1]
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+import Audio
+import Ellis_07_Search
+import Evaluation
+import Functions
+import Globals
+import Main
+from Globals import OSE_SAMPLE_RATE, FFT_HOP
+from benchmarks import fixtures
+
+# Tempo and metre grid (at 30 seconds)
+TEMPI = [60, 90, 120, 160, 200]
+METRES = [3, 4]
+# Durations at 120 BPM in 4/4: Quick run and full run (10s up to 30min)
+QUICK_DURATIONS = [10, 30]
+FULL_DURATIONS = [10, 30, 300, 1800]
+# Number of repetitions per measurement, the fastest one is reported
+REPEATS = 3
+# Relative throughput drop that counts as regression
+THRESHOLD = 0.1
+
+
+def cases(full=False):
+    """
+    The benchmark cases as (kind, bpm, metre, seconds) tuples
+    """
+    result = [(kind, bpm, metre, 30) for kind in fixtures.GENERATORS for bpm in TEMPI for metre in METRES]
+    for seconds in (FULL_DURATIONS if full else QUICK_DURATIONS):
+        if seconds != 30:
+            result.append(('drums', 120, 4, seconds))
+    return result
+
+
+def timed(function, *args, repeats=REPEATS):
+    """
+    Call a function several times
+    :return: The result of the last call and the fastest time in seconds
+    """
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def f_measure(reference, estimated):
+    """
+    F-measure with the +/- 35ms tolerance of Evaluation.evaluate_file
+    """
+    TP, FP, FN = Evaluation.match_beats(estimated, reference, Evaluation.MARGIN * 0.001 / 2)
+    return Evaluation.f_measure_from_counts(TP, FP, FN)
+
+
+def run_case(kind, bpm, metre, seconds):
+    """
+    Time every pipeline stage on one fixture independently and score the results against the ground truth
+    :return: Dictionary with the time and throughput (seconds of audio per second) per stage and the accuracy
+    """
+    path = fixtures.fixture(kind, bpm, metre, seconds)
+    # Long inputs are only timed once
+    repeats = REPEATS if seconds <= 60 else 1
+    sig, sr = Audio.load(path)
+
+    ose, ose_time = timed(Main.calculate_onset_strength_envelope, sig, sr, repeats=repeats)
+    (tactus, tau_index, is_duple_tempo), tempo_time = timed(Functions.estimate_tempo, ose, repeats=repeats)
+    _, search_time = timed(Main.state_space_search, ose, tau_index, is_duple_tempo, repeats=repeats)
+    ellis, ellis_time = timed(Ellis_07_Search.ellis_07_search, ose, tau_index, repeats=repeats)
+    (beats, downbeats), tracker_time = timed(Main.beatTracker, path, repeats=repeats)
+
+    times = {'beatTracker': tracker_time, 'calculate_onset_strength_envelope': ose_time,
+             'estimate_tempo': tempo_time, 'state_space_search': search_time, 'ellis_07_search': ellis_time}
+    reference_beats, reference_downbeats = fixtures.beat_times(bpm, metre, seconds)
+    ellis_beats = np.array(ellis[0]) * FFT_HOP / OSE_SAMPLE_RATE
+    return {
+        'stages': {name: {'time': t, 'throughput': seconds / t} for name, t in times.items()},
+        'accuracy': {
+            'f_measure': f_measure(reference_beats, beats),
+            'f_measure_downbeats': f_measure(reference_downbeats, downbeats),
+            'f_measure_ellis': f_measure(reference_beats, ellis_beats),
+            # Estimated beat period relative to the true one (1 is correct, 0.5 or 2 are octave errors)
+            'tempo_ratio': tactus / (60 / bpm),
+            'metre_correct': bool(is_duple_tempo == (metre == 4)),
+        },
+    }
+
+
+def run(output, full=False):
+    """
+    Run all cases and save the results as JSON
+    :param output: Path of the JSON file
+    :param full: Whether the long durations (up to 30 minutes) are included
+    """
+    Globals.TAU_0 = Functions.find_tempo_period_bias()
+    results = {}
+    for kind, bpm, metre, seconds in cases(full):
+        name = kind + "_" + str(bpm) + "bpm_" + str(metre) + "-4_" + str(seconds) + "s"
+        results[name] = run_case(kind, bpm, metre, seconds)
+        accuracy = results[name]['accuracy']
+        print(name + ": beatTracker " + str(round(results[name]['stages']['beatTracker']['throughput'], 1))
+              + "x realtime, F-measure " + str(round(accuracy['f_measure'], 2)) + ", downbeats "
+              + str(round(accuracy['f_measure_downbeats'], 2)))
+    environment = {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                   'backend': Globals.BACKEND}
+    with open(output, 'w') as f:
+        json.dump({'environment': environment, 'results': results}, f, indent=1)
+
+
+def compare(baseline, current, threshold=THRESHOLD):
+    """
+    Compare two result files and flag throughput regressions
+    :param baseline: Path of the baseline JSON file
+    :param current: Path of the JSON file to check
+    :param threshold: Relative throughput drop that counts as regression
+    :return: List of regressions as (case, stage, relative change) tuples
+    """
+    with open(baseline) as f:
+        old = json.load(f)['results']
+    with open(current) as f:
+        new = json.load(f)['results']
+    regressions = []
+    print("Case | Stage | Baseline (x realtime) | Current (x realtime) | Change")
+    for case in sorted(set(old) & set(new)):
+        for stage in sorted(set(old[case]['stages']) & set(new[case]['stages'])):
+            before = old[case]['stages'][stage]['throughput']
+            after = new[case]['stages'][stage]['throughput']
+            change = after / before - 1
+            flag = ""
+            if change < -threshold:
+                regressions.append((case, stage, change))
+                flag = " REGRESSION"
+            print(case + " | " + stage + " | " + str(round(before, 1)) + " | " + str(round(after, 1)) + " | "
+                  + str(round(change * 100, 1)) + "%" + flag)
+    print(str(len(regressions)) + " regressions beyond " + str(round(threshold * 100)) + "%")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite on synthetic click tracks and drum loops")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help="Run the benchmarks")
+    run_parser.add_argument('--output', default="benchmark_results.json", help="JSON file for the results")
+    run_parser.add_argument('--full', action='store_true', help="Include durations up to 30 minutes")
+    compare_parser = commands.add_parser('compare', help="Flag throughput regressions between two runs")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                                help="Relative throughput drop that counts as regression")
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args.output, args.full)
+    else:
+        sys.exit(1 if compare(args.baseline, args.current, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()